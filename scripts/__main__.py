@@ -0,0 +1,196 @@
+import sys
+import time
+from pathlib import Path
+
+# nothing heavy is imported at module level: pandas, matplotlib and selenium are loaded by the
+# command that needs them, so usage and help print without touching any of them
+SCRIPTS_DIR = Path(__file__).resolve().parent
+for subdir in ('collection', 'simulation', 'analysis', 'visualization'):
+    sys.path.insert(0, str(SCRIPTS_DIR / subdir))
+
+COMMANDS = {
+    'collect': ("[--cdp] --trial XXX [...]",
+                "collect a trial from Chrome; options as auto_collect.py, or cdp_collect.py with --cdp"),
+    'process': ("XXX [YYY ...] | --all [--step SECONDS] [--trace FILE]",
+                "build unified timelines from raw trials (process_trial.py)"),
+    'metrics': ("[--workers N] [--shard-size N]",
+                "write data/processed/metrics_summary.csv (calculate_metrics.py)"),
+    'validate': ("[--workers N] [--shard-size N] [--report FILE]",
+                 "check every processed timeline, report to data/processed/validation_report.json (validate_data.py)"),
+    'stats': ("[--resamples N] [--confidence C] [--target FRACTION] [--width METRIC=W] [--timeline]",
+              "bootstrap CIs per metric and trials needed for a target width (metric_stats.py)"),
+    'plot': ("[--workers N] [--force]",
+             "timeline figures, comparison dashboard and cross-trial bands"),
+    'scenarios': ("run SPEC.json [--by DIM,...] [--workers N] [--dry-run] | report [SPEC.json] [--by DIM,...]",
+                  "collect the missing cells of a scenario grid, then metrics and figures grouped by scenario"),
+    'all': ("[--step SECONDS] [--trace FILE] [--workers N] [--no-plots]",
+            "process -> validate -> metrics -> latency -> plots in one process, sharing loaded data"),
+}
+
+def usage():
+    print("Usage: python -m scripts COMMAND [options]")
+    print()
+    for name, (args, text) in COMMANDS.items():
+        print(f"  {name:<9} {text}")
+    print()
+    print("python -m scripts COMMAND --help shows a command's options")
+
+def command_usage(name):
+    args, text = COMMANDS[name]
+    print(f"Usage: python -m scripts {name} {args}".rstrip())
+    print(f"  {text}")
+
+def forward(module, args):
+    # the existing scripts parse sys.argv themselves
+    sys.argv = [f'{module.__name__}.py'] + args
+    module.main()
+
+def run_collect(args):
+    if '--cdp' in args:
+        import cdp_collect
+        forward(cdp_collect, [a for a in args if a != '--cdp'])
+    else:
+        import auto_collect
+        forward(auto_collect, args)
+
+def run_process(args):
+    import process_trial
+    forward(process_trial, args)
+
+def run_metrics(args):
+    import calculate_metrics
+    forward(calculate_metrics, args)
+
+def run_validate(args):
+    import validate_data
+    forward(validate_data, args)
+
+def run_stats(args):
+    import metric_stats
+    forward(metric_stats, args)
+
+def run_scenarios(args):
+    # scenarios.py sits next to pipeline.py, which it imports
+    sys.path.insert(0, str(SCRIPTS_DIR))
+    import scenarios
+    forward(scenarios, args)
+
+def parse_options(args):
+    options = {'step': None, 'trace': None, 'workers': 1, 'force': False, 'plots': True}
+    i = 0
+    while i < len(args):
+        if args[i] == '--step':
+            options['step'] = float(args[i + 1])
+            i += 2
+        elif args[i] == '--trace':
+            options['trace'] = args[i + 1]
+            i += 2
+        elif args[i] == '--workers':
+            options['workers'] = int(args[i + 1])
+            i += 2
+        elif args[i] == '--force':
+            options['force'] = True
+            i += 1
+        elif args[i] == '--no-plots':
+            options['plots'] = False
+            i += 1
+        else:
+            i += 1
+    return options
+
+def render_all(trial_nums, workers, force=False, timeline=None, summary=None):
+    import matplotlib
+    matplotlib.use('Agg')
+    from batch_render import FIGURES_DIR, render_timelines
+    from plot_comparison import plot_metrics_comparison, plot_bitrate_overlay
+    from plot_bands import plot_bands
+
+    FIGURES_DIR.mkdir(exist_ok=True)
+    rendered, skipped = render_timelines(trial_nums, workers, force=force, timeline=timeline)
+    plot_metrics_comparison(summary)
+    plot_bitrate_overlay(timeline)
+    plot_bands(trial_nums, timeline=timeline)
+    return len(rendered), skipped
+
+def run_plot(args):
+    from trial_store import list_trials
+    options = parse_options(args)
+    rendered, skipped = render_all(list_trials('processed'), options['workers'], options['force'])
+    print(f"Rendered {rendered} timelines ({skipped} unchanged) and the comparison figures")
+
+def timed(name, work):
+    start = time.monotonic()
+    result = work()
+    print(f"{name}: {time.monotonic() - start:.1f}s")
+    return result
+
+def run_all(args):
+    options = parse_options(args)
+    from network_trace import load_trace
+    from trial_store import list_trials, source_path
+    from process_trial import GRID_STEP, load_raw_trials, load_segments, process_trials, write_unified_timelines
+    from calculate_metrics import METRIC_COLUMNS, metrics_for_timeline, write_summary
+    from validate_data import validate_timeline
+    import adaptation_latency
+
+    trial_nums = [t for t in list_trials('quality') if source_path(t, 'quality').exists()]
+    if not trial_nums:
+        print("No trials found in data/raw")
+        sys.exit(1)
+    trace = load_trace(options['trace']) if options['trace'] else None
+    step = options['step'] or GRID_STEP
+
+    # raw events are read once and shared by processing and the latency analysis; the timeline stays
+    # in memory for metrics, validation and plots, the CSVs and store tables are only written out
+    quality, buffer, shaping = timed('load', lambda: load_raw_trials(trial_nums))
+    segments = load_segments(trial_nums)
+    timeline = timed('process', lambda: process_trials(trial_nums, step, trace, quality=quality, buffer=buffer,
+                                                       shaping=shaping, segments=segments))
+    timed('write', lambda: write_unified_timelines(timeline))
+
+    # trials that fail validation are quarantined: reported, and left out of everything after this point
+    quarantined = set(timed('validate', lambda: validate_timeline(timeline, buffer, shaping))['quarantined'])
+    if quarantined:
+        trial_nums = [t for t in trial_nums if t not in quarantined]
+        timeline = timeline[~timeline['trial'].isin(quarantined)]
+        timeline = timeline.assign(trial=timeline['trial'].cat.remove_unused_categories())
+        quality, buffer, shaping = [events[events['trial'].isin(trial_nums)] for events in (quality, buffer, shaping)]
+
+    summary = timed('metrics', lambda: metrics_for_timeline(timeline[['trial'] + METRIC_COLUMNS]))
+    write_summary(summary)
+
+    latency = timed('latency', lambda: adaptation_latency.compute_latency(trial_nums, quality, buffer, shaping, trace))
+    latency.to_csv(adaptation_latency.OUTPUT_FILE, index=False, float_format='%.6g')
+
+    if options['plots']:
+        timed('plots', lambda: render_all(trial_nums, options['workers'], options['force'], timeline, summary))
+
+RUNNERS = {
+    'collect': run_collect,
+    'process': run_process,
+    'metrics': run_metrics,
+    'validate': run_validate,
+    'stats': run_stats,
+    'plot': run_plot,
+    'scenarios': run_scenarios,
+    'all': run_all,
+}
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] in ('-h', '--help'):
+        usage()
+        sys.exit(0 if len(sys.argv) >= 2 else 1)
+
+    name = sys.argv[1]
+    args = sys.argv[2:]
+    if name not in RUNNERS:
+        print(f"Error: unknown command {name}")
+        usage()
+        sys.exit(1)
+    if '-h' in args or '--help' in args:
+        command_usage(name)
+        sys.exit(0)
+    RUNNERS[name](args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import sys
+import numpy as np
+import pandas as pd
+from process_trial import load_raw_trials, shaping_steps
+from network_trace import default_trace, load_trace
+from trial_store import PROC_DIR, list_trials
+
+OUTPUT_FILE = PROC_DIR / 'adaptation_latency.csv'
+# a new quality level counts as steady once the player holds it this long
+STEADY_SECONDS = 10.0
+
+def transitions_for(trial_nums, quality, buffer, shaping, trace=None):
+    # every bandwidth change after the first step is a transition; its window runs to the next change or trial end
+    steps = shaping_steps(trial_nums, shaping, trace or default_trace())
+    steps = steps.rename(columns={'time_seconds': 't0', 'bandwidth_kbps': 'to_kbps'})
+    steps['from_kbps'] = steps.groupby('trial')['to_kbps'].shift()
+    steps['t1'] = steps.groupby('trial')['t0'].shift(-1)
+
+    ends = pd.concat([quality[['trial', 'time_seconds']], buffer[['trial', 'time_seconds']]])
+    ends = ends.groupby('trial')['time_seconds'].max()
+    steps['t1'] = steps['t1'].fillna(steps['trial'].map(ends))
+
+    transitions = steps[steps['from_kbps'].notna()].copy()
+    transitions['transition'] = transitions.groupby('trial').cumcount() + 1
+    transitions['direction'] = np.where(transitions['to_kbps'] < transitions['from_kbps'], 'drop', 'recovery')
+    return transitions[['trial', 'transition', 't0', 't1', 'direction', 'from_kbps', 'to_kbps']].reset_index(drop=True)
+
+def assign_windows(events, transitions):
+    # tag each event with the transition window it falls in (latest t0 at or before it, same trial)
+    events = events.rename(columns={'time_seconds': 't'}).sort_values('t', kind='stable')
+    windows = transitions[['trial', 't0', 't1', 'pair']].sort_values('t0', kind='stable')
+    tagged = pd.merge_asof(events, windows, left_on='t', right_on='t0', by='trial', direction='backward')
+    return tagged[tagged['pair'].notna() & (tagged['t'] < tagged['t1'])].astype({'pair': np.int64})
+
+def compute_latency(trial_nums, quality, buffer, shaping, trace=None, steady_seconds=STEADY_SECONDS):
+    # merge_asof needs matching key dtypes on both sides
+    quality, buffer, shaping = [
+        events.assign(trial=events['trial'].astype(str), time_seconds=events['time_seconds'].astype(float))
+        for events in (quality, buffer, shaping)
+    ]
+    quality['bitrate_kbps'] = quality['bitrate_kbps'].astype(float)
+    quality['resolution_height'] = quality['resolution_height'].astype(float)
+    buffer['buffer_seconds'] = buffer['buffer_seconds'].astype(float)
+
+    transitions = transitions_for(trial_nums, quality, buffer, shaping, trace)
+    transitions['trial'] = transitions['trial'].astype(str)
+    transitions['pair'] = np.arange(len(transitions))
+    if transitions.empty:
+        return transitions
+
+    # rendition in effect when the bandwidth changed
+    before = pd.merge_asof(transitions[['trial', 't0', 'pair']].sort_values('t0'),
+                           quality.rename(columns={'time_seconds': 't0'}).sort_values('t0')[['trial', 't0', 'resolution_height', 'bitrate_kbps']],
+                           on='t0', by='trial', direction='backward').set_index('pair').reindex(transitions['pair'])
+    transitions['height_before'] = before['resolution_height'].to_numpy()
+    transitions['bitrate_before_kbps'] = before['bitrate_kbps'].to_numpy()
+
+    # a switch is a rendition change; the measured bitrate also drifts within a rendition, which is not a decision
+    quality = quality.sort_values(['trial', 'time_seconds'], kind='stable')
+    switched = quality['resolution_height'].ne(quality.groupby('trial')['resolution_height'].shift())
+    switches = assign_windows(quality[switched], transitions)
+    switches = switches[switches['t'] > switches['t0']]
+
+    # first switch in the direction the bandwidth moved
+    pairs = switches['pair'].to_numpy()
+    base = transitions['height_before'].to_numpy()[pairs]
+    down = (transitions['direction'].to_numpy() == 'drop')[pairs]
+    reacting = switches[np.where(down, switches['resolution_height'] < base, switches['resolution_height'] > base)]
+    first = reacting.groupby('pair').first().reindex(transitions['pair'])
+    transitions['first_switch_seconds'] = (first['t'] - first['t0']).to_numpy()
+    transitions['first_switch_height'] = first['resolution_height'].to_numpy()
+
+    # steady state: the last switch of the window, provided its rendition then holds for steady_seconds;
+    # a player still switching close to the next change never settled
+    last = switches.groupby('pair').last()
+    steady = last[(last['t1'] - last['t']) >= steady_seconds].reindex(transitions['pair'])
+    transitions['steady_state_seconds'] = (steady['t'] - steady['t0']).to_numpy()
+    transitions['steady_height'] = steady['resolution_height'].to_numpy()
+
+    # minimum buffer from the change until steady state (or the end of the window if none was reached)
+    samples = assign_windows(buffer, transitions)
+    settle = transitions['t0'] + transitions['steady_state_seconds'].fillna(np.inf)
+    within = samples['t'] <= settle.to_numpy()[samples['pair'].to_numpy()]
+    low = samples[within].groupby('pair')['buffer_seconds'].min()
+    # the level at the change itself counts too, since buffer samples are sparse
+    at_start = pd.merge_asof(transitions[['trial', 't0', 'pair']].sort_values('t0'),
+                             buffer.rename(columns={'time_seconds': 't0'}).sort_values('t0'),
+                             on='t0', by='trial', direction='backward').set_index('pair')['buffer_seconds']
+    transitions['min_buffer_seconds'] = np.fmin(low.reindex(transitions['pair']).to_numpy(),
+                                                at_start.reindex(transitions['pair']).to_numpy())
+
+    latency = transitions.drop(columns=['pair', 't1']).rename(columns={'t0': 'time_seconds'})
+    for name in ('height_before', 'first_switch_height', 'steady_height'):
+        latency[name] = latency[name].astype('Int16')
+    return latency
+
+def summarize(latency):
+    grouped = latency.groupby('direction')
+    return pd.DataFrame({
+        'transitions': grouped.size(),
+        'reacted': grouped['first_switch_seconds'].count(),
+        'median_first_switch_seconds': grouped['first_switch_seconds'].median(),
+        'median_steady_state_seconds': grouped['steady_state_seconds'].median(),
+        'median_min_buffer_seconds': grouped['min_buffer_seconds'].median()
+    })
+
+def main():
+    trial_nums = []
+    trace = None
+    steady_seconds = STEADY_SECONDS
+
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '--trace':
+            trace = load_trace(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--steady':
+            steady_seconds = float(sys.argv[i + 1])
+            i += 2
+        else:
+            trial_nums.append(sys.argv[i])
+            i += 1
+
+    trial_nums = trial_nums or list_trials('quality')
+    quality, buffer, shaping = load_raw_trials(trial_nums)
+    latency = compute_latency(trial_nums, quality, buffer, shaping, trace, steady_seconds)
+    latency.to_csv(OUTPUT_FILE, index=False, float_format='%.6g')
+
+    print(latency[['trial', 'transition', 'direction', 'first_switch_seconds', 'steady_state_seconds',
+                   'min_buffer_seconds']].to_string(index=False))
+    print()
+    print(summarize(latency).to_string())
+
+if __name__ == "__main__":
+    main()
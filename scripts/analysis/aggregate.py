@@ -0,0 +1,115 @@
+import hashlib
+import json
+import sys
+import numpy as np
+import pandas as pd
+from trial_store import PROC_DIR, list_trials, load_tables, source_path
+
+CACHE_FILE = PROC_DIR / 'aggregate_matrix.npz'
+BANDS_FILE = PROC_DIR / 'aggregate_bands.csv'
+SERIES = ['bitrate_kbps', 'buffer_seconds']
+PERCENTILES = [5, 25, 50, 75, 95]
+
+def matrix_key(trial_nums):
+    # the cache is valid while every processed timeline is byte-for-byte the one it was built from
+    stamps = []
+    for trial_num in trial_nums:
+        stat = source_path(trial_num, 'processed').stat()
+        stamps.append([trial_num, stat.st_size, stat.st_mtime_ns])
+    return hashlib.sha256(json.dumps(stamps).encode()).hexdigest()
+
+def build_matrix(trial_nums, stacked=None):
+    # scatter the stacked (trial, time) rows into dense (trials x time) arrays, NaN-padded where trials end early
+    if stacked is None:
+        stacked = load_tables('processed', trial_nums, ['time_seconds'] + SERIES + ['network_phase'])
+    rows = stacked['trial'].cat.codes.to_numpy()
+    times = stacked['time_seconds'].to_numpy(dtype=float)
+
+    steps = np.diff(times)[np.diff(rows) == 0]
+    step = float(np.median(steps)) if len(steps) else 1.0
+    cols = np.rint(times / step).astype(np.int64)
+    shape = (len(stacked['trial'].cat.categories), int(cols.max()) + 1)
+
+    matrix = {}
+    for name in SERIES:
+        values = np.full(shape, np.nan, dtype=np.float32)
+        values[rows, cols] = stacked[name].to_numpy(dtype=np.float32, na_value=np.nan)
+        matrix[name] = values
+
+    phase = stacked['network_phase'].astype('category')
+    phase_codes = np.full(shape, -1, dtype=np.int16)
+    phase_codes[rows, cols] = phase.cat.codes.to_numpy()
+
+    return {
+        'trials': np.array(stacked['trial'].cat.categories, dtype=str),
+        'time_seconds': np.arange(shape[1]) * step,
+        'phase_codes': phase_codes,
+        'phase_names': np.array(phase.cat.categories, dtype=str),
+        **matrix
+    }
+
+def load_matrix(trial_nums=None, rebuild=False, stacked=None):
+    trial_nums = list(trial_nums) if trial_nums is not None else list_trials('processed')
+    key = matrix_key(trial_nums)
+    if not rebuild and CACHE_FILE.exists():
+        with np.load(CACHE_FILE) as cached:
+            if str(cached['key']) == key:
+                return {name: cached[name] for name in cached.files if name != 'key'}
+
+    matrix = build_matrix(trial_nums, stacked)
+    np.savez(CACHE_FILE, key=np.array(key), **matrix)
+    return matrix
+
+def column_percentiles(values, qs):
+    # np.nanpercentile falls back to a per-column loop when NaNs are present; sorting once puts NaNs
+    # last in every column, so each percentile is a vectorized gather between two order statistics
+    ordered = np.sort(values, axis=0)
+    counts = np.sum(~np.isnan(values), axis=0)
+    out = np.full((len(qs), values.shape[1]), np.nan)
+    valid = counts > 0
+    for i, q in enumerate(qs):
+        pos = q / 100 * (np.maximum(counts, 1) - 1)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.ceil(pos).astype(np.int64)
+        low = np.take_along_axis(ordered, lo[None, :], axis=0)[0]
+        high = np.take_along_axis(ordered, hi[None, :], axis=0)[0]
+        out[i] = np.where(valid, low + (high - low) * (pos - lo), np.nan)
+    return out
+
+def modal_phase(matrix):
+    # the phase most trials are in at each timestep; markers go where it changes
+    codes = matrix['phase_codes']
+    n_phases = len(matrix['phase_names'])
+    if n_phases == 0:
+        return np.full(codes.shape[1], -1)
+    counts = np.stack([(codes == k).sum(axis=0) for k in range(n_phases)])
+    return np.where(counts.max(axis=0) > 0, counts.argmax(axis=0), -1)
+
+def phase_boundaries(matrix):
+    modal = modal_phase(matrix)
+    changes = np.flatnonzero((modal[1:] != modal[:-1]) & (modal[1:] >= 0)) + 1
+    return [(matrix['time_seconds'][i], matrix['phase_names'][modal[i]]) for i in changes]
+
+def compute_bands(matrix):
+    bands = {'time_seconds': matrix['time_seconds'], 'trial_count': np.sum(~np.isnan(matrix[SERIES[0]]), axis=0)}
+    for name in SERIES:
+        values = matrix[name].astype(np.float64)
+        counts = np.sum(~np.isnan(values), axis=0)
+        bands[f'{name}_mean'] = np.where(counts > 0, np.nansum(values, axis=0) / np.maximum(counts, 1), np.nan)
+        for q, row in zip(PERCENTILES, column_percentiles(values, PERCENTILES)):
+            bands[f'{name}_p{q}'] = row
+    return pd.DataFrame(bands)
+
+def main():
+    rebuild = '--rebuild' in sys.argv
+    trial_nums = [a for a in sys.argv[1:] if not a.startswith('--')] or None
+
+    matrix = load_matrix(trial_nums, rebuild)
+    bands = compute_bands(matrix)
+    bands.to_csv(BANDS_FILE, index=False, float_format='%.6g')
+    print(f"{len(matrix['trials'])} trials x {len(matrix['time_seconds'])} timesteps -> {BANDS_FILE}")
+    for time_seconds, phase in phase_boundaries(matrix):
+        print(f"  {phase} from {time_seconds:g}s")
+
+if __name__ == "__main__":
+    main()
@@ -1,75 +1,217 @@
+import sys
+import numpy as np
 import pandas as pd
-from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from trial_store import PROC_DIR, STORE_DIR, list_trials, load_tables, source_path
 
-def calculate_trial_metrics(trial_num):
-    unified_file = Path(f'data/processed/trial_{trial_num}/unified_timeline.csv')
-    if not unified_file.exists():
+HEIGHTS = [360, 480, 720, 1080]
+SHARD_SIZE = 250
+
+METRIC_COLUMNS = ['time_seconds', 'resolution_height', 'bitrate_kbps', 'buffer_seconds', 'network_phase']
+
+def load_timelines(trial_nums, store_dir=STORE_DIR):
+    return load_tables('processed', trial_nums, METRIC_COLUMNS, store_dir)
+
+def grid_step(df, key):
+    # rows are evenly spaced within a trial, so the first gap is the grid step
+    if 'time_seconds' not in df.columns:
+        return 1.0
+    return df['time_seconds'].groupby(key).diff().groupby(key).first().fillna(1.0)
+
+def group_mean_std(values, codes, n_groups):
+    # mean and sample std per group, each group's rows summed as one slice in row order the way
+    # Series.mean()/std() do (numpy's pairwise sum, two-pass variance); groupby's compensated sums round
+    # differently, and the summary has to match the per-trial numbers to the last digit. reduceat sums a
+    # segment as its first element plus the pairwise sum of the rest, so each group is led by an inserted
+    # 0.0 and its segment sum is exactly the pairwise sum of the group's rows
+    if n_groups == 0:
+        return np.empty(0), np.empty(0)
+    codes = np.asarray(codes)
+    values = np.asarray(values, dtype=np.float64)
+    present = ~np.isnan(values)
+    sizes = np.bincount(codes, minlength=n_groups)
+    count = sizes - np.bincount(codes[~present], minlength=n_groups)
+    # rows of a trial usually arrive together already; otherwise a stable sort keeps each group in row order
+    if not (codes[1:] >= codes[:-1]).all():
+        order = np.argsort(codes, kind='stable')
+        values, present = values[order], present[order]
+    starts = np.cumsum(sizes) - sizes
+    segments = starts + np.arange(n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg = np.add.reduceat(np.insert(np.where(present, values, 0.0), starts, 0.0), segments) / count
+        sqr = np.where(present, (np.repeat(avg, sizes) - values) ** 2, 0.0)
+        var = np.add.reduceat(np.insert(sqr, starts, 0.0), segments) / (count - 1)
+        mean = np.where(count > 0, avg, np.nan)
+        std = np.where(count > 1, np.sqrt(var), np.nan)
+    return mean, std
+
+def phase_metrics(df, key):
+    # phases are taken from the network_phase label ("phase2_low" -> phase2), not from fixed time windows;
+    # the label is parsed once per category rather than once per row
+    if 'network_phase' not in df.columns:
         return None
+    labels = df['network_phase'].astype('category')
+    prefixes = labels.cat.categories.astype(str).str.extract(r'^(phase\d+)', expand=False)
+    prefix_codes, names = pd.factorize(prefixes)
+    # missing labels (code -1) pick up the trailing -1, the same as unlabelled categories
+    phase = pd.Series(np.append(prefix_codes, -1)[labels.cat.codes.values], index=df.index)
 
-    df = pd.read_csv(unified_file)
-    metrics = {'trial': trial_num, 'duration_seconds': len(df)}
+    values = [c for c in ('bitrate_kbps', 'buffer_seconds') if c in df.columns]
+    labelled = phase.values >= 0
+    if not labelled.any():
+        return None
+    # one group per (trial, phase) pair present in the data, as a single integer code
+    pair_codes, pairs = np.unique(key.values[labelled] * len(names) + phase.values[labelled], return_inverse=True)
+    pair_index = pd.MultiIndex.from_arrays([pair_codes // len(names), pair_codes % len(names)])
+    means = pd.DataFrame({c: group_mean_std(df[c].values[labelled], pairs, len(pair_codes))[0] for c in values},
+                         index=pair_index)
+    means.index = means.index.set_levels(names[means.index.levels[1]], level=1)
+
+    wide = means.unstack()
+    suffix = {'bitrate_kbps': 'avg_bitrate', 'buffer_seconds': 'avg_buffer'}
+    phases = sorted(set(wide.columns.get_level_values(1)), key=lambda p: int(p[5:]))
+    columns = [(value, p) for p in phases for value in values]
+    wide = wide.reindex(columns=pd.MultiIndex.from_tuples(columns))
+    wide.columns = [f'{p}_{suffix[value]}' for value, p in columns]
+    return wide
+
+def compute_metrics(timeline):
+    # every metric is one grouped reduction over the stacked (trial x time) frame, keyed by integer trial codes
+    codes, trials = pd.factorize(timeline['trial'], sort=False)
+    key = pd.Series(codes, index=timeline.index, name='trial')
+    df = timeline.drop(columns='trial')
+    for col in ('time_seconds', 'resolution_height', 'bitrate_kbps', 'buffer_seconds'):
+        if col in df.columns:
+            df[col] = df[col].astype('float64')
+
+    rows = key.value_counts(sort=False).sort_index()
+    duration = rows * grid_step(df, key)
+    metrics = pd.DataFrame({'duration_seconds': duration.astype(np.int64) if (duration % 1 == 0).all() else duration})
 
     if 'bitrate_kbps' in df.columns:
-        metrics['avg_bitrate_kbps'] = df['bitrate_kbps'].mean()
-        metrics['max_bitrate_kbps'] = df['bitrate_kbps'].max()
-        metrics['min_bitrate_kbps'] = df['bitrate_kbps'].min()
-        metrics['stddev_bitrate_kbps'] = df['bitrate_kbps'].std()
-        # count quality switches
-        switches = 0
-        prev_bitrate = df['bitrate_kbps'].iloc[0]
-        for i in range(1, len(df)):
-            if df['bitrate_kbps'].iloc[i] != prev_bitrate:
-                switches += 1
-                prev_bitrate = df['bitrate_kbps'].iloc[i]
-        metrics['quality_switches'] = switches
+        bitrate = df['bitrate_kbps'].groupby(key)
+        mean, std = group_mean_std(df['bitrate_kbps'].values, codes, len(trials))
+        metrics['avg_bitrate_kbps'] = mean
+        metrics['max_bitrate_kbps'] = bitrate.max()
+        metrics['min_bitrate_kbps'] = bitrate.min()
+        metrics['stddev_bitrate_kbps'] = std
+        # a switch is any row whose bitrate differs from the previous row of the same trial
+        switched = df['bitrate_kbps'].ne(bitrate.shift()) & key.duplicated()
+        metrics['quality_switches'] = switched.groupby(key).sum()
 
     if 'buffer_seconds' in df.columns:
-        metrics['avg_buffer_seconds'] = df['buffer_seconds'].mean()
-        metrics['min_buffer_seconds'] = df['buffer_seconds'].min()
-        metrics['max_buffer_seconds'] = df['buffer_seconds'].max()
-        metrics['buffer_empty_count'] = (df['buffer_seconds'] <= 0).sum()
+        buffer = df['buffer_seconds'].groupby(key)
+        metrics['avg_buffer_seconds'] = group_mean_std(df['buffer_seconds'].values, codes, len(trials))[0]
+        metrics['min_buffer_seconds'] = buffer.min()
+        metrics['max_buffer_seconds'] = buffer.max()
+        metrics['buffer_empty_count'] = (df['buffer_seconds'] <= 0).groupby(key).sum()
 
     if 'resolution_height' in df.columns:
-        for height in [360, 480, 720, 1080]:
-            metrics[f'time_at_{height}p_percent'] = round((df['resolution_height'] == height).sum() / len(df) * 100, 2)
-
-    # phase 1: 0-45s
-    phase1_df = df[(df['time_seconds'] >= 0) & (df['time_seconds'] < 45)]
-    if 'bitrate_kbps' in phase1_df.columns:
-        metrics['phase1_avg_bitrate'] = phase1_df['bitrate_kbps'].mean()
-    if 'buffer_seconds' in phase1_df.columns:
-        metrics['phase1_avg_buffer'] = phase1_df['buffer_seconds'].mean()
-
-    # phase 2: 45-90s
-    phase2_df = df[(df['time_seconds'] >= 45) & (df['time_seconds'] < 90)]
-    if 'bitrate_kbps' in phase2_df.columns:
-        metrics['phase2_avg_bitrate'] = phase2_df['bitrate_kbps'].mean()
-    if 'buffer_seconds' in phase2_df.columns:
-        metrics['phase2_avg_buffer'] = phase2_df['buffer_seconds'].mean()
-
-    # phase 3: 90-136s
-    phase3_df = df[(df['time_seconds'] >= 90) & (df['time_seconds'] < 136)]
-    if 'bitrate_kbps' in phase3_df.columns:
-        metrics['phase3_avg_bitrate'] = phase3_df['bitrate_kbps'].mean()
-    if 'buffer_seconds' in phase3_df.columns:
-        metrics['phase3_avg_buffer'] = phase3_df['buffer_seconds'].mean()
+        for height in HEIGHTS:
+            at_height = (df['resolution_height'] == height).groupby(key).sum()
+            metrics[f'time_at_{height}p_percent'] = (at_height / rows * 100).round(2)
+
+    phases = phase_metrics(df, key)
+    if phases is not None:
+        metrics = metrics.join(phases)
+
+    metrics.index = pd.Index(np.asarray(trials).astype(str)[metrics.index], name='trial')
+    return metrics.reset_index()
 
+def logged_trials(table):
+    # load_tables keeps every trial that has the file as a category, even when the log has no rows
+    if isinstance(table['trial'].dtype, pd.CategoricalDtype):
+        return {str(t) for t in table['trial'].cat.categories}
+    return set(table['trial'].astype(str))
+
+def playback_metrics(trial_nums, durations, store_dir=STORE_DIR):
+    # from the raw stall and frame logs; trials collected before these were recorded get no values
+    stalls = load_tables('stalls', trial_nums, ['time_seconds', 'end_seconds', 'type'], store_dir)
+    frames = load_tables('playback', trial_nums, ['time_seconds', 'dropped_frames', 'total_frames'], store_dir)
+    metrics = pd.DataFrame(index=durations.index)
+
+    if logged_trials(stalls):
+        # a trial whose stall log is empty played without stalling
+        logged = durations.index.isin(logged_trials(stalls))
+        per_trial = lambda series: series.reindex(durations.index).fillna(0).where(logged)
+        trial = stalls['trial'].astype(str)
+        length = (stalls['end_seconds'].astype(float) - stalls['time_seconds'].astype(float)).clip(lower=0)
+        waiting = (stalls['type'].astype(str) == 'waiting').values
+        by_trial = length[waiting].groupby(trial[waiting])
+        metrics['rebuffer_count'] = per_trial(by_trial.size())
+        metrics['rebuffer_seconds'] = per_trial(by_trial.sum()).round(2)
+        metrics['rebuffer_ratio'] = (metrics['rebuffer_seconds'] / durations).round(4)
+        metrics['max_stall_seconds'] = per_trial(by_trial.max()).round(2)
+        metrics['network_stall_seconds'] = per_trial(length[~waiting].groupby(trial[~waiting]).sum()).round(2)
+
+    if len(frames):
+        frames = frames.assign(trial=frames['trial'].astype(str)).sort_values(['trial', 'time_seconds'], kind='stable')
+        # counters restart when the player loads a new source, so a drop means counting again from zero
+        counts = {}
+        for col in ('dropped_frames', 'total_frames'):
+            values = frames[col].astype(float)
+            step = values.groupby(frames['trial']).diff()
+            counts[col] = step.where(step >= 0, values).where(step.notna(), 0).groupby(frames['trial']).sum()
+        metrics['dropped_frames'] = counts['dropped_frames'].reindex(durations.index)
+        metrics['decoded_frames'] = counts['total_frames'].reindex(durations.index)
+        decoded = metrics['decoded_frames'].where(metrics['decoded_frames'] > 0)
+        metrics['dropped_frame_rate'] = (metrics['dropped_frames'] / decoded).round(4)
     return metrics
 
-def calculate_all_trials():
-    proc_dir = Path('data/processed')
-    trial_dirs = sorted([d for d in proc_dir.iterdir() if d.is_dir() and d.name.startswith('trial_')])
+def metrics_for_timeline(timeline, store_dir=STORE_DIR):
+    metrics = compute_metrics(timeline)
+    if metrics.empty:
+        return metrics
+    playback = playback_metrics(list(metrics['trial']), metrics.set_index('trial')['duration_seconds'], store_dir)
+    return metrics.join(playback, on='trial')
+
+def metrics_for_shard(trial_nums, store_dir=STORE_DIR):
+    return metrics_for_timeline(load_timelines(trial_nums, store_dir), store_dir)
+
+def calculate_trial_metrics(trial_num):
+    if not source_path(trial_num, 'processed').exists():
+        return None
+    return metrics_for_shard([trial_num]).iloc[0].to_dict()
+
+def calculate_metrics(trial_nums, workers=1, shard_size=SHARD_SIZE, store_dir=STORE_DIR):
+    shards = [trial_nums[i:i + shard_size] for i in range(0, len(trial_nums), shard_size)]
+    if workers <= 1 or len(shards) <= 1:
+        results = [metrics_for_shard(shard, store_dir) for shard in shards]
+    else:
+        # each worker loads and reduces its own shard, so only the small summary rows cross processes
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(metrics_for_shard, shards, [store_dir] * len(shards)))
 
-    all_metrics = []
-    for trial_dir in trial_dirs:
-        trial_num = trial_dir.name.split('_')[1]
-        metrics = calculate_trial_metrics(trial_num)
-        if metrics:
-            all_metrics.append(metrics)
+    results = [r for r in results if not r.empty]
+    if not results:
+        return pd.DataFrame()
+    return pd.concat(results, ignore_index=True)
 
-    summary = pd.DataFrame(all_metrics)
-    summary.to_csv(proc_dir / 'metrics_summary.csv', index=False)
+def write_summary(summary):
+    summary.to_csv(PROC_DIR / 'metrics_summary.csv', index=False)
     print(summary[['trial', 'avg_bitrate_kbps', 'quality_switches', 'avg_buffer_seconds']].to_string(index=False))
 
+def calculate_all_trials(workers=1, shard_size=SHARD_SIZE):
+    summary = calculate_metrics(list_trials('processed'), workers, shard_size)
+    write_summary(summary)
+    return summary
+
+def main():
+    workers = 1
+    shard_size = SHARD_SIZE
+
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '--workers':
+            workers = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--shard-size':
+            shard_size = int(sys.argv[i + 1])
+            i += 2
+        else:
+            i += 1
+
+    calculate_all_trials(workers, shard_size)
+
 if __name__ == "__main__":
-    calculate_all_trials()
+    main()
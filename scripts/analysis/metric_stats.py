@@ -0,0 +1,200 @@
+import math
+import sys
+import numpy as np
+import pandas as pd
+from aggregate import SERIES, column_percentiles, load_matrix
+from trial_store import PROC_DIR
+
+SUMMARY_FILE = PROC_DIR / 'metrics_summary.csv'
+LATENCY_FILE = PROC_DIR / 'adaptation_latency.csv'
+OUTPUT_FILE = PROC_DIR / 'metrics_ci.csv'
+TIMELINE_FILE = PROC_DIR / 'timeline_ci.csv'
+RESAMPLES = 10000
+CONFIDENCE = 0.95
+# full CI width as a fraction of the mean that counts as "enough trials"
+TARGET_RELATIVE_WIDTH = 0.10
+# resample counts are drawn in blocks of at most this many (resample x trial) cells to bound memory
+CHUNK_CELLS = 5_000_000
+# timesteps bootstrapped together; each block is reduced to its percentiles before the next one, so memory
+# stays at resamples x block however long the trials are
+TIMELINE_BLOCK = 256
+LATENCY_COLUMNS = ['first_switch_seconds', 'steady_state_seconds', 'min_buffer_seconds']
+
+def load_trial_metrics(summary_file=SUMMARY_FILE, latency_file=LATENCY_FILE):
+    # one row per trial: the summary metrics plus each trial's mean adaptation timings per direction,
+    # so a trial with several drops still counts once when resampling
+    summary = pd.read_csv(summary_file, dtype={'trial': str}).set_index('trial')
+    if latency_file is not None and latency_file.exists():
+        latency = pd.read_csv(latency_file, dtype={'trial': str})
+        timings = latency.pivot_table(index='trial', columns='direction', values=LATENCY_COLUMNS, aggfunc='mean')
+        timings.columns = [f'{direction}_{name}' for name, direction in timings.columns]
+        summary = summary.join(timings)
+    return summary.select_dtypes('number')
+
+def resample_counts(rng, n, size):
+    # row r holds how often each of the n trials was drawn in resample r
+    draws = rng.integers(0, n, (size, n)) + (np.arange(size) * n)[:, None]
+    return np.bincount(draws.ravel(), minlength=size * n).reshape(size, n)
+
+def bootstrap_means(values, resamples=RESAMPLES, seed=None):
+    # (resamples x columns) means of every column over resampled trials: each block of resamples is a
+    # count matrix times the trial matrix, NaNs (metrics a trial does not have) drop out through the masked counts
+    values = np.asarray(values, dtype=np.float64)
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0.0)
+    present = present.astype(np.float64)
+    n = values.shape[0]
+
+    rng = np.random.default_rng(seed)
+    block = max(1, CHUNK_CELLS // max(n, 1))
+    means = np.empty((resamples, values.shape[1]))
+    for start in range(0, resamples, block):
+        counts = resample_counts(rng, n, min(block, resamples - start)).astype(np.float64)
+        totals = counts @ filled
+        drawn = counts @ present
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means[start:start + len(counts)] = np.where(drawn > 0, totals / drawn, np.nan)
+    return means
+
+def confidence_intervals(values, resamples=RESAMPLES, confidence=CONFIDENCE, seed=None):
+    # percentile intervals of the bootstrapped means, columnwise
+    tail = (1 - confidence) / 2 * 100
+    means = bootstrap_means(values, resamples, seed)
+    low, high = column_percentiles(means, [tail, 100 - tail])
+    return low, high
+
+def trials_needed(trials, width, target):
+    # CI width shrinks as 1/sqrt(n), so reaching `target` takes n * (width / target)^2 trials; with very few
+    # trials percentile intervals run narrow, so treat the estimate as a lower bound
+    if not (target > 0) or np.isnan(width):
+        return np.nan
+    return max(trials, math.ceil(trials * (width / target) ** 2))
+
+def metric_intervals(metrics, resamples=RESAMPLES, confidence=CONFIDENCE, target=TARGET_RELATIVE_WIDTH,
+                     widths=None, seed=None):
+    widths = widths or {}
+    values = metrics.to_numpy(dtype=np.float64)
+    low, high = confidence_intervals(values, resamples, confidence, seed)
+
+    rows = []
+    for i, name in enumerate(metrics.columns):
+        column = values[:, i]
+        trials = int(np.sum(~np.isnan(column)))
+        mean = np.nanmean(column) if trials else np.nan
+        width = high[i] - low[i]
+        target_width = widths.get(name, target * abs(mean) if trials else np.nan)
+        needed = trials_needed(trials, width, target_width) if trials else np.nan
+        rows.append({
+            'metric': name,
+            'trials': trials,
+            'mean': mean,
+            'ci_low': low[i],
+            'ci_high': high[i],
+            'ci_width': width,
+            'relative_width': width / abs(mean) if mean else np.nan,
+            'target_width': target_width,
+            'trials_needed': needed,
+            'additional_trials': needed - trials if not np.isnan(needed) else np.nan
+        })
+    intervals = pd.DataFrame(rows)
+    return intervals.astype({'trials_needed': 'Int64', 'additional_trials': 'Int64'})
+
+def timeline_intervals(matrix, resamples=RESAMPLES, confidence=CONFIDENCE, seed=None):
+    # CI of the cross-trial mean at every timestep of the stacked (trials x time) matrix, a block of timesteps
+    # of every series at a time; one seed sequence for all blocks means every block sees the same resampled
+    # trials, as if the whole matrix had been bootstrapped at once
+    seed = np.random.SeedSequence(seed)
+    steps = len(matrix['time_seconds'])
+    low = np.empty((len(SERIES), steps))
+    high = np.empty((len(SERIES), steps))
+    for start in range(0, steps, TIMELINE_BLOCK):
+        end = min(start + TIMELINE_BLOCK, steps)
+        block = np.hstack([matrix[name][:, start:end].astype(np.float64) for name in SERIES])
+        block_low, block_high = confidence_intervals(block, resamples, confidence, seed)
+        low[:, start:end] = block_low.reshape(len(SERIES), -1)
+        high[:, start:end] = block_high.reshape(len(SERIES), -1)
+
+    bands = {'time_seconds': matrix['time_seconds'],
+             'trial_count': np.sum(~np.isnan(matrix[SERIES[0]]), axis=0)}
+    for i, name in enumerate(SERIES):
+        values = matrix[name].astype(np.float64)
+        counts = np.sum(~np.isnan(values), axis=0)
+        bands[f'{name}_mean'] = np.where(counts > 0, np.nansum(values, axis=0) / np.maximum(counts, 1), np.nan)
+        bands[f'{name}_ci_low'] = low[i]
+        bands[f'{name}_ci_high'] = high[i]
+    return pd.DataFrame(bands)
+
+def print_intervals(intervals, confidence):
+    print(f"{'metric':<36} {'n':>5} {'mean':>10} {f'{confidence:.0%} CI':>23} {'width':>7} {'need':>6} {'more':>6}")
+    for row in intervals.itertuples():
+        ci = f"[{row.ci_low:.4g}, {row.ci_high:.4g}]" if not np.isnan(row.ci_low) else '-'
+        relative = f"{row.relative_width:.0%}" if not np.isnan(row.relative_width) else '-'
+        needed = str(row.trials_needed) if not pd.isna(row.trials_needed) else '-'
+        more = str(row.additional_trials) if not pd.isna(row.additional_trials) else '-'
+        print(f"{row.metric:<36} {row.trials:>5} {row.mean:>10.4g} {ci:>23} {relative:>7} {needed:>6} {more:>6}")
+
+def main():
+    resamples = RESAMPLES
+    confidence = CONFIDENCE
+    target = TARGET_RELATIVE_WIDTH
+    widths = {}
+    seed = None
+    timeline = False
+    trial_nums = []
+
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '--resamples':
+            resamples = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--confidence':
+            confidence = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--target':
+            target = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--width':
+            # absolute target width for one metric, e.g. --width quality_switches=1
+            name, value = sys.argv[i + 1].split('=')
+            widths[name] = float(value)
+            i += 2
+        elif sys.argv[i] == '--seed':
+            seed = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--timeline':
+            timeline = True
+            i += 1
+        else:
+            trial_nums.append(sys.argv[i])
+            i += 1
+
+    if not 0 < confidence < 1:
+        print("Error: --confidence must be between 0 and 1")
+        sys.exit(1)
+
+    if timeline:
+        matrix = load_matrix(trial_nums or None)
+        bands = timeline_intervals(matrix, resamples, confidence, seed)
+        bands.to_csv(TIMELINE_FILE, index=False, float_format='%.6g')
+        print(f"{len(matrix['trials'])} trials x {len(bands)} timesteps, {resamples} resamples -> {TIMELINE_FILE}")
+        return
+
+    if not SUMMARY_FILE.exists():
+        print(f"Error: {SUMMARY_FILE} not found (run calculate_metrics.py first)")
+        sys.exit(1)
+    metrics = load_trial_metrics()
+    if trial_nums:
+        metrics = metrics[metrics.index.isin(trial_nums)]
+    unknown = sorted(set(widths) - set(metrics.columns))
+    if unknown:
+        print(f"Error: unknown metric {', '.join(unknown)}")
+        sys.exit(1)
+
+    intervals = metric_intervals(metrics, resamples, confidence, target, widths, seed)
+    intervals.to_csv(OUTPUT_FILE, index=False, float_format='%.6g')
+    print_intervals(intervals, confidence)
+    print(f"\n{len(metrics)} trials, {resamples} resamples; 'need' is the trial count for a CI width of "
+          f"{target:.0%} of the mean (or --width) -> {OUTPUT_FILE}")
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,225 @@
-import pandas as pd
 import sys
 from pathlib import Path
+import numpy as np
+import pandas as pd
 
-def process_trial(trial_num):
-    raw_dir = Path(f'data/raw/trial_{trial_num}')
-    proc_dir = Path(f'data/processed/trial_{trial_num}')
-    proc_dir.mkdir(parents=True, exist_ok=True)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'collection'))
+from network_trace import default_trace, load_trace
+from trial_store import PROC_DIR, load_tables, list_trials, source_path, update_index, write_table
 
-    quality = pd.read_csv(raw_dir / 'quality_timeline.csv')
-    buffer = pd.read_csv(raw_dir / 'buffer_timeline.csv')
+GRID_STEP = 1.0
 
-    timeline = pd.DataFrame({'time_seconds': range(0, 136)})
+TIMELINE_COLUMNS = ['time_seconds', 'resolution_width', 'resolution_height', 'bitrate_kbps',
+                    'buffer_seconds', 'network_phase', 'network_bandwidth_mbps']
+# only present for trials collected with a segment log (cdp_collect.py --segments)
+SEGMENT_COLUMNS = ['throughput_kbps', 'segment_bitrate_kbps']
 
-    timeline = timeline.merge(
-        quality[['time_seconds', 'resolution_width', 'resolution_height', 'bitrate_kbps']],
-        on='time_seconds', how='left'
-    )
-    timeline[['resolution_width', 'resolution_height', 'bitrate_kbps']] = \
-        timeline[['resolution_width', 'resolution_height', 'bitrate_kbps']].ffill()
+def load_raw_trials(trial_nums):
+    quality = load_tables('quality', trial_nums, ['time_seconds', 'resolution_width', 'resolution_height', 'bitrate_kbps'])
+    missing = set(trial_nums) - set(quality['trial'].astype(str))
+    if missing:
+        raise FileNotFoundError(source_path(min(missing), 'quality'))
+    buffer = load_tables('buffer', trial_nums, ['time_seconds', 'buffer_seconds'])
+    shaping = load_tables('shaping', trial_nums, ['time_seconds', 'bandwidth_kbps'])
+    return quality, buffer, shaping
 
-    timeline = timeline.merge(
-        buffer[['time_seconds', 'buffer_seconds']],
-        on='time_seconds', how='left'
-    )
-    timeline['buffer_seconds'] = timeline['buffer_seconds'].interpolate()
+def load_segments(trial_nums):
+    return load_tables('segments', trial_nums, ['time_seconds', 'request_seconds', 'response_seconds', 'media',
+                                                'bytes', 'stream_kbps', 'status'])
+
+def build_grid(ends, step):
+    # one row per (trial, grid point) without a Python loop over trials
+    counts = (np.floor(ends.values / step + 1e-9)).astype(np.int64) + 1
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    ticks = np.arange(counts.sum()) - starts
+    times = ticks * step
+    if float(step).is_integer():
+        times = times.astype(np.int32)
+    return pd.DataFrame({'trial': np.repeat(ends.index.values, counts), 'time_seconds': times})
+
+def shaping_steps(trial_nums, shaping, trace):
+    # recorded shaping wins; trials without a log fall back to the trace definition
+    trace_frame = pd.DataFrame(trace)[['time_seconds', 'bandwidth_kbps']]
+    missing = [t for t in trial_nums if t not in set(shaping['trial'])]
+    fallback = pd.concat({t: trace_frame for t in missing}, names=['trial', None]).reset_index(level=0) \
+        if missing else shaping.iloc[:0]
+    steps = pd.concat([shaping, fallback], ignore_index=True)
+    steps = steps.sort_values(['trial', 'time_seconds'], kind='stable')
+
+    # resumed trials re-log the active step; only real bandwidth changes start a new phase
+    changed = steps['bandwidth_kbps'].ne(steps.groupby('trial')['bandwidth_kbps'].shift())
+    steps = steps[changed].copy()
+
+    # the first step is applied during the preroll, so it covers t=0
+    first = ~steps['trial'].duplicated()
+    steps.loc[first, 'time_seconds'] = np.minimum(steps.loc[first, 'time_seconds'], 0)
+
+    steps['phase_index'] = steps.groupby('trial').cumcount() + 1
+    peak = steps.groupby('trial')['bandwidth_kbps'].transform('max')
+    level = np.where(steps['bandwidth_kbps'] >= peak / 2, 'high', 'low')
+    steps['network_phase'] = 'phase' + steps['phase_index'].astype(str) + '_' + level
+    return steps[['trial', 'time_seconds', 'bandwidth_kbps', 'network_phase']]
+
+def interpolate_buffer(grid, buffer):
+    # piecewise-linear between buffer samples and held after the last one, like Series.interpolate();
+    # trials are laid end to end on one axis so a single np.interp covers the whole batch
+    buffer = buffer.drop_duplicates(['trial', 'time_seconds'], keep='last')
+    codes = {t: i for i, t in enumerate(grid['trial'].unique())}
+    span = max(grid['time_seconds'].max(), buffer['time_seconds'].max()) + 1
+
+    buffer_code = buffer['trial'].map(codes).values
+    buffer_key = buffer_code * span + buffer['time_seconds'].values
+    order = np.argsort(buffer_key, kind='stable')
+    values = np.interp(grid['trial'].map(codes).values * span + grid['time_seconds'].values,
+                       buffer_key[order], buffer['buffer_seconds'].values[order])
+
+    bounds = buffer.groupby('trial')['time_seconds'].agg(['min', 'max'])
+    last_value = buffer.loc[buffer.groupby('trial')['time_seconds'].idxmax()].set_index('trial')['buffer_seconds']
+    first_time = grid['trial'].map(bounds['min']).values
+    last_time = grid['trial'].map(bounds['max']).values
+    times = grid['time_seconds'].values
+
+    values = np.where(times > last_time, grid['trial'].map(last_value).values, values)
+    values = np.where((times < first_time) | np.isnan(first_time), np.nan, values)
+    return values
+
+def segment_throughput(grid, segments, step):
+    # each segment's bytes are spread evenly from its first response byte to loadingFinished, so bytes
+    # delivered over time is piecewise linear; with trials laid end to end one np.interp reads that curve
+    # at every grid point and one step earlier, and the difference is the throughput over that step
+    codes = {t: i for i, t in enumerate(grid['trial'].unique())}
+    logged = grid['trial'].isin(set(segments['trial'])).values
+    done = segments[(segments['status'] == 'ok') & segments['time_seconds'].notna()]
+    if done.empty:
+        return np.where(logged, 0.0, np.nan)
+
+    code = done['trial'].map(codes).values
+    start = np.clip(done['response_seconds'].fillna(done['request_seconds']).values.astype(float), 0, None)
+    end = np.maximum(done['time_seconds'].values.astype(float), start)
+    # a transfer that completes in the same millisecond still delivers its bytes over a short ramp
+    transfer = np.maximum(end - start, 1e-3)
+    rate = done['bytes'].values.astype(float) / transfer
 
-    timeline['network_phase'] = 'phase1_high'
-    timeline.loc[(timeline['time_seconds'] >= 45) & (timeline['time_seconds'] < 90), 'network_phase'] = 'phase2_low'
-    timeline.loc[timeline['time_seconds'] >= 90, 'network_phase'] = 'phase3_high'
+    times = grid['time_seconds'].values.astype(float)
+    span = max(times.max(), end.max()) + 2 * step + 1
+    keys = np.concatenate([code * span + start, code * span + start + transfer])
+    deltas = np.concatenate([rate, -rate])
+    order = np.argsort(keys, kind='stable')
+    keys, deltas = keys[order], deltas[order]
+    delivered = np.concatenate([[0.0], np.cumsum(np.cumsum(deltas)[:-1] * np.diff(keys))])
 
-    timeline['network_bandwidth_mbps'] = 20.0
-    timeline.loc[(timeline['time_seconds'] >= 45) & (timeline['time_seconds'] < 90), 'network_bandwidth_mbps'] = 1.5
+    grid_key = grid['trial'].map(codes).values * span + times
+    kbps = (np.interp(grid_key, keys, delivered) - np.interp(grid_key - step, keys, delivered)) * 8 / 1000 / step
+    return np.where(logged, kbps, np.nan)
 
-    timeline.to_csv(proc_dir / 'unified_timeline.csv', index=False)
+def process_trials(trial_nums, step=GRID_STEP, trace=None, duration=None, quality=None, buffer=None, shaping=None,
+                   segments=None):
+    trial_nums = list(trial_nums)
+    if quality is None:
+        quality, buffer, shaping = load_raw_trials(trial_nums)
+        segments = load_segments(trial_nums)
+    if shaping is None:
+        shaping = pd.DataFrame(columns=['trial', 'time_seconds', 'bandwidth_kbps'])
+    if segments is None:
+        segments = pd.DataFrame(columns=['trial', 'time_seconds'])
+
+    # merge_asof needs identical key dtypes on both sides
+    for events in (quality, buffer, shaping, segments):
+        events['trial'] = events['trial'].astype(str)
+        events['time_seconds'] = events['time_seconds'].astype(float)
+
+    if duration is None:
+        ends = pd.concat([quality[['trial', 'time_seconds']], buffer[['trial', 'time_seconds']]])
+        ends = ends.groupby('trial')['time_seconds'].max().reindex(trial_nums)
+    else:
+        ends = pd.Series(float(duration), index=trial_nums)
+
+    grid = build_grid(ends, step)
+    grid_times = grid['time_seconds'].astype(float)
+    keyed = grid.assign(trial=grid['trial'].astype(str), t=grid_times, row=np.arange(len(grid))).sort_values('t', kind='stable')
+
+    quality = quality.sort_values('time_seconds', kind='stable').rename(columns={'time_seconds': 't'})
+    timeline = pd.merge_asof(keyed, quality, on='t', by='trial', direction='backward')
+
+    steps = shaping_steps(trial_nums, shaping, trace or default_trace())
+    steps = steps.sort_values('time_seconds', kind='stable').rename(columns={'time_seconds': 't'})
+    steps['trial'] = steps['trial'].astype(str)
+    timeline = pd.merge_asof(timeline, steps, on='t', by='trial', direction='backward')
+
+    extra = []
+    if not segments.empty:
+        # bitrate of the rendition actually being downloaded: the encoded rate of the last video segment
+        video = segments[(segments['media'] == 'video') & (segments['status'] == 'ok') & segments['stream_kbps'].notna()]
+        video = video[['trial', 'time_seconds', 'stream_kbps']].sort_values('time_seconds', kind='stable')
+        video = video.rename(columns={'time_seconds': 't', 'stream_kbps': 'segment_bitrate_kbps'})
+        timeline = pd.merge_asof(timeline, video, on='t', by='trial', direction='backward')
+        extra = SEGMENT_COLUMNS
+    timeline = timeline.sort_values('row').reset_index(drop=True)
+
+    # buffer and bandwidth stay float64: metrics read them back from the store, and float32 would shift
+    # min/max/mean away from the values the CSV export (and metrics_summary.csv) has always had
+    timeline['buffer_seconds'] = interpolate_buffer(grid, buffer)
+    if extra:
+        timeline['throughput_kbps'] = segment_throughput(grid, segments, step).astype(np.float32)
+        timeline['segment_bitrate_kbps'] = timeline['segment_bitrate_kbps'].round().astype('Int32')
+
+    timeline = timeline.assign(
+        trial=pd.Categorical(timeline['trial'], categories=trial_nums),
+        resolution_width=timeline['resolution_width'].astype('Int16'),
+        resolution_height=timeline['resolution_height'].astype('Int16'),
+        bitrate_kbps=timeline['bitrate_kbps'].astype('Int32'),
+        network_phase=timeline['network_phase'].astype('category'),
+        network_bandwidth_mbps=timeline['bandwidth_kbps'] / 1000
+    )
+    return timeline[['trial'] + TIMELINE_COLUMNS + extra].reset_index(drop=True)
+
+def write_unified_timelines(timeline, proc_dir=PROC_DIR, index=True):
+    # the CSV stays as the compatibility export; readers go through the columnar store
+    written = []
+    for trial_num, df in timeline.groupby('trial', observed=True, sort=False):
+        trial_dir = proc_dir / f'trial_{trial_num}'
+        trial_dir.mkdir(parents=True, exist_ok=True)
+        # segment columns are kept only for trials that had a segment log
+        columns = TIMELINE_COLUMNS + [c for c in SEGMENT_COLUMNS if c in df and df['throughput_kbps'].notna().any()]
+        df = df[columns].reset_index(drop=True)
+        df.to_csv(trial_dir / 'unified_timeline.csv', index=False)
+        write_table(trial_num, 'processed', df, trial_dir / 'unified_timeline.csv', index=False)
+        written.append(trial_num)
+    if index:
+        update_index(written)
+
+def process_trial(trial_num, step=GRID_STEP, trace=None):
+    write_unified_timelines(process_trials([trial_num], step, trace))
     print(f"Processed trial {trial_num}")
 
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python process_trial.py XXX [YYY ...] [--step SECONDS] [--trace FILE]")
+        print("       python process_trial.py --all [--step SECONDS] [--trace FILE]")
+        sys.exit(1)
+
+    trial_nums = []
+    step = GRID_STEP
+    trace = None
+
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '--all':
+            trial_nums = list_trials('quality')
+            i += 1
+        elif sys.argv[i] == '--step':
+            step = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--trace':
+            trace = load_trace(sys.argv[i + 1])
+            i += 2
+        else:
+            trial_nums.append(sys.argv[i])
+            i += 1
+
+    timeline = process_trials(trial_nums, step, trace)
+    write_unified_timelines(timeline)
+    print(f"Processed {len(trial_nums)} trials ({len(timeline)} rows, {step:g}s grid)")
+
 if __name__ == "__main__":
-    process_trial(sys.argv[1])
+    main()
@@ -0,0 +1,340 @@
+import csv
+import fcntl
+import json
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+STORE_DIR = Path('data/store')
+RAW_DIR = Path('data/raw')
+PROC_DIR = Path('data/processed')
+
+INDEX_COLUMNS = ['trial', 'video_url', 'trace', 'collected_at', 'duration_seconds', 'status', 'fidelity', 'scenario',
+                 'tables', 'updated_at']
+
+# every table is a cache of the CSV the collectors or process_trial write, which stays the source of truth
+TABLE_SOURCES = {
+    'processed': (PROC_DIR, 'unified_timeline.csv'),
+    'quality': (RAW_DIR, 'quality_timeline.csv'),
+    'buffer': (RAW_DIR, 'buffer_timeline.csv'),
+    'shaping': (RAW_DIR, 'shaping_timeline.csv'),
+    'segments': (RAW_DIR, 'segment_timeline.csv'),
+    'playback': (RAW_DIR, 'playback_timeline.csv'),
+    'stalls': (RAW_DIR, 'stall_timeline.csv'),
+}
+RAW_TABLES = ['quality', 'buffer', 'shaping', 'segments', 'playback', 'stalls']
+
+def source_path(trial_num, table):
+    base_dir, filename = TABLE_SOURCES[table]
+    return base_dir / f'trial_{trial_num}' / filename
+
+def table_dir(trial_num, table, store_dir=STORE_DIR):
+    return store_dir / f'trial_{trial_num}' / table
+
+def write_json(path, data):
+    tmp = path.with_suffix('.tmp')
+    with tmp.open('w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+def code_dtype(n_categories):
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+def encode_column(series):
+    # returns the arrays to persist plus the schema entry needed to rebuild the pandas column
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype) or pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype):
+        values = series if isinstance(dtype, pd.CategoricalDtype) else series.astype('category')
+        categories = [str(c) for c in values.cat.categories]
+        codes = values.cat.codes.to_numpy().astype(code_dtype(len(categories)))
+        return {'values': codes}, {'kind': 'category', 'dtype': codes.dtype.name, 'categories': categories}
+
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype):
+        # nullable Int16 / Float32 / boolean: dense values plus a mask, the mask only when something is missing
+        numpy_dtype = dtype.numpy_dtype
+        mask = series.isna().to_numpy()
+        values = series.to_numpy(dtype=numpy_dtype, na_value=0 if numpy_dtype.kind in 'iub' else np.nan)
+        arrays = {'values': values}
+        if mask.any():
+            arrays['mask'] = mask
+        return arrays, {'kind': 'nullable', 'dtype': numpy_dtype.name, 'pandas_dtype': str(dtype), 'mask': bool(mask.any())}
+
+    values = series.to_numpy()
+    return {'values': values}, {'kind': 'numeric', 'dtype': values.dtype.name}
+
+def decode_column(arrays, spec):
+    if spec['kind'] == 'category':
+        return pd.Categorical.from_codes(arrays['values'], categories=spec['categories'], validate=False)
+    if spec['kind'] == 'nullable':
+        mask = arrays.get('mask')
+        if mask is None:
+            mask = np.zeros(len(arrays['values']), dtype=bool)
+        array_type = pd.api.types.pandas_dtype(spec['pandas_dtype']).construct_array_type()
+        return array_type(arrays['values'], mask)
+    return arrays['values']
+
+def compact_csv_frame(df):
+    # CSV parsing widens everything to int64/float64; integer columns shrink to the smallest type that fits
+    for col in df.columns:
+        if pd.api.types.is_integer_dtype(df[col].dtype) and not isinstance(df[col].dtype, pd.api.extensions.ExtensionDtype):
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
+
+def write_table(trial_num, table, df, source=None, store_dir=STORE_DIR, index=True):
+    out_dir = table_dir(trial_num, table, store_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    columns = {}
+    for col in df.columns:
+        arrays, spec = encode_column(df[col])
+        for part, array in arrays.items():
+            np.save(out_dir / f'{col}.{part}.npy', np.ascontiguousarray(array), allow_pickle=False)
+        columns[col] = spec
+
+    # the schema goes last, so a reader never sees a schema that points at half-written columns
+    schema = {'table': table, 'trial': trial_num, 'rows': len(df), 'order': list(df.columns), 'columns': columns}
+    if source is not None and source.exists():
+        schema['source'] = str(source)
+        schema['source_mtime_ns'] = source.stat().st_mtime_ns
+    write_json(out_dir / 'schema.json', schema)
+    if index:
+        update_index([trial_num], store_dir)
+
+def load_schema(trial_num, table, store_dir=STORE_DIR):
+    path = table_dir(trial_num, table, store_dir) / 'schema.json'
+    if not path.exists():
+        return None
+    with path.open() as f:
+        return json.load(f)
+
+def is_current(trial_num, table, store_dir=STORE_DIR):
+    schema = load_schema(trial_num, table, store_dir)
+    if schema is None:
+        return False
+    source = source_path(trial_num, table)
+    return not source.exists() or source.stat().st_mtime_ns == schema.get('source_mtime_ns')
+
+def read_columns(trial_num, table, columns=None, store_dir=STORE_DIR):
+    # memory-mapped: nothing is read from disk until a column is actually touched
+    schema = load_schema(trial_num, table, store_dir)
+    if schema is None:
+        raise FileNotFoundError(table_dir(trial_num, table, store_dir) / 'schema.json')
+    in_dir = table_dir(trial_num, table, store_dir)
+    columns = [c for c in (columns or schema['order']) if c in schema['columns']]
+
+    arrays = {}
+    for col in columns:
+        spec = schema['columns'][col]
+        parts = {'values': np.load(in_dir / f'{col}.values.npy', mmap_mode='r')}
+        if spec.get('mask'):
+            parts['mask'] = np.load(in_dir / f'{col}.mask.npy', mmap_mode='r')
+        arrays[col] = (parts, spec)
+    return arrays
+
+def ingest_trial(trial_num, tables=None, store_dir=STORE_DIR, index=True):
+    stored = []
+    for table in tables or TABLE_SOURCES:
+        source = source_path(trial_num, table)
+        if not source.exists():
+            continue
+        write_table(trial_num, table, compact_csv_frame(pd.read_csv(source)), source, store_dir, index=False)
+        stored.append(table)
+    if stored and index:
+        update_index([trial_num], store_dir)
+    return stored
+
+def load_trial(trial_num, table='processed', columns=None, store_dir=STORE_DIR):
+    # reads through the store; a missing or stale entry is rebuilt from its CSV first
+    if not is_current(trial_num, table, store_dir):
+        if not ingest_trial(trial_num, [table], store_dir):
+            return None
+    arrays = read_columns(trial_num, table, columns, store_dir)
+    return pd.DataFrame({col: decode_column(parts, spec) for col, (parts, spec) in arrays.items()}, copy=False)
+
+def load_tables(table='processed', trial_nums=None, columns=None, store_dir=STORE_DIR):
+    # stacks trials column by column with a categorical trial key, without building a frame per trial
+    if trial_nums is None:
+        trial_nums = list_trials(table, store_dir)
+
+    loaded = []
+    rows = []
+    ingested = []
+    for trial_num in trial_nums:
+        if not is_current(trial_num, table, store_dir):
+            if not ingest_trial(trial_num, [table], store_dir, index=False):
+                continue
+            ingested.append(trial_num)
+        loaded.append((trial_num, read_columns(trial_num, table, columns, store_dir)))
+        rows.append(load_schema(trial_num, table, store_dir)['rows'])
+    if ingested:
+        update_index(ingested, store_dir)
+    if not loaded:
+        return pd.DataFrame(columns=['trial'] + list(columns or []))
+
+    rows = np.array(rows, dtype=np.int64)
+    names = [t for t, _ in loaded]
+    stacked = {'trial': pd.Categorical.from_codes(np.repeat(np.arange(len(names), dtype=code_dtype(len(names))), rows),
+                                                  categories=names, validate=False)}
+
+    order = columns or list(dict.fromkeys(c for _, arrays in loaded for c in arrays))
+    for col in order:
+        parts = [arrays.get(col) for _, arrays in loaded]
+        specs = [p[1] for p in parts if p is not None]
+        if not specs:
+            continue
+        kind = specs[0]['kind']
+        if any(p is None for p in parts) or any(s['kind'] != kind for s in specs):
+            # column missing or typed differently in some trials: fall back to pandas alignment
+            frames = [pd.Series(decode_column(*p)) if p is not None else pd.Series(np.nan, index=range(n))
+                      for p, n in zip(parts, rows)]
+            stacked[col] = pd.concat(frames, ignore_index=True).to_numpy()
+        elif kind == 'category':
+            categories = list(dict.fromkeys(c for s in specs for c in s['categories']))
+            lookup = {c: i for i, c in enumerate(categories)}
+            codes = []
+            for arrays, spec in parts:
+                remap = np.append(np.array([lookup[c] for c in spec['categories']], dtype=np.int64), -1)
+                codes.append(remap[arrays['values']])
+            stacked[col] = pd.Categorical.from_codes(np.concatenate(codes).astype(code_dtype(len(categories))),
+                                                     categories=categories, validate=False)
+        elif kind == 'nullable':
+            values = np.concatenate([arrays['values'] for arrays, _ in parts])
+            mask = np.concatenate([arrays.get('mask', np.zeros(len(arrays['values']), dtype=bool)) for arrays, _ in parts])
+            stacked[col] = decode_column({'values': values, 'mask': mask}, dict(specs[0], mask=True))
+        else:
+            stacked[col] = np.concatenate([arrays['values'] for arrays, _ in parts])
+    return pd.DataFrame(stacked, copy=False)
+
+def export_csv(trial_num, table='processed', path=None, store_dir=STORE_DIR):
+    df = load_trial(trial_num, table, store_dir=store_dir)
+    if df is None:
+        return None
+    path = Path(path) if path else source_path(trial_num, table)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    df.to_csv(path, index=False)
+    return path
+
+def read_index(store_dir=STORE_DIR):
+    path = store_dir / 'index.csv'
+    if not path.exists():
+        return {}
+    with path.open(newline='') as f:
+        return {row['trial']: row for row in csv.DictReader(f)}
+
+def raw_metadata(trial_num):
+    manifest_file = RAW_DIR / f'trial_{trial_num}' / 'trial_manifest.json'
+    if not manifest_file.exists():
+        return {}
+    with manifest_file.open() as f:
+        manifest = json.load(f)
+    return {
+        'video_url': manifest.get('video_url', ''),
+        'trace': manifest.get('trace', ''),
+        'collected_at': manifest.get('started_at', ''),
+        'duration_seconds': manifest.get('duration', ''),
+        'status': manifest.get('status', ''),
+        'fidelity': manifest.get('collection_timing', {}).get('fidelity', ''),
+        'scenario': manifest.get('scenario', {}).get('id', '')
+    }
+
+def stored_tables(trial_num, store_dir=STORE_DIR):
+    return [t for t in TABLE_SOURCES if (table_dir(trial_num, t, store_dir) / 'schema.json').exists()]
+
+def update_index(trial_nums, store_dir=STORE_DIR):
+    # one rewrite per batch of trials, not per table; the lock keeps parallel workers from losing each other's rows
+    store_dir.mkdir(parents=True, exist_ok=True)
+    with (store_dir / 'index.lock').open('w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        index = read_index(store_dir)
+        now = datetime.now().isoformat(timespec='seconds')
+        for trial_num in trial_nums:
+            row = index.get(trial_num, {c: '' for c in INDEX_COLUMNS})
+            row.update({k: v for k, v in raw_metadata(trial_num).items() if v != ''})
+            row['trial'] = trial_num
+            row['tables'] = ';'.join(stored_tables(trial_num, store_dir))
+            if not row.get('duration_seconds') and load_schema(trial_num, 'processed', store_dir) is not None:
+                time_values = read_columns(trial_num, 'processed', ['time_seconds'], store_dir)['time_seconds'][0]['values']
+                row['duration_seconds'] = float(time_values[-1]) if len(time_values) else ''
+            row['updated_at'] = now
+            index[trial_num] = row
+
+        path = store_dir / 'index.csv'
+        tmp = path.with_suffix('.tmp')
+        with tmp.open('w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=INDEX_COLUMNS, extrasaction='ignore')
+            writer.writeheader()
+            for trial in sorted(index):
+                writer.writerow(index[trial])
+        os.replace(tmp, path)
+
+def list_trials(table='processed', store_dir=STORE_DIR):
+    # indexed trials come straight from index.csv; only names the index has not seen yet
+    # (fresh collections, copied-in trials) are checked on disk
+    index = read_index(store_dir)
+    listed = {t for t, row in index.items() if table in row.get('tables', '').split(';')}
+
+    base_dir, filename = TABLE_SOURCES[table]
+    if base_dir.exists():
+        for name in os.listdir(base_dir):
+            if name.startswith('trial_') and name[6:] not in listed and (base_dir / name / filename).exists():
+                listed.add(name[6:])
+    return sorted(listed)
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python trial_store.py ingest XXX [YYY ...] | --all")
+        print("       python trial_store.py export XXX [--table processed|quality|buffer|shaping|segments|playback|stalls] [--out FILE]")
+        print("       python trial_store.py list")
+        sys.exit(1)
+
+    command = sys.argv[1]
+    args = sys.argv[2:]
+
+    if command == 'ingest':
+        if '--all' in args:
+            trial_nums = sorted(set(list_trials('processed')) | set(list_trials('quality')))
+        else:
+            trial_nums = args
+        for trial_num in trial_nums:
+            stored = ingest_trial(trial_num, index=False)
+            print(f"Trial {trial_num}: stored {', '.join(stored) if stored else 'nothing'}")
+        update_index(trial_nums)
+
+    elif command == 'export':
+        table = 'processed'
+        out = None
+        trial_num = None
+        i = 0
+        while i < len(args):
+            if args[i] == '--table':
+                table = args[i + 1]
+                i += 2
+            elif args[i] == '--out':
+                out = args[i + 1]
+                i += 2
+            else:
+                trial_num = args[i]
+                i += 1
+        path = export_csv(trial_num, table, out)
+        if path is None:
+            print(f"Error: trial {trial_num} has no {table} table")
+            sys.exit(1)
+        print(f"Exported {path}")
+
+    elif command == 'list':
+        for row in read_index().values():
+            print(f"{row['trial']}  {row['tables']:<34} {row['trace'] or '-':<10} {row['collected_at'] or '-':<20} "
+                  f"{row['duration_seconds'] or '-':<8} {row.get('fidelity') or '-':<9} {row.get('scenario') or ''}".rstrip())
+
+    else:
+        print(f"Error: unknown command {command}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,251 @@
-import pandas as pd
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
 from pathlib import Path
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'collection'))
+from collector_config import BITRATE_MAP, POLLING_INTERVAL, PHASE1_DURATION, PHASE2_DURATION, PHASE3_DURATION
+from trial_store import PROC_DIR, STORE_DIR, list_trials, load_tables, raw_metadata, write_json
+from process_trial import GRID_STEP, SEGMENT_COLUMNS, TIMELINE_COLUMNS
+
+REPORT_FILE = PROC_DIR / 'validation_report.json'
+SHARD_SIZE = 250
+
+# trials without a manifest are expected to cover the default three-phase run
+DEFAULT_DURATION = PHASE1_DURATION + PHASE2_DURATION + PHASE3_DURATION
+# the last poll can land up to one interval before the end of the trial
+LENGTH_TOLERANCE_SECONDS = POLLING_INTERVAL
+MAX_BUFFER_SECONDS = 180
+# buffered media plays out at 1x, so the buffer cannot shrink faster than wall time (with a margin for sampling)
+MAX_DRAIN_RATE = 1.1
+# raw buffer logs are milestone events, so gaps are long; past this the interpolated buffer is a guess
+MAX_SAMPLE_GAP_SECONDS = 30
+BANDWIDTH_TOLERANCE_KBPS = 1
+
+CHECKS = ['length', 'nulls', 'time', 'sample_gap', 'resolution', 'buffer', 'phase']
+
+def expected_duration(trial_num):
+    duration = raw_metadata(trial_num).get('duration_seconds')
+    return float(duration) if duration not in (None, '') else DEFAULT_DURATION
+
+def resolution_keys(width, height):
+    return np.asarray(width, dtype=float) * 100000 + np.asarray(height, dtype=float)
+
+def schedule_mismatch(timeline, shaping, codes, trials):
+    # bandwidth the recorded shaping log had applied at each grid time, read with one merge_asof over all trials;
+    # trials without a log were processed against a trace and have no recorded schedule to compare with
+    shaping = shaping.assign(trial=shaping['trial'].astype(str), t=shaping['time_seconds'].astype(float))
+    shaping = shaping.sort_values(['trial', 't'], kind='stable')
+    if shaping.empty:
+        return np.zeros(len(timeline), dtype=bool)
+
+    grid = pd.DataFrame({'trial': trials[codes], 't': timeline['time_seconds'].values.astype(float),
+                         'row': np.arange(len(timeline))}).sort_values('t', kind='stable')
+    expected = pd.merge_asof(grid, shaping[['trial', 't', 'bandwidth_kbps']].sort_values('t', kind='stable'),
+                             on='t', by='trial', direction='backward').sort_values('row')
+    # the first step is applied during the preroll, so it also covers the rows before it was logged
+    first = shaping.groupby('trial')['bandwidth_kbps'].first()
+    kbps = expected['bandwidth_kbps'].fillna(expected['trial'].map(first)).values.astype(float)
+
+    actual = timeline['network_bandwidth_mbps'].values.astype(float) * 1000
+    return np.abs(actual - kbps) > BANDWIDTH_TOLERANCE_KBPS
+
+def check_timelines(timeline, buffer, shaping, durations):
+    # one columnar pass over the stacked (trial x time) frame: every check is a vectorized row mask,
+    # reduced to a per-trial count with a single bincount on the integer trial codes
+    if isinstance(timeline['trial'].dtype, pd.CategoricalDtype):
+        codes = timeline['trial'].cat.codes.values.astype(np.int64)
+        trials = np.asarray(timeline['trial'].cat.categories).astype(str)
+    else:
+        codes, trials = pd.factorize(timeline['trial'], sort=False)
+        trials = np.asarray(trials).astype(str)
+    n = len(trials)
+    per_trial = lambda mask: np.bincount(codes, weights=np.asarray(mask, dtype=float), minlength=n).astype(np.int64)
+
+    rows = np.bincount(codes, minlength=n)
+    time = timeline['time_seconds'].values.astype(float)
+    first = np.ones(len(timeline), dtype=bool)
+    first[1:] = codes[1:] != codes[:-1]
+    gap = np.diff(time, prepend=np.nan)
+    gap[first] = np.nan
+    step = pd.Series(gap).groupby(codes).first().reindex(range(n)).fillna(GRID_STEP).values
+    durations = np.array([durations.get(t, DEFAULT_DURATION) for t in trials])
+    expected_rows = np.floor(durations / step + 1e-9).astype(np.int64) + 1
+    shortfall = np.floor(LENGTH_TOLERANCE_SECONDS / step + 1e-9).astype(np.int64)
+
+    counts = {}
+    checked = [c for c in TIMELINE_COLUMNS if c in timeline and c not in SEGMENT_COLUMNS]
+    # segment bitrate is legitimately empty until the first video segment has finished
+    counts['nulls'] = per_trial(timeline[checked].isnull().any(axis=1))
+    counts['time'] = per_trial((gap <= 0) | (first & (time != 0)))
+
+    off_grid = ~first & (gap > 0) & (np.abs(gap - step[codes]) > 1e-6)
+    counts['sample_gap'] = per_trial(off_grid)
+    raw = buffer.assign(trial=buffer['trial'].astype(str), t=buffer['time_seconds'].astype(float))
+    raw = raw.sort_values(['trial', 't'], kind='stable')
+    raw_gap = raw['t'].diff().where(raw['trial'].eq(raw['trial'].shift()))
+    long_gaps = raw.loc[raw_gap > MAX_SAMPLE_GAP_SECONDS, 'trial'].value_counts()
+    raw_counts = long_gaps.reindex(trials).fillna(0).values.astype(np.int64)
+    counts['sample_gap'] = counts['sample_gap'] + raw_counts
+
+    width = timeline['resolution_width'].astype(float).values
+    height = timeline['resolution_height'].astype(float).values
+    known = np.isin(resolution_keys(width, height), resolution_keys(*zip(*BITRATE_MAP)))
+    counts['resolution'] = per_trial(~known & ~np.isnan(width) & ~np.isnan(height))
+
+    level = timeline['buffer_seconds'].values.astype(float)
+    drained = -np.diff(level, prepend=np.nan)
+    counts['buffer'] = per_trial((level < 0) | (level > MAX_BUFFER_SECONDS) |
+                                 (~first & (drained > MAX_DRAIN_RATE * gap + 1e-3)))
+
+    # a phase label may only change where the bandwidth does, and the bandwidth has to follow the recorded schedule
+    bandwidth = timeline['network_bandwidth_mbps'].values.astype(float)
+    phase_codes = timeline['network_phase'].astype('category').cat.codes.values
+    relabelled = np.diff(phase_codes, prepend=-2) != 0
+    rerated = np.diff(bandwidth, prepend=np.nan) != 0
+    counts['phase'] = per_trial((~first & (relabelled != rerated)) | schedule_mismatch(timeline, shaping, codes, trials))
+
+    results = []
+    for i, trial_num in enumerate(trials):
+        problems = {}
+        if not expected_rows[i] - shortfall[i] <= rows[i] <= expected_rows[i]:
+            problems['length'] = f"expected {expected_rows[i]}"
+        if counts['nulls'][i]:
+            problems['nulls'] = f"{counts['nulls'][i]} rows with missing values"
+        if counts['time'][i]:
+            problems['time'] = f"{counts['time'][i]} rows out of order"
+        gaps = []
+        if counts['sample_gap'][i] > raw_counts[i]:
+            gaps.append(f"{counts['sample_gap'][i] - raw_counts[i]} gaps off the {step[i]:g}s grid")
+        if raw_counts[i]:
+            gaps.append(f"{raw_counts[i]} raw buffer gaps over {MAX_SAMPLE_GAP_SECONDS}s")
+        if gaps:
+            problems['sample_gap'] = ', '.join(gaps)
+        if counts['resolution'][i]:
+            problems['resolution'] = f"{counts['resolution'][i]} rows at resolutions not in BITRATE_MAP"
+        if counts['buffer'][i]:
+            problems['buffer'] = f"{counts['buffer'][i]} rows with buffer outside 0-{MAX_BUFFER_SECONDS}s or draining faster than playback"
+        if counts['phase'][i]:
+            problems['phase'] = f"{counts['phase'][i]} rows off the recorded shaping schedule"
+        results.append({
+            'trial': trial_num,
+            'rows': int(rows[i]),
+            'expected_rows': int(expected_rows[i]),
+            'valid': not problems,
+            'counts': {check: int(counts[check][i]) for check in CHECKS if check in counts},
+            'problems': problems
+        })
+    return results
+
+def validate_shard(trial_nums, store_dir=STORE_DIR):
+    timeline = load_tables('processed', trial_nums, TIMELINE_COLUMNS, store_dir)
+    buffer = load_tables('buffer', trial_nums, ['time_seconds'], store_dir)
+    shaping = load_tables('shaping', trial_nums, ['time_seconds', 'bandwidth_kbps'], store_dir)
+    durations = {t: expected_duration(t) for t in trial_nums}
+
+    results = check_timelines(timeline, buffer, shaping, durations)
+    found = {r['trial'] for r in results}
+    results += [{'trial': t, 'rows': 0, 'expected_rows': None, 'valid': False, 'counts': {},
+                 'problems': {'length': 'not found'}} for t in trial_nums if t not in found]
+    return results
+
+def validate_trials(trial_nums, workers=1, shard_size=SHARD_SIZE, store_dir=STORE_DIR):
+    # yields each shard's results as soon as it finishes, so large corpora report progress as they go
+    shards = [trial_nums[i:i + shard_size] for i in range(0, len(trial_nums), shard_size)]
+    if workers <= 1 or len(shards) <= 1:
+        for shard in shards:
+            yield validate_shard(shard, store_dir)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(validate_shard, shard, store_dir) for shard in shards]
+        for future in as_completed(futures):
+            yield future.result()
+
+def print_result(result):
+    problems = '; '.join(result['problems'].values())
+    print(f"Trial {result['trial']}: {result['rows']} rows, {problems or 'OK'}")
+
+def build_report(results):
+    results = sorted(results, key=lambda r: r['trial'])
+    return {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'limits': {'default_duration_seconds': DEFAULT_DURATION, 'length_tolerance_seconds': LENGTH_TOLERANCE_SECONDS,
+                   'max_buffer_seconds': MAX_BUFFER_SECONDS, 'max_drain_rate': MAX_DRAIN_RATE,
+                   'max_sample_gap_seconds': MAX_SAMPLE_GAP_SECONDS,
+                   'bandwidth_tolerance_kbps': BANDWIDTH_TOLERANCE_KBPS},
+        'trials': len(results),
+        'valid': sum(r['valid'] for r in results),
+        'quarantined': [r['trial'] for r in results if not r['valid']],
+        'results': results
+    }
+
+def write_report(results, path=REPORT_FILE):
+    report = build_report(results)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_json(path, report)
+    return report
+
+def print_summary(report):
+    print(f"\n{report['valid']}/{report['trials']} trials valid")
+    if report['quarantined']:
+        print(f"Quarantined: {', '.join(report['quarantined'])}")
 
-def validate_trial(trial_num):
-    unified_file = Path(f'data/processed/trial_{trial_num}/unified_timeline.csv')
-    if not unified_file.exists():
-        print(f"Trial {trial_num}: not found")
-        return False
+def read_report(path=REPORT_FILE):
+    if not path.exists():
+        return None
+    with path.open() as f:
+        return json.load(f)
 
-    df = pd.read_csv(unified_file)
-    print(f"Trial {trial_num}: {len(df)} rows, ", end="")
+def quarantined_trials(path=REPORT_FILE):
+    report = read_report(path)
+    return set(report['quarantined']) if report else set()
 
-    if len(df) != 136:
-        print(f"expected 136")
-        return False
+def validate_timeline(timeline, buffer, shaping, path=REPORT_FILE):
+    # an already loaded timeline and raw logs (python -m scripts all) are checked without touching the store
+    durations = {t: expected_duration(t) for t in timeline['trial'].astype(str).unique()}
+    results = check_timelines(timeline, buffer, shaping, durations)
+    for result in results:
+        print_result(result)
+    report = write_report(results, path)
+    print_summary(report)
+    return report
 
-    missing = df.isnull().sum().sum()
-    if missing > 0:
-        print(f"{missing} missing values")
-        return False
+def validate_all(trial_nums=None, workers=1, shard_size=SHARD_SIZE, path=REPORT_FILE):
+    if trial_nums is None:
+        trial_nums = list_trials('processed')
+    results = []
+    for shard in validate_trials(trial_nums, workers, shard_size):
+        for result in shard:
+            print_result(result)
+        results += shard
+    report = write_report(results, path)
+    print_summary(report)
+    return report
 
-    print("OK")
-    return True
+def main():
+    workers = 1
+    shard_size = SHARD_SIZE
+    path = REPORT_FILE
 
-def validate_all():
-    proc_dir = Path('data/processed')
-    trial_dirs = sorted([d for d in proc_dir.iterdir() if d.is_dir() and d.name.startswith('trial_')])
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '--workers':
+            workers = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--shard-size':
+            shard_size = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--report':
+            path = Path(sys.argv[i + 1])
+            i += 2
+        else:
+            i += 1
 
-    valid = sum(validate_trial(d.name.split('_')[1]) for d in trial_dirs)
-    print(f"\n{valid}/{len(trial_dirs)} trials valid")
+    if validate_all(workers=workers, shard_size=shard_size, path=path)['quarantined']:
+        sys.exit(1)
 
 if __name__ == "__main__":
-    validate_all()
+    main()
@@ -0,0 +1,270 @@
+import asyncio
+import contextlib
+import csv
+import io
+import json
+import math
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'collection'))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'simulation'))
+from collector_config import *
+from network_trace import make_step
+from trial_writer import TrialWriter
+from page_scripts import VIDEO_STATE_JS
+from page_sampler import DRAIN_JS
+from cdp_collect import CDPVideoCollector, open_session
+from abr_simulator import make_ladder, sample_trial, simulate_batch
+from mock_devtools import MockDevTools, MockDriver, ScriptedPlayer
+
+REPORT_FILE = Path('data/benchmarks/collector_benchmark.csv')
+REPORT_COLUMNS = ['run_at', 'backend', 'duration', 'trajectory', 'eval_delay_ms', 'samples', 'latency_kind',
+                  'latency_p50_ms', 'latency_p95_ms', 'latency_max_ms', 'interval_expected_ms', 'interval_mean_ms',
+                  'jitter_p50_ms', 'jitter_p95_ms', 'jitter_max_ms', 'shaping_late_p50_ms', 'shaping_late_max_ms',
+                  'changes_true', 'changes_detected', 'detect_delay_p50_ms', 'detect_delay_max_ms',
+                  'spurious_changes', 'buffer_mae_seconds']
+BACKENDS = ['poll', 'sampler', 'cdp']
+BENCH_DURATION = 60
+BENCH_POLICY = 'buffer'
+
+def compressed_trace(duration):
+    # the three-phase trace squeezed into the benchmark duration
+    return [
+        make_step(0, PHASE1_BANDWIDTH_KBPS),
+        make_step(duration / 3, PHASE2_BANDWIDTH_KBPS),
+        make_step(2 * duration / 3, PHASE3_BANDWIDTH_KBPS)
+    ]
+
+def simulated_player(duration, policy=BENCH_POLICY, seed=0):
+    ladder = make_ladder()
+    result = simulate_batch([0], policy, compressed_trace(duration), duration, seed, ladder=ladder)
+    times, level, buffer = sample_trial(result, 0, duration)
+    return ScriptedPlayer(times, ladder['width'][level], ladder['height'][level], buffer)
+
+def recorded_player(trial_num, duration):
+    trial_dir = get_trial_dir(trial_num)
+    quality = pd.read_csv(trial_dir / 'quality_timeline.csv')
+    buffer = pd.read_csv(trial_dir / 'buffer_timeline.csv')
+    times = np.round(np.arange(0, duration + 0.05, 0.1), 3)
+    pos = np.maximum(np.searchsorted(quality['time_seconds'].to_numpy(), times, side='right') - 1, 0)
+    levels = np.interp(times, buffer['time_seconds'], buffer['buffer_seconds'])
+    return ScriptedPlayer(times, quality['resolution_width'].to_numpy()[pos],
+                          quality['resolution_height'].to_numpy()[pos], levels)
+
+def summarize(values):
+    if len(values) == 0:
+        return None, None, None
+    values = np.asarray(values)
+    return (round(float(np.percentile(values, 50)), 2), round(float(np.percentile(values, 95)), 2),
+            round(float(values.max()), 2))
+
+def interval_stats(times, expected_ms):
+    intervals = np.diff(times) * 1000
+    if len(intervals) == 0:
+        return {'interval_expected_ms': expected_ms}
+    p50, p95, worst = summarize(np.abs(intervals - expected_ms))
+    return {'interval_expected_ms': expected_ms, 'interval_mean_ms': round(float(intervals.mean()), 2),
+            'jitter_p50_ms': p50, 'jitter_p95_ms': p95, 'jitter_max_ms': worst}
+
+def shaping_stats(shaping_log, trace, duration):
+    # the collector's own lateness column only sees its side of the call; the mock stamps arrival.
+    # the t=0 step is re-issued while the player clock is still starting, so only later steps count
+    late = []
+    pos = 0
+    for step in trace:
+        if not 0 < step['time_seconds'] < duration:
+            continue
+        while pos < len(shaping_log) and shaping_log[pos][1] != step['bandwidth_kbps']:
+            pos += 1
+        if pos < len(shaping_log):
+            late.append((shaping_log[pos][0] - step['time_seconds']) * 1000)
+            pos += 1
+    p50, p95, worst = summarize(late)
+    return {'shaping_late_p50_ms': p50, 'shaping_late_max_ms': worst}
+
+def capture_stats(trial_dir, player, duration):
+    # match each true rendition switch to the first recorded switch to that rendition before the next true
+    # one; recorded timestamps may be floored to whole seconds, hence the one-second allowance
+    quality = pd.read_csv(trial_dir / 'quality_timeline.csv')
+    recorded = quality[quality['notes'] == 'quality_change']
+    truth = [c for c in player.changes() if c[0] < duration]
+    used = set()
+    delays = []
+    for k, (t, width, height) in enumerate(truth):
+        until = truth[k + 1][0] if k + 1 < len(truth) else float('inf')
+        hits = recorded[(recorded['time_seconds'] >= t - 1) & (recorded['time_seconds'] < until + 1)
+                        & (recorded['resolution_width'] == width) & (recorded['resolution_height'] == height)
+                        & ~recorded.index.isin(used)]
+        if len(hits):
+            used.add(hits.index[0])
+            delays.append((hits['time_seconds'].iloc[0] - t) * 1000)
+
+    buffer = pd.read_csv(trial_dir / 'buffer_timeline.csv')
+    buffer = buffer[buffer['time_seconds'] <= duration]
+    truth_buffer = np.interp(buffer['time_seconds'], player.times, player.buffer)
+    p50, p95, worst = summarize(delays)
+    return {'changes_true': len(truth), 'changes_detected': len(delays), 'detect_delay_p50_ms': p50,
+            'detect_delay_max_ms': worst, 'spurious_changes': len(recorded) - len(used),
+            'buffer_mae_seconds': round(float(np.abs(buffer['buffer_seconds'] - truth_buffer).mean()), 3)}
+
+def redirect_output(collector, out_dir):
+    # benchmark trials never touch data/raw
+    collector.output_dir = out_dir
+    collector.writer = TrialWriter(out_dir, collector.writer.fsync_policy)
+
+def run_selenium_backend(backend, player, duration, trace, mock, out_dir):
+    from auto_collect import VideoDataCollector
+    driver = MockDriver(mock.port)
+    collector = VideoDataCollector('bench', duration, use_sampler=backend == 'sampler', trace=trace,
+                                   trace_name='benchmark', driver=driver, countdown_seconds=0)
+    redirect_output(collector, out_dir)
+    try:
+        collector.collect(enable_shaping=True)
+    finally:
+        driver.quit()
+
+    # every main-loop round trip: state polls, or sampler drains; the first and last calls are the
+    # startup sample (or sampler start mark) and the closing sample, which are off the loop cadence
+    script = DRAIN_JS if backend == 'sampler' else VIDEO_STATE_JS
+    calls = [(sent, received) for s, sent, received in driver.round_trips if s == script][1:-1]
+    latency = [(received - sent) * 1000 for sent, received in calls]
+    if backend == 'sampler':
+        expected = math.ceil(SAMPLER_DRAIN_INTERVAL / POLLING_INTERVAL) * POLLING_INTERVAL
+    else:
+        expected = POLLING_INTERVAL
+    stats = {'samples': len(calls), 'latency_kind': 'round_trip'}
+    stats.update(zip(['latency_p50_ms', 'latency_p95_ms', 'latency_max_ms'], summarize(latency)))
+    stats.update(interval_stats([sent for sent, received in calls], round(expected * 1000, 1)))
+    return stats
+
+async def run_cdp_backend(player, duration, trace, mock, out_dir):
+    session = await open_session(mock.port)
+    deliveries = []
+    on_event = lambda params, received: deliveries.append(received - json.loads(params['payload'])['sent'])
+    session.on('Runtime.bindingCalled', on_event)
+    collector = CDPVideoCollector('bench', duration, port=mock.port, trace=trace, trace_name='benchmark',
+                                  countdown_seconds=0, session=session)
+    redirect_output(collector, out_dir)
+    try:
+        await collector.collect(enable_shaping=True)
+    finally:
+        await session.close()
+
+    # events are pushed, so latency is one-way delivery and jitter is measured on the page heartbeat
+    stats = {'samples': len(deliveries), 'latency_kind': 'one_way'}
+    stats.update(zip(['latency_p50_ms', 'latency_p95_ms', 'latency_max_ms'], summarize(np.array(deliveries) * 1000)))
+    stats.update(interval_stats(collector.heartbeat_times, CDP_HEARTBEAT_MS))
+    return stats
+
+def run_backend(backend, player, duration, trace, eval_delay_ms, verbose=False):
+    player.reset()
+    mock = MockDevTools(player, eval_delay_ms)
+    mock.start()
+    with tempfile.TemporaryDirectory() as tmp:
+        out_dir = Path(tmp) / 'trial_bench'
+        output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        try:
+            with output:
+                if backend == 'cdp':
+                    stats = asyncio.run(run_cdp_backend(player, duration, trace, mock, out_dir))
+                else:
+                    stats = run_selenium_backend(backend, player, duration, trace, mock, out_dir)
+        finally:
+            mock.stop()
+        stats.update(shaping_stats(mock.shaping_log, trace, duration))
+        stats.update(capture_stats(out_dir, player, duration))
+    return stats
+
+def append_report_row(row):
+    REPORT_FILE.parent.mkdir(parents=True, exist_ok=True)
+    new_file = not REPORT_FILE.exists()
+    with REPORT_FILE.open('a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+        if new_file:
+            writer.writeheader()
+        writer.writerow(row)
+
+def selenium_available():
+    try:
+        import selenium
+        return True
+    except ImportError:
+        return False
+
+def main():
+    backends = BACKENDS
+    duration = BENCH_DURATION
+    trial_num = None
+    policy = BENCH_POLICY
+    eval_delay_ms = 0
+    verbose = False
+
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '--backends':
+            backends = sys.argv[i + 1].split(',')
+            i += 2
+        elif sys.argv[i] == '--duration':
+            duration = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--trial':
+            trial_num = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--policy':
+            policy = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--eval-delay':
+            eval_delay_ms = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--verbose':
+            verbose = True
+            i += 1
+        else:
+            print("Usage: python collector_benchmark.py [--backends poll,sampler,cdp] [--duration N] "
+                  "[--trial XXX | --policy buffer|throughput|hybrid] [--eval-delay MS] [--verbose]")
+            sys.exit(1)
+
+    unknown = [b for b in backends if b not in BACKENDS]
+    if unknown:
+        print(f"Unknown backend(s): {', '.join(unknown)} (choose from {', '.join(BACKENDS)})")
+        sys.exit(1)
+    if not selenium_available() and any(b != 'cdp' for b in backends):
+        print("selenium is not installed, skipping the poll and sampler backends")
+        backends = [b for b in backends if b == 'cdp']
+
+    if trial_num:
+        player = recorded_player(trial_num, duration)
+        trajectory = f'trial_{trial_num}'
+    else:
+        player = simulated_player(duration, policy)
+        trajectory = f'simulated_{policy}'
+    trace = compressed_trace(duration)
+    run_at = datetime.now().isoformat(timespec='seconds')
+
+    print(f"Benchmarking {', '.join(backends)} for {duration}s each against a {trajectory} trajectory "
+          f"({len(player.changes())} rendition switches)")
+    for backend in backends:
+        start = time.monotonic()
+        stats = run_backend(backend, player, duration, trace, eval_delay_ms, verbose)
+        row = {'run_at': run_at, 'backend': backend, 'duration': duration, 'trajectory': trajectory,
+               'eval_delay_ms': eval_delay_ms, **stats}
+        append_report_row(row)
+        print(f"\n{backend} ({time.monotonic() - start:.0f}s)")
+        print(f"  {stats['latency_kind']} latency p50/p95/max: {stats['latency_p50_ms']}/{stats['latency_p95_ms']}/"
+              f"{stats['latency_max_ms']} ms over {stats['samples']} samples")
+        print(f"  loop interval {stats.get('interval_mean_ms')} ms (expected {stats['interval_expected_ms']}), "
+              f"jitter p50/p95/max: {stats.get('jitter_p50_ms')}/{stats.get('jitter_p95_ms')}/{stats.get('jitter_max_ms')} ms")
+        print(f"  shaping lateness p50/max: {stats['shaping_late_p50_ms']}/{stats['shaping_late_max_ms']} ms")
+        print(f"  switches detected {stats['changes_detected']}/{stats['changes_true']} "
+              f"(delay p50/max {stats['detect_delay_p50_ms']}/{stats['detect_delay_max_ms']} ms, "
+              f"{stats['spurious_changes']} spurious), buffer MAE {stats['buffer_mae_seconds']}s")
+    print(f"\nAppended to {REPORT_FILE}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+import asyncio
+import json
+import sys
+import threading
+import time
+from collections import deque
+from http import HTTPStatus
+from pathlib import Path
+import numpy as np
+from websockets.asyncio.server import serve
+from websockets.sync.client import connect
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'collection'))
+from collector_config import *
+from cdp_collect import BINDING_NAME, LISTENER_JS, STOP_LISTENERS_JS
+from page_scripts import READY_PROMISE_JS, READY_ASYNC_JS, RESET_PLAYER_JS, CURRENT_URL_JS, VIDEO_STATE_JS, as_expression
+from page_sampler import INSTALL_JS, DRAIN_JS, STOP_JS
+
+PAGE_PATH = '/devtools/page/mock'
+DRIVER_PATH = '/webdriver'
+TARGET_ID = 'mock'
+# Chrome throttles 'progress' to about one event per 350 ms while media is downloading
+PROGRESS_INTERVAL = 0.35
+FRAME_RATE = 30
+
+class ScriptedPlayer:
+    # a <video> element whose rendition and buffer follow a fixed trajectory; its clock starts at the
+    # first observation after the player reports ready, which is when a collector takes its startup sample
+    def __init__(self, times, width, height, buffer, url=YOUTUBE_VIDEO_URL):
+        self.times = np.asarray(times, dtype=float)
+        self.width = np.asarray(width)
+        self.height = np.asarray(height)
+        self.buffer = np.asarray(buffer, dtype=float)
+        self.url = url
+        self.armed = False
+        self.start = None
+
+    def reset(self):
+        self.armed = False
+        self.start = None
+
+    def arm(self):
+        self.armed = True
+
+    def clock(self):
+        if self.start is None:
+            if not self.armed:
+                return 0.0
+            self.start = time.monotonic()
+        return time.monotonic() - self.start
+
+    def state_at(self, t):
+        i = max(int(np.searchsorted(self.times, t, side='right')) - 1, 0)
+        buffer = float(np.interp(t, self.times, self.buffer))
+        # a clean decoder: every frame shown, no waiting/stalled intervals reported
+        return {'width': int(self.width[i]), 'height': int(self.height[i]), 'buffer': buffer, 'currentTime': t,
+                'droppedFrames': 0, 'totalFrames': int(t * FRAME_RATE), 'stalls': [], 'now': t * 1000}
+
+    def state(self):
+        return self.state_at(self.clock())
+
+    def changes(self):
+        # ground truth: when each rendition switch happens on the player clock
+        shown = self.height * 100000 + self.width
+        idx = np.flatnonzero(shown[1:] != shown[:-1]) + 1
+        return [(float(self.times[i]), int(self.width[i]), int(self.height[i])) for i in idx]
+
+class MockSampler:
+    # server side of page_sampler.INSTALL_JS: a ring buffer filled on a timer, stamped with a page clock
+    def __init__(self, player, epoch, interval_ms, capacity):
+        self.player = player
+        self.epoch = epoch
+        self.interval = interval_ms / 1000
+        self.samples = deque(maxlen=capacity)
+        self.dropped = 0
+        self.task = asyncio.ensure_future(self.run())
+
+    def now_ms(self):
+        return (time.monotonic() - self.epoch) * 1000
+
+    async def run(self):
+        deadline = time.monotonic()
+        while True:
+            deadline += self.interval
+            await asyncio.sleep(max(0, deadline - time.monotonic()))
+            if len(self.samples) == self.samples.maxlen:
+                self.dropped += 1
+            s = self.player.state()
+            self.samples.append([self.now_ms(), s['width'], s['height'], s['buffer'], s['currentTime'],
+                                 s['droppedFrames'], s['totalFrames']])
+
+    def drain(self):
+        result = {'samples': list(self.samples), 'dropped': self.dropped, 'stalls': [], 'now': self.now_ms()}
+        self.samples.clear()
+        self.dropped = 0
+        return result
+
+    def stop(self):
+        self.task.cancel()
+
+class MockDevTools:
+    # enough of Chrome's remote-debugging port for both collector backends: /json target discovery and a
+    # page websocket speaking CDP for cdp_collect, plus a websocket stand-in for chromedriver that answers
+    # the collector's execute_script calls by recognising the snippet
+    def __init__(self, player, eval_delay_ms=0):
+        self.player = player
+        self.eval_delay = eval_delay_ms / 1000
+        self.epoch = time.monotonic()
+        self.port = None
+        self.loop = None
+        self.thread = None
+        self.server = None
+        self.ready = threading.Event()
+        self.sampler = None
+        self.listeners = None
+        # every Network.emulateNetworkConditions as (player time, kbps), for shaping lateness
+        self.shaping_log = []
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run_loop, daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        return self.port
+
+    def run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.serve())
+
+    async def serve(self):
+        async with serve(self.handle, '127.0.0.1', 0, process_request=self.http, ping_interval=None,
+                         max_size=None, compression=None) as server:
+            self.server = server
+            self.port = server.sockets[0].getsockname()[1]
+            self.stopped = asyncio.Event()
+            self.ready.set()
+            await self.stopped.wait()
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopped.set)
+            self.thread.join()
+
+    def target(self):
+        return {'id': TARGET_ID, 'type': 'page', 'title': 'mock player', 'url': self.player.url,
+                'webSocketDebuggerUrl': f'ws://127.0.0.1:{self.port}{PAGE_PATH}'}
+
+    def http(self, connection, request):
+        if request.path in (PAGE_PATH, DRIVER_PATH):
+            return None
+        if request.path.rstrip('/') in ('/json', '/json/list'):
+            return connection.respond(HTTPStatus.OK, json.dumps([self.target()]))
+        if request.path.startswith('/json/new'):
+            return connection.respond(HTTPStatus.OK, json.dumps(self.target()))
+        if request.path.startswith('/json/close'):
+            return connection.respond(HTTPStatus.OK, 'Target is closing')
+        return connection.respond(HTTPStatus.NOT_FOUND, 'not found')
+
+    async def handle(self, ws):
+        if ws.request.path == DRIVER_PATH:
+            await self.handle_driver(ws)
+        else:
+            await self.handle_page(ws)
+
+    def navigate(self, url):
+        self.player.url = url
+        self.player.reset()
+
+    def ready_result(self):
+        self.player.arm()
+        s = self.player.state_at(0)
+        return {'state': 'playing', 'width': s['width'], 'height': s['height']}
+
+    def emulate(self, params):
+        kbps = params['downloadThroughput'] * 8 / 1024 if params['downloadThroughput'] >= 0 else None
+        if self.player.start is not None:
+            self.shaping_log.append((self.player.clock(), kbps))
+
+    def run_script(self, script, args):
+        # WebDriver bodies, or the same bodies wrapped by as_expression / called with arguments for CDP
+        if script in (VIDEO_STATE_JS, as_expression(VIDEO_STATE_JS)):
+            return self.player.state()
+        if script in (CURRENT_URL_JS, as_expression(CURRENT_URL_JS)):
+            return self.player.url
+        if script in (RESET_PLAYER_JS, as_expression(RESET_PLAYER_JS)):
+            self.player.reset()
+            return True
+        if script == READY_ASYNC_JS or script.startswith(READY_PROMISE_JS):
+            return self.ready_result()
+        if script == INSTALL_JS:
+            if self.sampler:
+                self.sampler.stop()
+            self.sampler = MockSampler(self.player, self.epoch, args[0], args[1])
+            return 'interval'
+        if script == DRAIN_JS:
+            self.player.clock()
+            return self.sampler.drain() if self.sampler else None
+        if script == STOP_JS:
+            if self.sampler:
+                self.sampler.stop()
+            return None
+        raise ValueError(f"mock page cannot evaluate: {script[:60]!r}")
+
+    async def handle_driver(self, ws):
+        async for raw in ws:
+            message = json.loads(raw)
+            if self.eval_delay:
+                await asyncio.sleep(self.eval_delay)
+            reply = {'id': message['id']}
+            try:
+                if message['kind'] == 'cdp':
+                    if message['cmd'] == 'Network.emulateNetworkConditions':
+                        self.emulate(message['params'])
+                    reply['value'] = {}
+                elif message['kind'] == 'get':
+                    self.navigate(message['url'])
+                    reply['value'] = None
+                else:
+                    reply['value'] = self.run_script(message['script'], message['args'])
+            except ValueError as e:
+                reply['error'] = str(e)
+            await ws.send(json.dumps(reply))
+
+    async def handle_page(self, ws):
+        try:
+            async for raw in ws:
+                message = json.loads(raw)
+                if self.eval_delay:
+                    await asyncio.sleep(self.eval_delay)
+                await ws.send(json.dumps(self.cdp_reply(ws, message)))
+        finally:
+            self.stop_listeners()
+
+    def cdp_reply(self, ws, message):
+        method = message['method']
+        params = message.get('params', {})
+        reply = {'id': message['id'], 'result': {}}
+        if method == 'Network.emulateNetworkConditions':
+            self.emulate(params)
+        elif method == 'Page.navigate':
+            self.navigate(params['url'])
+            asyncio.get_running_loop().call_later(0.05, self.fire, ws, 'Page.loadEventFired', {'timestamp': 0})
+        elif method == 'Runtime.evaluate':
+            expression = params['expression']
+            try:
+                if expression.startswith(LISTENER_JS):
+                    value = self.start_listeners(ws, int(expression[len(LISTENER_JS):].strip('()')))
+                elif expression == STOP_LISTENERS_JS:
+                    value = self.stop_listeners()
+                else:
+                    value = self.run_script(expression, [])
+                reply['result'] = {'result': {'type': 'object', 'value': value}}
+            except ValueError as e:
+                reply['result'] = {'result': {'type': 'undefined'},
+                                   'exceptionDetails': {'text': str(e), 'exception': {'description': str(e)}}}
+        return reply
+
+    def fire(self, ws, method, params):
+        asyncio.ensure_future(ws.send(json.dumps({'method': method, 'params': params})))
+
+    def emit(self, ws, kind):
+        # 'sent' is extra to what the page sends; the collector ignores it, the benchmark measures delivery with it
+        payload = dict(self.player.state(), type=kind, sent=time.monotonic())
+        self.fire(ws, 'Runtime.bindingCalled', {'name': BINDING_NAME, 'payload': json.dumps(payload),
+                                                'executionContextId': 1})
+
+    def start_listeners(self, ws, heartbeat_ms):
+        self.stop_listeners()
+        self.listeners = asyncio.ensure_future(self.run_listeners(ws, heartbeat_ms / 1000))
+        return True
+
+    def stop_listeners(self):
+        if self.listeners is not None:
+            self.listeners.cancel()
+            self.listeners = None
+        return None
+
+    async def run_listeners(self, ws, heartbeat):
+        # heartbeat and progress timers, 'resize' exactly at each rendition change, 'waiting' when the buffer runs dry
+        changes = [t for t, w, h in self.player.changes()]
+        now = self.player.clock()
+        timers = {'heartbeat': now + heartbeat, 'progress': now + PROGRESS_INTERVAL}
+        pending = [t for t in changes if t > now]
+        starved = self.player.state_at(now)['buffer'] <= 0
+        while True:
+            next_change = pending[0] if pending else float('inf')
+            kind, due = min(timers.items(), key=lambda item: item[1])
+            if next_change < due:
+                kind, due = 'resize', next_change
+            await asyncio.sleep(max(0, due - self.player.clock()))
+            if kind == 'resize':
+                pending.pop(0)
+            else:
+                timers[kind] = due + (heartbeat if kind == 'heartbeat' else PROGRESS_INTERVAL)
+            self.emit(ws, kind)
+            dry = self.player.state()['buffer'] <= 0
+            if dry and not starved:
+                self.emit(ws, 'waiting')
+            starved = dry
+
+class MockDriver:
+    # the subset of selenium's WebDriver the collectors use, talking to MockDevTools over a websocket
+    # so every call pays a real loopback round trip, like chromedriver's HTTP hop
+    def __init__(self, port):
+        self.ws = connect(f'ws://127.0.0.1:{port}{DRIVER_PATH}', compression=None, ping_interval=None, max_size=None)
+        self.next_id = 0
+        self.lock = threading.Lock()
+        self.round_trips = []
+
+    def call(self, message):
+        with self.lock:
+            self.next_id += 1
+            message['id'] = self.next_id
+            sent = time.monotonic()
+            self.ws.send(json.dumps(message))
+            reply = json.loads(self.ws.recv())
+            received = time.monotonic()
+        self.round_trips.append((message.get('script'), sent, received))
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply['value']
+
+    def execute_script(self, script, *args):
+        return self.call({'kind': 'script', 'script': script, 'args': list(args)})
+
+    def execute_async_script(self, script, *args):
+        return self.call({'kind': 'script', 'script': script, 'args': list(args)})
+
+    def execute_cdp_cmd(self, cmd, params):
+        return self.call({'kind': 'cdp', 'cmd': cmd, 'params': params})
+
+    def get(self, url):
+        return self.call({'kind': 'get', 'url': url})
+
+    def set_script_timeout(self, seconds):
+        pass
+
+    def quit(self):
+        self.ws.close()
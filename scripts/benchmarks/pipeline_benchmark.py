@@ -0,0 +1,289 @@
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent
+REPO_DIR = SCRIPTS_DIR.parent
+for sub in ('collection', 'analysis', 'visualization', 'simulation'):
+    sys.path.insert(0, str(SCRIPTS_DIR / sub))
+
+HISTORY_FILE = REPO_DIR / 'data' / 'benchmarks' / 'pipeline_history.jsonl'
+STAGES = ['generate', 'process', 'metrics', 'validate', 'latency', 'bands_plot', 'timeline_plots', 'comparison_plots']
+# 5 / 1k / 50k trials are the target scales; 50k is opt-in because it takes a while
+DEFAULT_TRIALS = [5, 1000]
+DEFAULT_SAMPLES = [1.0, 0.1]
+BENCH_DURATION = 135
+TRIAL_PREFIX = 'bench'
+GENERATE_BATCH = 500
+# figures per timeline-plot run, and the trial count above which per-trial comparison charts are skipped
+PLOT_LIMIT = 20
+COMPARISON_LIMIT = 1000
+
+def generate_trials(trial_nums, duration, sample_seconds, seed=0):
+    # simulated trajectories written as dense raw logs: one quality and one buffer row per sample
+    import numpy as np
+    import pandas as pd
+    from abr_simulator import make_ladder, sample_trial, shaping_rows, simulate_batch
+    from network_trace import default_trace
+    from trial_writer import BUFFER_COLUMNS, QUALITY_COLUMNS, SHAPING_COLUMNS
+
+    ladder = make_ladder()
+    trace = default_trace()
+    shaping = pd.DataFrame(shaping_rows(trace, duration), columns=SHAPING_COLUMNS)
+    rows = 0
+    for start in range(0, len(trial_nums), GENERATE_BATCH):
+        batch = trial_nums[start:start + GENERATE_BATCH]
+        result = simulate_batch(list(range(start, start + len(batch))), 'hybrid', trace, duration, seed, ladder=ladder)
+        for row, trial_num in enumerate(batch):
+            times, level, buffer = sample_trial(result, row, duration, sample_seconds)
+            trial_dir = Path('data/raw') / f'trial_{trial_num}'
+            trial_dir.mkdir(parents=True, exist_ok=True)
+            quality = pd.DataFrame({'time_seconds': times, 'resolution_width': ladder['width'][level],
+                                    'resolution_height': ladder['height'][level],
+                                    'bitrate_kbps': ladder['kbps'][level].astype(int), 'notes': 'sample'})
+            buffers = pd.DataFrame({'time_seconds': times, 'buffer_seconds': np.round(buffer, 1), 'notes': 'sample'})
+            quality[QUALITY_COLUMNS].to_csv(trial_dir / 'quality_timeline.csv', index=False)
+            buffers[BUFFER_COLUMNS].to_csv(trial_dir / 'buffer_timeline.csv', index=False)
+            shaping.to_csv(trial_dir / 'shaping_timeline.csv', index=False)
+            rows += len(times)
+    return rows
+
+def run_stage(stage, params):
+    trial_nums = params['trials']
+    quiet = contextlib.redirect_stdout(io.StringIO())
+
+    if stage == 'generate':
+        return generate_trials(trial_nums, params['duration'], params['sample_seconds'])
+    if stage == 'process':
+        from process_trial import process_trials, write_unified_timelines
+        timeline = process_trials(trial_nums, params['sample_seconds'])
+        write_unified_timelines(timeline)
+        return len(timeline)
+    if stage == 'metrics':
+        from calculate_metrics import calculate_metrics
+        summary = calculate_metrics(trial_nums, params['workers'])
+        summary.to_csv('data/processed/metrics_summary.csv', index=False)
+        return len(summary)
+    if stage == 'validate':
+        from validate_data import validate_all
+        with quiet:
+            return validate_all(trial_nums, params['workers'])['valid']
+    if stage == 'latency':
+        from adaptation_latency import compute_latency, load_raw_trials
+        return len(compute_latency(trial_nums, *load_raw_trials(trial_nums)))
+    if stage == 'bands_plot':
+        from plot_bands import plot_bands
+        Path('figures').mkdir(exist_ok=True)
+        plot_bands(trial_nums)
+        return len(trial_nums)
+    if stage == 'timeline_plots':
+        from batch_render import render_timelines
+        rendered, skipped = render_timelines(trial_nums[:params['plot_limit']], params['workers'], force=True)
+        return len(rendered)
+    if stage == 'comparison_plots':
+        if len(trial_nums) > COMPARISON_LIMIT:
+            return None
+        import plot_comparison
+        Path('figures').mkdir(exist_ok=True)
+        plot_comparison.plot_metrics_comparison()
+        plot_comparison.plot_bitrate_overlay()
+        return len(trial_nums)
+    raise ValueError(f"Unknown stage: {stage}")
+
+def stage_worker(stage, params, workdir, trace_memory, queue):
+    # a fresh interpreter per stage, so peak RSS is the stage's own and nothing is cached from the one before
+    import resource
+    import tracemalloc
+    os.environ['MPLBACKEND'] = 'Agg'
+    os.chdir(workdir)
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        units = run_stage(stage, params)
+        error = None
+    except Exception as e:
+        units, error = None, f"{type(e).__name__}: {e}"
+    seconds = time.perf_counter() - start
+    result = {'seconds': round(seconds, 4), 'units': units, 'error': error,
+              'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    if trace_memory:
+        result['traced_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        tracemalloc.stop()
+    queue.put(result)
+
+def time_stage(stage, params, workdir, trace_memory):
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=stage_worker, args=(stage, params, workdir, trace_memory, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+def commit_id():
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                             text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR,
+                               capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return rev + ('-dirty' if dirty else '')
+
+def prepare_workdir(workdir, params):
+    # raw data is reused between runs with the same generator settings; outputs always start empty
+    key = {k: params[k] for k in ('n_trials', 'duration', 'sample_seconds')}
+    marker = workdir / 'dataset.json'
+    reuse = marker.exists() and json.loads(marker.read_text()) == key
+    for sub in ('data/processed', 'data/store', 'figures') + (() if reuse else ('data/raw',)):
+        shutil.rmtree(workdir / sub, ignore_errors=True)
+    (workdir / 'data' / 'processed').mkdir(parents=True, exist_ok=True)
+    if not reuse and marker.exists():
+        marker.unlink()
+    return reuse, marker, key
+
+def run_scale(n_trials, sample_seconds, duration, stages, workers, plot_limit, trace_memory, workdir, run):
+    params = {'n_trials': n_trials, 'duration': duration, 'sample_seconds': sample_seconds, 'workers': workers,
+              'plot_limit': plot_limit, 'trials': [f'{TRIAL_PREFIX}{n:06d}' for n in range(1, n_trials + 1)]}
+    reuse, marker, key = prepare_workdir(workdir, params)
+
+    records = []
+    for stage in stages:
+        if stage == 'generate' and reuse:
+            print(f"  {stage:<17} reused {workdir / 'data' / 'raw'}")
+            continue
+        result = time_stage(stage, params, str(workdir), trace_memory)
+        if stage == 'generate' and result['error'] is None:
+            marker.write_text(json.dumps(key))
+        record = dict(run, trials=n_trials, duration=duration, sample_seconds=sample_seconds, workers=workers,
+                      stage=stage, **result)
+        records.append(record)
+        if result['error']:
+            status = result['error']
+        elif result['units'] is None:
+            status = 'skipped'
+        else:
+            status = f"{result['seconds']:8.2f}s  {result['max_rss_mb']:8.1f} MB rss"
+            if trace_memory:
+                status += f"  {result['traced_peak_mb']:8.1f} MB traced"
+        print(f"  {stage:<17} {status}", flush=True)
+    return records
+
+def append_history(records):
+    HISTORY_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with HISTORY_FILE.open('a') as f:
+        for record in records:
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+
+def load_history():
+    if not HISTORY_FILE.exists():
+        return []
+    with HISTORY_FILE.open() as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def compare(records, history):
+    # each stage against the latest earlier run at the same scale
+    def scale(r):
+        return (r['trials'], r['duration'], r['sample_seconds'], r['workers'], r['stage'])
+
+    print("\nvs previous run at the same scale:")
+    for record in records:
+        earlier = [h for h in history if scale(h) == scale(record) and h['run_id'] != record['run_id']
+                   and h['error'] is None and h['units'] is not None]
+        if not earlier or record['error'] or record['units'] is None:
+            continue
+        prev = earlier[-1]
+        time_change = (record['seconds'] / prev['seconds'] - 1) * 100 if prev['seconds'] else 0
+        rss_change = (record['max_rss_mb'] / prev['max_rss_mb'] - 1) * 100 if prev['max_rss_mb'] else 0
+        print(f"  {record['trials']:>6} trials {record['sample_seconds']:g}s  {record['stage']:<17} "
+              f"{time_change:+6.1f}% time  {rss_change:+6.1f}% rss  (vs {prev['commit']}, {prev['run_at']})")
+
+def main():
+    trial_counts = DEFAULT_TRIALS
+    samples = DEFAULT_SAMPLES
+    duration = BENCH_DURATION
+    stages = STAGES
+    workers = 1
+    plot_limit = PLOT_LIMIT
+    trace_memory = False
+    workdir = None
+    show_compare = False
+
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+        if arg == '--trials':
+            trial_counts = [int(n) for n in sys.argv[i + 1].split(',')]
+            i += 2
+        elif arg == '--sample':
+            samples = [float(s) for s in sys.argv[i + 1].split(',')]
+            i += 2
+        elif arg == '--duration':
+            duration = int(sys.argv[i + 1])
+            i += 2
+        elif arg == '--stages':
+            stages = sys.argv[i + 1].split(',')
+            i += 2
+        elif arg == '--workers':
+            workers = int(sys.argv[i + 1])
+            i += 2
+        elif arg == '--plot-limit':
+            plot_limit = int(sys.argv[i + 1])
+            i += 2
+        elif arg == '--tracemalloc':
+            trace_memory = True
+            i += 1
+        elif arg == '--workdir':
+            workdir = Path(sys.argv[i + 1]).resolve()
+            i += 2
+        elif arg == '--compare':
+            show_compare = True
+            i += 1
+        else:
+            print("Usage: python pipeline_benchmark.py [--trials 5,1000,50000] [--sample 1,0.1] [--duration S] "
+                  f"[--stages {','.join(STAGES)}] [--workers N] [--plot-limit N] [--tracemalloc] "
+                  "[--workdir DIR] [--compare]")
+            sys.exit(1)
+
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        print(f"Unknown stage(s): {', '.join(unknown)} (choose from {', '.join(STAGES)})")
+        sys.exit(1)
+    if 'generate' not in stages:
+        stages = ['generate'] + stages
+
+    run = {'run_id': datetime.now().strftime('%Y%m%dT%H%M%S%f'), 'run_at': datetime.now().isoformat(timespec='seconds'),
+           'commit': commit_id(), 'python': platform.python_version(), 'machine': platform.machine(),
+           'cpu_count': os.cpu_count()}
+    history = load_history()
+
+    records = []
+    with contextlib.ExitStack() as stack:
+        base = workdir or Path(stack.enter_context(tempfile.TemporaryDirectory(prefix='pipeline_bench_')))
+        for n_trials in trial_counts:
+            for sample_seconds in samples:
+                print(f"{n_trials} trials x {duration}s at {sample_seconds:g}s sampling ({run['commit']})")
+                scale_dir = base / f'{n_trials}_{sample_seconds:g}s_{duration}s'
+                scale_dir.mkdir(parents=True, exist_ok=True)
+                scale_records = run_scale(n_trials, sample_seconds, duration, stages, workers, plot_limit,
+                                          trace_memory, scale_dir, run)
+                append_history(scale_records)
+                records += scale_records
+
+    print(f"\nAppended {len(records)} results to {HISTORY_FILE}")
+    if show_compare:
+        compare(records, history + records)
+
+if __name__ == "__main__":
+    main()
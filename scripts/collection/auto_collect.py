@@ -1,101 +1,104 @@
 import time
 import sys
-import csv
 import socket
+import threading
 from pathlib import Path
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.common.exceptions import WebDriverException
 from collector_config import *
-
-class VideoDataCollector:
-    def __init__(self, trial_num, duration, is_test=False):
-        self.trial_num = trial_num
+from page_sampler import PageSampler
+from page_scripts import READY_ASYNC_JS, RESET_PLAYER_JS, CURRENT_URL_JS, VIDEO_STATE_JS
+from network_trace import default_trace, load_trace, step_at, describe_step
+from shaping_scheduler import ShapingScheduler
+from trial_recorder import TrialRecorder
+from collector_timing import CollectorTiming
+from live_metrics import LiveServer
+
+def verify_chrome_connection():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    result = sock.connect_ex(('127.0.0.1', CHROME_DEBUGGING_PORT))
+    sock.close()
+    return result == 0
+
+def create_driver():
+    print(f"Connecting to Chrome on port {CHROME_DEBUGGING_PORT}...")
+
+    if not verify_chrome_connection():
+        print(f"Error: Cannot connect to Chrome on port {CHROME_DEBUGGING_PORT}")
+        print("Please run: ./scripts/collection/launch_chrome.sh")
+        return None
+
+    chrome_options = Options()
+    chrome_options.add_experimental_option("debuggerAddress", f"127.0.0.1:{CHROME_DEBUGGING_PORT}")
+    for opt in CHROME_OPTIONS:
+        chrome_options.add_argument(opt)
+
+    try:
+        driver = webdriver.Chrome(options=chrome_options)
+        print("Connected successfully")
+        return driver
+    except WebDriverException as e:
+        print(f"Error connecting to Chrome: {e}")
+        return None
+
+class VideoDataCollector(TrialRecorder):
+    def __init__(self, trial_num, duration, is_test=False, use_sampler=False,
+                 sample_interval_ms=SAMPLER_INTERVAL_MS, frame_callback=False,
+                 fsync_policy=WRITER_FSYNC_POLICY, trace=None, trace_name='default', driver=None,
+                 countdown_seconds=5, live_server=None):
+        super().__init__(trial_num, is_test, fsync_policy, live_server)
         self.duration = duration
-        self.is_test = is_test
-
-        if is_test:
-            self.output_dir = get_test_dir()
-        else:
-            self.output_dir = get_trial_dir(trial_num)
+        self.use_sampler = use_sampler
+        self.sample_interval_ms = sample_interval_ms
+        self.frame_callback = frame_callback
 
-        self.driver = None
-        self.quality_events = []
-        self.buffer_events = []
+        self.trace = trace or default_trace()
+        self.trace_name = trace_name
 
-        self.last_width = None
-        self.last_height = None
-        self.last_buffer_milestone = -1
-        self.last_forced_record = -1
+        self.countdown_seconds = countdown_seconds
 
-    def verify_chrome_connection(self):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        result = sock.connect_ex(('127.0.0.1', CHROME_DEBUGGING_PORT))
-        sock.close()
-        return result == 0
+        # a driver handed in belongs to a long-lived session that outlives this trial
+        self.driver = driver
+        self.owns_driver = driver is None
+        # selenium is not thread-safe and the shaping scheduler issues CDP commands from its own thread
+        self.driver_lock = threading.Lock()
+        self.sampler = None
+        self.timing = None
 
     def connect_to_chrome(self):
-        print(f"Connecting to Chrome on port {CHROME_DEBUGGING_PORT}...")
-
-        if not self.verify_chrome_connection():
-            print(f"Error: Cannot connect to Chrome on port {CHROME_DEBUGGING_PORT}")
-            print("Please run: ./scripts/collection/launch_chrome.sh")
-            return False
-
-        chrome_options = Options()
-        chrome_options.add_experimental_option("debuggerAddress", f"127.0.0.1:{CHROME_DEBUGGING_PORT}")
-        for opt in CHROME_OPTIONS:
-            chrome_options.add_argument(opt)
-
-        try:
-            self.driver = webdriver.Chrome(options=chrome_options)
-            print("Connected successfully")
-            return True
-        except WebDriverException as e:
-            print(f"Error connecting to Chrome: {e}")
+        self.driver = create_driver()
+        return self.driver is not None
+
+    def clear_session_state(self):
+        # drop whatever the previous trial in this session left behind
+        self.disable_network_throttling()
+        with self.driver_lock:
+            self.driver.execute_cdp_cmd('Network.clearBrowserCache', {})
+
+    def wait_for_video(self):
+        rewound = False
+        if not self.owns_driver:
+            self.clear_session_state()
+            if SESSION_RESET == 'seek' and self.driver.execute_script(CURRENT_URL_JS).startswith(YOUTUBE_VIDEO_URL):
+                rewound = self.driver.execute_script(RESET_PLAYER_JS)
+
+        if not rewound:
+            print("Loading YouTube video...")
+            self.driver.get(YOUTUBE_VIDEO_URL)
+
+        self.driver.set_script_timeout(PLAYER_READY_TIMEOUT + 5)
+        result = self.driver.execute_async_script(READY_ASYNC_JS, PLAYER_READY_TIMEOUT * 1000)
+        if result['state'] != 'playing':
+            print(f"Error: Video did not start playing within {PLAYER_READY_TIMEOUT}s")
             return False
 
-    def wait_for_video(self, retries=3):
-        print("Loading YouTube video...")
-        self.driver.get(YOUTUBE_VIDEO_URL)
-
-        for attempt in range(retries):
-            time.sleep(3)
-            js_code = "return document.querySelector('video') !== null;"
-            if self.driver.execute_script(js_code):
-                width = self.driver.execute_script("return document.querySelector('video').videoWidth;")
-                height = self.driver.execute_script("return document.querySelector('video').videoHeight;")
-                if width > 0 and height > 0:
-                    print(f"Video loaded: {width}x{height}")
-                    return True
-
-        print("Error: Video failed to load after 3 retries")
-        return False
-
-    def click_play_button(self):
-        js_code = """
-        const video = document.querySelector('video');
-        if (video && video.paused) {
-            const playButton = document.querySelector('.ytp-play-button');
-            if (playButton) {
-                playButton.click();
-                return 'clicked';
-            }
-            return 'no_button';
-        }
-        return 'already_playing';
-        """
-        result = self.driver.execute_script(js_code)
-        if result == 'clicked':
-            print("Clicked play button")
-            time.sleep(1)
-        elif result == 'already_playing':
-            print("Video already playing")
-            time.sleep(0.5)
-        else:
-            time.sleep(0.5)
+        print(f"Video playing: {result['width']}x{result['height']}")
+        return True
 
     def countdown(self, seconds=5):
+        if seconds <= 0:
+            return
         trial_label = "test" if self.is_test else self.trial_num
         print(f"Trial {trial_label} ready. Starting collection in {seconds} seconds...")
         for i in range(seconds, 0, -1):
@@ -104,192 +107,232 @@ class VideoDataCollector:
         print("Collecting")
 
     def extract_video_data(self):
-        js_code = """
-        const video = document.querySelector('video');
-        if (!video) return null;
-        return {
-            width: video.videoWidth,
-            height: video.videoHeight,
-            buffer: video.buffered.length > 0 ?
-                    video.buffered.end(0) - video.currentTime : 0,
-            currentTime: video.currentTime
-        };
-        """
-        return self.driver.execute_script(js_code)
-
-    def detect_quality_change(self, width, height):
-        if self.last_width is None or self.last_height is None:
-            return True
-        return (width, height) != (self.last_width, self.last_height)
-
-    def detect_buffer_milestone(self, buffer_seconds):
-        current_milestone = int(buffer_seconds // 5) * 5
-        if current_milestone > self.last_buffer_milestone and current_milestone in BUFFER_MILESTONES:
-            return True
-        return False
-
-    def estimate_bitrate(self, width, height):
-        return BITRATE_MAP.get((width, height), 1200)
+        with self.driver_lock:
+            return self.driver.execute_script(VIDEO_STATE_JS)
 
     def enable_network_throttling(self, download_kbps, upload_kbps, latency_ms):
-        self.driver.execute_cdp_cmd('Network.emulateNetworkConditions', {
-            'offline': False,
-            'downloadThroughput': download_kbps * 1024 / 8,
-            'uploadThroughput': upload_kbps * 1024 / 8,
-            'latency': latency_ms
-        })
+        with self.driver_lock:
+            self.driver.execute_cdp_cmd('Network.emulateNetworkConditions', {
+                'offline': False,
+                'downloadThroughput': download_kbps * 1024 / 8,
+                'uploadThroughput': upload_kbps * 1024 / 8,
+                'latency': latency_ms
+            })
 
     def disable_network_throttling(self):
-        self.driver.execute_cdp_cmd('Network.emulateNetworkConditions', {
-            'offline': False,
-            'downloadThroughput': -1,
-            'uploadThroughput': -1,
-            'latency': 0
-        })
-
-    def apply_network_phase(self, phase):
-        if phase == 1 or phase == 3:
-            self.enable_network_throttling(PHASE1_BANDWIDTH_KBPS, PHASE1_BANDWIDTH_KBPS, LATENCY_MS)
-            print(f"[Phase {phase}] Network: 20 Mbps, 40ms latency")
-        elif phase == 2:
-            self.enable_network_throttling(PHASE2_BANDWIDTH_KBPS, PHASE2_BANDWIDTH_KBPS, LATENCY_MS)
-            print(f"[Phase {phase}] Network: 1.5 Mbps, 40ms latency")
-
-    def record_quality_event(self, timestamp, width, height, note=""):
-        bitrate = self.estimate_bitrate(width, height)
-        self.quality_events.append([timestamp, width, height, bitrate, note])
-        self.last_width = width
-        self.last_height = height
-
-    def record_buffer_event(self, timestamp, buffer_seconds, note=""):
-        self.buffer_events.append([timestamp, round(buffer_seconds, 1), note])
-        current_milestone = int(buffer_seconds // 5) * 5
-        if current_milestone > self.last_buffer_milestone:
-            self.last_buffer_milestone = current_milestone
-
-    def write_csv_files(self):
-        print("Writing CSV files...")
-        self.output_dir.mkdir(parents=True, exist_ok=True)
-
-        quality_file = self.output_dir / 'quality_timeline.csv'
-        with quality_file.open('w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['time_seconds', 'resolution_width', 'resolution_height', 'bitrate_kbps', 'notes'])
-            for event in self.quality_events:
-                writer.writerow(event)
-
-        buffer_file = self.output_dir / 'buffer_timeline.csv'
-        with buffer_file.open('w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['time_seconds', 'buffer_seconds', 'notes'])
-            for event in self.buffer_events:
-                writer.writerow(event)
+        with self.driver_lock:
+            self.driver.execute_cdp_cmd('Network.emulateNetworkConditions', {
+                'offline': False,
+                'downloadThroughput': -1,
+                'uploadThroughput': -1,
+                'latency': 0
+            })
+
+    def apply_trace_step(self, step):
+        self.enable_network_throttling(step['bandwidth_kbps'], step['bandwidth_kbps'], step['latency_ms'])
+
+    def sample_timestamp(self, elapsed):
+        # sampler mode keeps sub-second resolution, polling mode keeps whole seconds
+        if self.sampler:
+            return round(elapsed, 1)
+        return int(elapsed)
+
+    def drain_sampler(self):
+        with self.driver_lock:
+            samples, playback = self.sampler.drain()
+        for sample in samples:
+            if sample['elapsed'] < 0:
+                continue
+            timestamp = self.sample_timestamp(self.time_offset + sample['elapsed'])
+            self.handle_sample(timestamp, sample['width'], sample['height'], sample['buffer'])
+            self.record_frames(timestamp, sample)
+        # frame counters came with every sample; this hands over the stalls that closed since the last drain
+        if playback is not None:
+            self.record_playback(self.time_offset + playback['elapsed'], playback, frames=False)
+
+    def record_shaping_event(self, step, applied_at):
+        super().record_shaping_event(step, applied_at)
+        if self.timing is not None:
+            self.timing.record_shaping((applied_at - step['time_seconds']) * 1000)
+
+    def finish_timing(self):
+        summary = self.timing.summary()
+        self.writer.set_metadata('collection_timing', summary)
+        self.timing.report(summary)
+
+    def release_driver(self):
+        if self.owns_driver:
+            self.driver.quit()
 
-        trial_label = "test" if self.is_test else self.trial_num
-        print(f"Saved: {quality_file} ({len(self.quality_events)} events)")
-        print(f"Saved: {buffer_file} ({len(self.buffer_events)} events)")
-        print(f"Collection complete: trial_{trial_label}")
+    def release_browser(self, enable_shaping):
+        if enable_shaping:
+            self.disable_network_throttling()
+        self.release_driver()
 
-    def collect(self, enable_shaping=False):
-        if not self.connect_to_chrome():
+    def collect(self, enable_shaping=False, resume=False):
+        if self.driver is None and not self.connect_to_chrome():
             return False
 
         if not self.wait_for_video():
-            self.driver.quit()
+            self.release_driver()
             return False
 
-        self.click_play_button()
+        try:
+            offset = self.open_trial_files(self.duration, resume)
+        except FileExistsError as e:
+            print(f"Error: {e}")
+            self.release_driver()
+            return False
+        if offset is None:
+            self.release_driver()
+            return True
 
+        self.writer.set_metadata('video_url', YOUTUBE_VIDEO_URL)
+        self.timing = CollectorTiming(self.writer)
+        self.timing.open(resume=offset > 0)
+        scheduler = None
         if enable_shaping:
-            self.apply_network_phase(1)
+            # shape for the preroll too, the scheduler re-issues this step at t=offset
+            step = step_at(self.trace, offset)
+            self.apply_trace_step(step)
+            print(f"[Preroll] Network: {describe_step(step)} ({self.trace_name} trace)")
+            self.writer.set_metadata('trace', self.trace_name)
+            self.live.set_trace(self.trace)
+            scheduler = ShapingScheduler(self.trace, self.apply_trace_step, self.record_shaping_event)
+
+        if self.use_sampler:
+            self.sampler = PageSampler(self.driver, self.sample_interval_ms, SAMPLER_CAPACITY, self.frame_callback)
+            with self.driver_lock:
+                self.sampler.install()
 
-        self.countdown()
-
-        start_time = time.time()
-        last_status_print = 0
-        current_phase = 1
-
-        data = self.extract_video_data()
+        try:
+            self.countdown(self.countdown_seconds)
+            self.run_collection_loop(scheduler)
+        except BaseException:
+            # keep everything flushed so far so the trial can be continued with --resume, and don't leave
+            # the browser throttled at whatever trace step was active
+            if scheduler is not None:
+                scheduler.stop()
+            self.finish_timing()
+            try:
+                self.release_browser(enable_shaping)
+            except Exception as e:
+                print(f"Warning: could not reset the browser after the interruption ({e})")
+            self.finish_trial_files('interrupted')
+            raise
+
+        aborted = self.live.abort.is_set()
+        if aborted:
+            print(f"[{self.live.trial_time():.1f}s] Collection aborted")
+        else:
+            print(f"[{self.duration}s] Collection complete")
+        self.finish_timing()
+        self.release_browser(enable_shaping)
+        self.finish_trial_files('aborted' if aborted else 'complete')
+        return not aborted
+
+    def run_collection_loop(self, scheduler):
+        start_time = time.monotonic()
+        last_drain = self.time_offset
+        end_time = start_time + self.duration - self.time_offset
+
+        self.live.start(start_time, self.time_offset)
+        # page t=0 is pinned before the scheduler thread starts issuing shaping commands; every sampler
+        # call goes through driver_lock, since that thread drives the same (non-thread-safe) driver
+        if self.sampler:
+            with self.driver_lock:
+                self.sampler.mark_start()
+        if scheduler is not None:
+            scheduler.start(start_time, self.time_offset)
+
+        data, round_trip = self.timing.timed(self.extract_video_data)
+        self.timing.record(start_time, self.time_offset, self.time_offset, round_trip, action='startup')
         if data:
-            self.record_quality_event(0, data['width'], data['height'], "startup")
-            self.record_buffer_event(0, data['buffer'], "startup")
+            note = "resume" if self.time_offset > 0 else "startup"
+            self.record_state(self.sample_timestamp(self.time_offset), data, note)
+            self.record_playback(self.time_offset, data)
 
+        # polls are due on a fixed grid from start_time, so the work done in an iteration never
+        # pushes the next sample back; a deadline that has already passed is skipped and counted
+        tick = 1
         while True:
-            elapsed = time.time() - start_time
-
-            if enable_shaping:
-                if elapsed >= 90 and current_phase == 2:
-                    self.apply_network_phase(3)
-                    current_phase = 3
-                elif elapsed >= 45 and current_phase == 1:
-                    self.apply_network_phase(2)
-                    current_phase = 2
-
-            if elapsed >= self.duration:
-                data = self.extract_video_data()
+            deadline = start_time + tick * POLLING_INTERVAL
+            missed = 0
+            now = time.monotonic()
+            while deadline + POLLING_INTERVAL <= now and deadline < end_time:
+                missed += 1
+                tick += 1
+                deadline += POLLING_INTERVAL
+            time.sleep(max(0, min(deadline, end_time) - now))
+            tick += 1
+            if scheduler is not None:
+                scheduler.check()
+
+            started = time.monotonic()
+            elapsed = self.time_offset + started - start_time
+            # the grid position, not the wake-up time, decides when the sampler is due for a drain
+            scheduled = round(self.time_offset + min(deadline, end_time) - start_time, 6)
+
+            # an abort from the live endpoint ends the trial at the next poll, through the normal end path
+            if started >= end_time or self.live.abort.is_set():
+                if scheduler is not None:
+                    scheduler.stop()
+                    scheduler.check()
+                if self.sampler:
+                    self.drain_sampler()
+                    with self.driver_lock:
+                        self.sampler.stop()
+                data, round_trip = self.timing.timed(self.extract_video_data)
+                self.timing.record(started, elapsed, scheduled, round_trip, missed, 'end')
                 if data:
-                    self.record_quality_event(int(elapsed), data['width'], data['height'], "end")
-                    self.record_buffer_event(int(elapsed), data['buffer'], "end")
+                    self.record_state(self.sample_timestamp(elapsed), data, "end")
+                    self.record_playback(elapsed, data)
+                self.close_open_stalls(round(elapsed, 2))
                 break
 
-            data = self.extract_video_data()
-            if not data:
-                time.sleep(POLLING_INTERVAL)
-                continue
-
-            timestamp = int(elapsed)
-            width = data['width']
-            height = data['height']
-            buffer_seconds = data['buffer']
-
-            quality_changed = self.detect_quality_change(width, height)
-            buffer_milestone = self.detect_buffer_milestone(buffer_seconds)
-            force_record = timestamp - self.last_forced_record >= MIN_EVENT_SPACING
-
-            if quality_changed:
-                self.record_quality_event(timestamp, width, height, "quality_change")
-
-            if buffer_milestone:
-                self.record_buffer_event(timestamp, buffer_seconds, "buffer_milestone")
-
-            if force_record and not quality_changed:
-                self.record_quality_event(timestamp, width, height, "periodic")
-                if not buffer_milestone:
-                    self.record_buffer_event(timestamp, buffer_seconds, "periodic")
-                self.last_forced_record = timestamp
-
-            if timestamp - last_status_print >= 15:
-                bitrate = self.estimate_bitrate(width, height)
-                print(f"[{timestamp}s] Quality: {width}x{height} ({bitrate} kbps), Buffer: {buffer_seconds:.1f}s")
-                last_status_print = timestamp
-
-            time.sleep(POLLING_INTERVAL)
-
-        print(f"[{self.duration}s] Collection complete")
-
-        if enable_shaping:
-            self.disable_network_throttling()
-
-        self.driver.quit()
-        self.write_csv_files()
-        return True
+            if self.sampler:
+                if scheduled - last_drain >= SAMPLER_DRAIN_INTERVAL:
+                    _, round_trip = self.timing.timed(self.drain_sampler)
+                    self.timing.record(started, elapsed, scheduled, round_trip, missed, 'drain')
+                    last_drain = scheduled
+                else:
+                    self.timing.record(started, elapsed, scheduled, None, missed, 'idle')
+            else:
+                data, round_trip = self.timing.timed(self.extract_video_data)
+                self.timing.record(started, elapsed, scheduled, round_trip, missed, 'poll')
+                if data:
+                    self.handle_sample(int(elapsed), data['width'], data['height'], data['buffer'])
+                    self.record_playback(elapsed, data)
 
 def main():
     if len(sys.argv) < 2:
-        print("Usage: python auto_collect.py --trial XXX [--duration N] [--with-shaping]")
+        print("Usage: python auto_collect.py --trial XXX [--duration N] [--with-shaping | --trace FILE] [--resume] [--fsync row|batch|close]")
+        print("                              [--sampler [--sample-interval MS] [--frame-callback]] [--live [--live-port N]]")
+        print("       python auto_collect.py --trials 001,002,003 [...]   (back-to-back in one browser session)")
         print("       python auto_collect.py --test [--duration N]")
         sys.exit(1)
 
     trial_num = None
+    trial_list = None
     duration = TOTAL_DURATION
     is_test = False
     enable_shaping = False
+    use_sampler = False
+    sample_interval_ms = SAMPLER_INTERVAL_MS
+    frame_callback = False
+    resume = False
+    fsync_policy = WRITER_FSYNC_POLICY
+    trace_file = None
+    live_port = None
 
     i = 1
     while i < len(sys.argv):
         if sys.argv[i] == '--trial':
             trial_num = sys.argv[i + 1]
             i += 2
+        elif sys.argv[i] == '--trials':
+            trial_list = sys.argv[i + 1].split(',')
+            i += 2
         elif sys.argv[i] == '--duration':
             duration = int(sys.argv[i + 1])
             i += 2
@@ -300,15 +343,63 @@ def main():
         elif sys.argv[i] == '--with-shaping':
             enable_shaping = True
             i += 1
+        elif sys.argv[i] == '--sampler':
+            use_sampler = True
+            i += 1
+        elif sys.argv[i] == '--sample-interval':
+            sample_interval_ms = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--frame-callback':
+            frame_callback = True
+            i += 1
+        elif sys.argv[i] == '--resume':
+            resume = True
+            i += 1
+        elif sys.argv[i] == '--fsync':
+            fsync_policy = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--trace':
+            trace_file = sys.argv[i + 1]
+            enable_shaping = True
+            i += 2
+        elif sys.argv[i] == '--live':
+            live_port = live_port or LIVE_PORT
+            i += 1
+        elif sys.argv[i] == '--live-port':
+            live_port = int(sys.argv[i + 1])
+            i += 2
         else:
             i += 1
 
-    if trial_num is None:
-        print("Error: Must specify --trial XXX or --test")
+    if trial_num is None and trial_list is None:
+        print("Error: Must specify --trial XXX, --trials XXX,YYY or --test")
         sys.exit(1)
 
-    collector = VideoDataCollector(trial_num, duration, is_test)
-    success = collector.collect(enable_shaping=enable_shaping)
+    trace = load_trace(trace_file) if trace_file else None
+    live_server = None
+    if live_port is not None:
+        live_server = LiveServer(live_port)
+        if not live_server.start():
+            sys.exit(1)
+
+    if trial_list is None:
+        collector = VideoDataCollector(trial_num, duration, is_test, use_sampler, sample_interval_ms, frame_callback,
+                                       fsync_policy, trace, trace_file or 'default', live_server=live_server)
+        success = collector.collect(enable_shaping=enable_shaping, resume=resume)
+    else:
+        # one driver for the whole run; trials are separated by a player reset instead of a new attach
+        driver = create_driver()
+        if driver is None:
+            sys.exit(1)
+        success = True
+        try:
+            for trial in trial_list:
+                collector = VideoDataCollector(trial, duration, False, use_sampler, sample_interval_ms, frame_callback,
+                                               fsync_policy, trace, trace_file or 'default', driver=driver,
+                                               countdown_seconds=0, live_server=live_server)
+                success = collector.collect(enable_shaping=enable_shaping, resume=resume) and success
+        finally:
+            driver.quit()
 
     if not success:
         sys.exit(1)
@@ -0,0 +1,290 @@
+import asyncio
+import csv
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from collector_config import *
+from cdp_client import fetch_targets, open_tab, close_tab
+from cdp_collect import CDPVideoCollector, open_session
+from live_metrics import LiveServer
+from network_trace import default_trace, load_trace, with_latency
+
+REPORT_FILE = Path('data/raw/batch_report.csv')
+REPORT_COLUMNS = ['trial', 'session', 'port', 'video_url', 'trace', 'status', 'started_at', 'heartbeats',
+                  'mean_interval_ms', 'jitter_p50_ms', 'jitter_p95_ms', 'jitter_max_ms', 'loop_lag_p95_ms']
+
+def load_jobs(path):
+    jobs = []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            jobs.append({
+                'trial': row['trial'],
+                'video_url': row.get('video_url') or YOUTUBE_VIDEO_URL,
+                'trace': row.get('trace') or 'default',
+                'latency_ms': float(row['latency_ms']) if row.get('latency_ms') else None
+            })
+    return jobs
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def jitter_stats(times, expected_ms):
+    # heartbeats are emitted by a page timer every expected_ms, so any spread in their
+    # arrival intervals is added by the browser, the websocket or this event loop
+    intervals = [(b - a) * 1000 for a, b in zip(times, times[1:])]
+    if not intervals:
+        return {'heartbeats': len(times), 'mean_interval_ms': None, 'jitter_p50_ms': None,
+                'jitter_p95_ms': None, 'jitter_max_ms': None}
+
+    deviations = [abs(interval - expected_ms) for interval in intervals]
+    return {
+        'heartbeats': len(times),
+        'mean_interval_ms': round(sum(intervals) / len(intervals), 1),
+        'jitter_p50_ms': round(percentile(deviations, 0.5), 1),
+        'jitter_p95_ms': round(percentile(deviations, 0.95), 1),
+        'jitter_max_ms': round(max(deviations), 1)
+    }
+
+def append_report_row(row):
+    REPORT_FILE.parent.mkdir(parents=True, exist_ok=True)
+    new_file = not REPORT_FILE.exists()
+    with REPORT_FILE.open('a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+        if new_file:
+            writer.writeheader()
+        writer.writerow(row)
+
+class ChromeInstance:
+    def __init__(self, port, binary=CHROME_BINARY):
+        self.port = port
+        self.binary = binary
+        self.process = None
+        self.profile_dir = None
+
+    async def start(self):
+        self.profile_dir = tempfile.mkdtemp(prefix=f'chrome-{self.port}-')
+        args = [self.binary, f'--remote-debugging-port={self.port}', f'--user-data-dir={self.profile_dir}']
+        args += CHROME_HEADLESS_OPTIONS + CHROME_OPTIONS + ['about:blank']
+        try:
+            self.process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except OSError as e:
+            print(f"Error: could not start Chrome ({self.binary}): {e}")
+            return False
+
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + CHROME_STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            try:
+                await loop.run_in_executor(None, fetch_targets, self.port)
+                print(f"Chrome ready on port {self.port}")
+                return True
+            except OSError:
+                await asyncio.sleep(0.2)
+
+        print(f"Error: Chrome on port {self.port} did not start within {CHROME_STARTUP_TIMEOUT}s")
+        return False
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.profile_dir is not None:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+class LoopLagMonitor:
+    # all sessions share one event loop, so its scheduling lag is the host-wide oversubscription signal
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.samples = []
+
+    async def run(self):
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.samples.append((time.monotonic() - before - self.interval) * 1000)
+
+async def discard_tab(port, target):
+    try:
+        await close_tab(port, target['id'])
+    except OSError:
+        pass
+
+async def run_session(index, port, queue, duration, monitor, use_tabs, resume, live_server=None):
+    # each session keeps its tab and DevTools connection for every job it runs
+    target = None
+    session = None
+    try:
+        while True:
+            try:
+                job = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            print(f"[session {index}] Starting trial {job['trial']} on port {port}")
+            started_at = datetime.now().isoformat(timespec='seconds')
+            lag_start = len(monitor.samples)
+            collector = None
+            # a tab that won't open or a bad trace fails this job only, like an error during collection
+            try:
+                if session is None:
+                    if use_tabs and target is None:
+                        target = await open_tab(port)
+                    session = await open_session(port, target)
+                    if session is None:
+                        # without a session of its own the collector would attach to any page on the port,
+                        # possibly a tab another job is collecting from
+                        raise ConnectionError(f"no DevTools session on port {port}")
+
+                trace = default_trace() if job['trace'] == 'default' else load_trace(job['trace'])
+                if job.get('latency_ms') is not None:
+                    trace = with_latency(trace, job['latency_ms'])
+                collector = CDPVideoCollector(job['trial'], duration, port=port, trace=trace, trace_name=job['trace'],
+                                              video_url=job['video_url'], countdown_seconds=0, session=session,
+                                              live_server=live_server, metadata=job.get('metadata'))
+
+                # a requeued job starts over instead of resuming the attempt that was aborted
+                restart = job.get('restart', False)
+                status = 'complete' if await collector.collect(enable_shaping=True, resume=resume and not restart) else 'failed'
+                if collector.live.status == 'aborted':
+                    status = 'aborted'
+            except Exception as e:
+                print(f"[session {index}] Trial {job['trial']} failed: {e}")
+                status = 'failed'
+                # start the next job on a fresh connection and tab
+                if session is not None:
+                    await session.close()
+                    session = None
+                if target is not None:
+                    await discard_tab(port, target)
+                    target = None
+
+            stats = jitter_stats(collector.heartbeat_times if collector is not None else [], CDP_HEARTBEAT_MS)
+            lag = monitor.samples[lag_start:]
+            row = dict(trial=job['trial'], session=index, port=port, video_url=job['video_url'], trace=job['trace'],
+                       status=status, started_at=started_at,
+                       loop_lag_p95_ms=round(percentile(lag, 0.95), 1) if lag else None, **stats)
+            append_report_row(row)
+
+            if status == 'aborted' and collector.live.requeue:
+                # collected again from scratch by whichever session picks it up next
+                print(f"[session {index}] Requeued trial {job['trial']}")
+                queue.put_nowait(dict(job, restart=True))
+
+            if stats['jitter_p95_ms'] is not None and stats['jitter_p95_ms'] > BATCH_JITTER_WARN_MS:
+                print(f"[session {index}] Warning: trial {job['trial']} p95 sampling jitter "
+                      f"{stats['jitter_p95_ms']} ms, host may be oversubscribed")
+    finally:
+        if session is not None:
+            await session.close()
+        if target is not None:
+            await discard_tab(port, target)
+
+async def run_batch(jobs, sessions, duration, use_tabs=False, attach=False, binary=CHROME_BINARY, resume=False,
+                    live_server=None):
+    if use_tabs:
+        ports = [CHROME_DEBUGGING_PORT] * sessions
+    else:
+        ports = [CHROME_DEBUGGING_PORT + i for i in range(sessions)]
+
+    instances = []
+    if not attach:
+        for port in sorted(set(ports)):
+            instance = ChromeInstance(port, binary)
+            instances.append(instance)
+            if not await instance.start():
+                for started in instances:
+                    started.stop()
+                return False
+
+    queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+
+    monitor = LoopLagMonitor()
+    monitor_task = asyncio.ensure_future(monitor.run())
+    batch_start = time.monotonic()
+    try:
+        await asyncio.gather(*(run_session(i, port, queue, duration, monitor, use_tabs, resume, live_server)
+                               for i, port in enumerate(ports)))
+    finally:
+        monitor_task.cancel()
+        for instance in instances:
+            instance.stop()
+
+    elapsed = time.monotonic() - batch_start
+    print(f"Batch complete: {len(jobs)} trials on {sessions} sessions in {elapsed:.0f}s, report in {REPORT_FILE}")
+    return True
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python batch_collect.py --jobs FILE [--sessions N] [--duration N] [--tabs] [--attach] [--chrome PATH] [--resume]")
+        print("                               [--live [--live-port N]]   (running metrics per trial; abort or requeue with live_metrics.py)")
+        print("       jobs file columns: trial,video_url,trace[,latency_ms]")
+        sys.exit(1)
+
+    jobs_file = None
+    sessions = 2
+    duration = TOTAL_DURATION
+    use_tabs = False
+    attach = False
+    binary = CHROME_BINARY
+    resume = False
+    live_port = None
+
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '--jobs':
+            jobs_file = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--sessions':
+            sessions = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--duration':
+            duration = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--tabs':
+            use_tabs = True
+            i += 1
+        elif sys.argv[i] == '--attach':
+            attach = True
+            i += 1
+        elif sys.argv[i] == '--chrome':
+            binary = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--resume':
+            resume = True
+            i += 1
+        elif sys.argv[i] == '--live':
+            live_port = live_port or LIVE_PORT
+            i += 1
+        elif sys.argv[i] == '--live-port':
+            live_port = int(sys.argv[i + 1])
+            i += 2
+        else:
+            i += 1
+
+    if jobs_file is None:
+        print("Error: Must specify --jobs FILE")
+        sys.exit(1)
+
+    live_server = None
+    if live_port is not None:
+        live_server = LiveServer(live_port)
+        if not live_server.start():
+            sys.exit(1)
+
+    success = asyncio.run(run_batch(load_jobs(jobs_file), sessions, duration, use_tabs, attach, binary, resume,
+                                    live_server))
+    if not success:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import asyncio
+import json
+import time
+import urllib.request
+import websockets
+
+class CDPError(Exception):
+    pass
+
+def fetch_targets(port):
+    return fetch_json(f'http://127.0.0.1:{port}/json')
+
+def fetch_json(url, method='GET'):
+    request = urllib.request.Request(url, method=method)
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return json.load(response)
+
+async def open_tab(port, url='about:blank'):
+    # newer Chrome only accepts PUT for /json/new
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, fetch_json, f'http://127.0.0.1:{port}/json/new?{url}', 'PUT')
+
+async def close_tab(port, target_id):
+    loop = asyncio.get_running_loop()
+    request = urllib.request.Request(f'http://127.0.0.1:{port}/json/close/{target_id}')
+    await loop.run_in_executor(None, lambda: urllib.request.urlopen(request, timeout=5).read())
+
+async def find_page_target(port):
+    loop = asyncio.get_running_loop()
+    try:
+        targets = await loop.run_in_executor(None, fetch_targets, port)
+    except OSError:
+        return None
+
+    pages = [t for t in targets if t.get('type') == 'page' and 'webSocketDebuggerUrl' in t]
+    if not pages:
+        return None
+    # prefer a tab that is already on YouTube
+    for page in pages:
+        if 'youtube.com' in page.get('url', ''):
+            return page
+    return pages[0]
+
+class CDPSession:
+    def __init__(self, ws_url):
+        self.ws_url = ws_url
+        self.ws = None
+        self.reader = None
+        self.next_id = 0
+        self.pending = {}
+        self.listeners = {}
+
+    async def connect(self):
+        self.ws = await websockets.connect(self.ws_url, max_size=None, ping_interval=None)
+        self.reader = asyncio.ensure_future(self.read_loop())
+
+    async def read_loop(self):
+        try:
+            async for raw in self.ws:
+                # stamp on arrival so event timing does not depend on handler scheduling
+                received = time.monotonic()
+                message = json.loads(raw)
+                if 'id' in message:
+                    future = self.pending.pop(message['id'], None)
+                    if future is None or future.done():
+                        continue
+                    if 'error' in message:
+                        future.set_exception(CDPError(message['error'].get('message', 'unknown error')))
+                    else:
+                        future.set_result(message.get('result', {}))
+                else:
+                    for callback in self.listeners.get(message.get('method'), []):
+                        callback(message.get('params', {}), received)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(CDPError('DevTools connection closed'))
+            self.pending.clear()
+
+    def on(self, method, callback):
+        self.listeners.setdefault(method, []).append(callback)
+
+    def off(self, method, callback):
+        if callback in self.listeners.get(method, []):
+            self.listeners[method].remove(callback)
+
+    async def send(self, method, params=None):
+        self.next_id += 1
+        message_id = self.next_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[message_id] = future
+        await self.ws.send(json.dumps({'id': message_id, 'method': method, 'params': params or {}}))
+        return await future
+
+    async def evaluate(self, expression, await_promise=False):
+        result = await self.send('Runtime.evaluate', {
+            'expression': expression,
+            'returnByValue': True,
+            'awaitPromise': await_promise
+        })
+        if 'exceptionDetails' in result:
+            details = result['exceptionDetails']
+            raise CDPError(details.get('exception', {}).get('description', details.get('text', 'evaluation failed')))
+        return result.get('result', {}).get('value')
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+        if self.reader is not None:
+            await self.reader
@@ -0,0 +1,412 @@
+import asyncio
+import json
+import sys
+import time
+from collector_config import *
+from cdp_client import CDPSession, CDPError, find_page_target
+from page_scripts import (READY_PROMISE_JS, RESET_PLAYER_JS, CURRENT_URL_JS, VIDEO_STATE_JS, PLAYBACK_STATE_FN,
+                          as_expression)
+from network_trace import default_trace, load_trace, step_at, describe_step
+from shaping_scheduler import ShapingScheduler
+from trial_recorder import TrialRecorder
+from segment_capture import SegmentCapture
+from live_metrics import LiveServer
+
+BINDING_NAME = '__abrEvent'
+# how often the otherwise idle collection coroutine checks for an abort from the live endpoint
+ABORT_CHECK_SECONDS = 0.5
+
+LISTENER_JS = """
+(function(heartbeatMs) {
+""" + PLAYBACK_STATE_FN + """
+    const video = document.querySelector('video');
+    if (!video) return false;
+    if (window.__abrListeners) window.__abrListeners.stop();
+
+    const emit = function(type) {
+        const state = playbackState(video);
+        state.type = type;
+        window.__abrEvent(JSON.stringify(state));
+    };
+
+    const handlers = {};
+    ['resize', 'progress', 'waiting'].forEach(function(type) {
+        handlers[type] = function() { emit(type); };
+        video.addEventListener(type, handlers[type]);
+    });
+    const timer = setInterval(function() { emit('heartbeat'); }, heartbeatMs);
+
+    window.__abrListeners = {
+        stop: function() {
+            clearInterval(timer);
+            Object.keys(handlers).forEach(function(type) {
+                video.removeEventListener(type, handlers[type]);
+            });
+            window.__abrListeners = null;
+        }
+    };
+    return true;
+})
+"""
+
+STOP_LISTENERS_JS = "if (window.__abrListeners) { window.__abrListeners.stop(); }"
+
+async def open_session(port=CHROME_DEBUGGING_PORT, target=None):
+    print(f"Connecting to Chrome DevTools on port {port}...")
+    target = target or await find_page_target(port)
+    if target is None:
+        print(f"Error: No debuggable page on port {port}")
+        print("Please run: ./scripts/collection/launch_chrome.sh")
+        return None
+
+    session = CDPSession(target['webSocketDebuggerUrl'])
+    try:
+        await session.connect()
+        await session.send('Runtime.enable')
+        await session.send('Page.enable')
+        await session.send('Network.enable')
+        await session.send('Runtime.addBinding', {'name': BINDING_NAME})
+    except (OSError, CDPError) as e:
+        print(f"Error connecting to Chrome: {e}")
+        await session.close()
+        return None
+
+    print("Connected successfully")
+    return session
+
+class CDPVideoCollector(TrialRecorder):
+    def __init__(self, trial_num, duration, is_test=False, port=CHROME_DEBUGGING_PORT,
+                 fsync_policy=WRITER_FSYNC_POLICY, trace=None, trace_name='default',
+                 video_url=YOUTUBE_VIDEO_URL, target=None, countdown_seconds=5, session=None,
+                 capture_segments=False, live_server=None, metadata=None):
+        super().__init__(trial_num, is_test, fsync_policy, live_server)
+        self.duration = duration
+        self.port = port
+        self.trace = trace or default_trace()
+        self.trace_name = trace_name
+        self.video_url = video_url
+        self.target = target
+        self.countdown_seconds = countdown_seconds
+        # a session handed in belongs to a long-lived connection that outlives this trial
+        self.session = session
+        self.owns_session = session is None
+        self.start_time = None
+        self.event_counts = {}
+        self.heartbeat_times = []
+        self.capture_segments = capture_segments
+        self.segments = None
+        # extra manifest fields, e.g. the scenario a sweep collects this trial for
+        self.metadata = metadata or {}
+
+    async def connect_to_chrome(self):
+        if self.session is None:
+            self.session = await open_session(self.port, self.target)
+            if self.session is None:
+                return False
+
+        self.session.on('Runtime.bindingCalled', self.on_binding_called)
+        return True
+
+    async def release_session(self):
+        self.session.off('Runtime.bindingCalled', self.on_binding_called)
+        if self.owns_session:
+            await self.session.close()
+
+    async def navigate(self):
+        loaded = asyncio.Event()
+        on_load = lambda params, received: loaded.set()
+        self.session.on('Page.loadEventFired', on_load)
+        try:
+            await self.session.send('Page.navigate', {'url': self.video_url})
+            await asyncio.wait_for(loaded.wait(), PLAYER_READY_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.session.off('Page.loadEventFired', on_load)
+
+    async def wait_for_video(self):
+        rewound = False
+        if not self.owns_session:
+            # drop whatever the previous trial in this session left behind
+            await self.disable_network_throttling()
+            await self.session.send('Network.clearBrowserCache')
+            current_url = await self.session.evaluate(as_expression(CURRENT_URL_JS))
+            if SESSION_RESET == 'seek' and current_url.startswith(self.video_url):
+                rewound = await self.session.evaluate(as_expression(RESET_PLAYER_JS))
+
+        if not rewound:
+            print("Loading YouTube video...")
+            await self.navigate()
+
+        result = await self.session.evaluate(f"{READY_PROMISE_JS}({PLAYER_READY_TIMEOUT * 1000})", await_promise=True)
+        if result['state'] != 'playing':
+            print(f"Error: Video did not start playing within {PLAYER_READY_TIMEOUT}s")
+            return False
+
+        print(f"Video playing: {result['width']}x{result['height']}")
+        return True
+
+    async def countdown(self, seconds=5):
+        if seconds <= 0:
+            return
+        trial_label = "test" if self.is_test else self.trial_num
+        print(f"Trial {trial_label} ready. Starting collection in {seconds} seconds...")
+        for i in range(seconds, 0, -1):
+            print(f"{i}...", end=" ", flush=True)
+            await asyncio.sleep(1)
+        print("Collecting")
+
+    async def extract_video_data(self):
+        return await self.session.evaluate(as_expression(VIDEO_STATE_JS))
+
+    async def enable_network_throttling(self, download_kbps, upload_kbps, latency_ms):
+        await self.session.send('Network.emulateNetworkConditions', {
+            'offline': False,
+            'downloadThroughput': download_kbps * 1024 / 8,
+            'uploadThroughput': upload_kbps * 1024 / 8,
+            'latency': latency_ms
+        })
+
+    async def release_browser(self, enable_shaping):
+        if enable_shaping:
+            await self.disable_network_throttling()
+        await self.release_session()
+
+    async def disable_network_throttling(self):
+        await self.session.send('Network.emulateNetworkConditions', {
+            'offline': False,
+            'downloadThroughput': -1,
+            'uploadThroughput': -1,
+            'latency': 0
+        })
+
+    async def apply_trace_step(self, step):
+        await self.enable_network_throttling(step['bandwidth_kbps'], step['bandwidth_kbps'], step['latency_ms'])
+
+    def on_binding_called(self, params, received):
+        if params.get('name') != BINDING_NAME or self.start_time is None:
+            return
+
+        event = json.loads(params['payload'])
+        self.event_counts[event['type']] = self.event_counts.get(event['type'], 0) + 1
+        timestamp = round(self.time_offset + received - self.start_time, 2)
+
+        # frame counters once per heartbeat; stall intervals ride along on every event
+        self.record_playback(timestamp, event, frames=event['type'] == 'heartbeat')
+        if event['type'] == 'heartbeat':
+            self.heartbeat_times.append(received)
+        elif event['type'] == 'waiting':
+            self.record_buffer_event(timestamp, event['buffer'], "waiting")
+            return
+
+        self.handle_sample(timestamp, event['width'], event['height'], event['buffer'])
+
+    async def collect(self, enable_shaping=False, resume=False):
+        if not await self.connect_to_chrome():
+            return False
+
+        if not await self.wait_for_video():
+            await self.release_session()
+            return False
+
+        try:
+            offset = self.open_trial_files(self.duration, resume)
+        except FileExistsError as e:
+            print(f"Error: {e}")
+            await self.release_session()
+            return False
+        if offset is None:
+            await self.release_session()
+            return True
+
+        self.writer.set_metadata('video_url', self.video_url)
+        for key, value in self.metadata.items():
+            self.writer.set_metadata(key, value)
+        if self.capture_segments:
+            self.segments = SegmentCapture(self.writer)
+            self.segments.open(resume=offset > 0)
+        scheduler = None
+        if enable_shaping:
+            # shape for the preroll too, the scheduler re-issues this step at t=offset
+            step = step_at(self.trace, offset)
+            await self.apply_trace_step(step)
+            print(f"[Preroll] Network: {describe_step(step)} ({self.trace_name} trace)")
+            self.writer.set_metadata('trace', self.trace_name)
+            self.live.set_trace(self.trace)
+            scheduler = ShapingScheduler(self.trace, self.apply_trace_step, self.record_shaping_event)
+
+        try:
+            await self.countdown(self.countdown_seconds)
+            await self.run_collection(scheduler)
+        except BaseException:
+            # keep everything flushed so far so the trial can be continued with --resume, and don't leave
+            # the browser throttled at whatever trace step was active
+            if self.segments is not None:
+                self.segments.stop()
+            try:
+                await self.release_browser(enable_shaping)
+            except Exception as e:
+                print(f"Warning: could not reset the browser after the interruption ({e})")
+            self.finish_trial_files('interrupted')
+            raise
+
+        aborted = self.live.abort.is_set()
+        counts = ', '.join(f"{k}={v}" for k, v in sorted(self.event_counts.items()))
+        if aborted:
+            print(f"[{self.live.trial_time():.1f}s] Collection aborted ({counts})")
+        else:
+            print(f"[{self.duration}s] Collection complete ({counts})")
+        if self.segments is not None:
+            self.segments.stop()
+            print(f"Segments: {self.segments.describe()}")
+
+        await self.release_browser(enable_shaping)
+        self.finish_trial_files('aborted' if aborted else 'complete')
+        return not aborted
+
+    async def run_collection(self, scheduler):
+        self.start_time = time.monotonic()
+        self.live.start(self.start_time, self.time_offset)
+
+        data = await self.extract_video_data()
+        if data:
+            note = "resume" if self.time_offset > 0 else "startup"
+            self.record_state(self.time_offset, data, note)
+            self.record_playback(self.time_offset, data)
+
+        await self.session.evaluate(f"{LISTENER_JS}({CDP_HEARTBEAT_MS})")
+        if self.segments is not None:
+            self.segments.start(self.session, self.start_time, self.time_offset)
+
+        shaping = None
+        if scheduler is not None:
+            shaping = asyncio.ensure_future(scheduler.run_async(self.start_time, self.time_offset))
+
+        end_time = self.start_time + self.duration - self.time_offset
+        try:
+            while not self.live.abort.is_set() and time.monotonic() < end_time:
+                if scheduler is not None:
+                    scheduler.check()
+                await asyncio.sleep(min(ABORT_CHECK_SECONDS, max(0, end_time - time.monotonic())))
+        finally:
+            if shaping is not None:
+                shaping.cancel()
+        if scheduler is not None:
+            scheduler.check()
+
+        await self.session.evaluate(STOP_LISTENERS_JS)
+        elapsed = self.time_offset + time.monotonic() - self.start_time
+        data = await self.extract_video_data()
+        if data:
+            timestamp = round(elapsed, 2)
+            self.record_state(timestamp, data, "end")
+            self.record_playback(timestamp, data)
+        self.close_open_stalls(round(elapsed, 2))
+
+async def collect_back_to_back(trial_list, duration, port, fsync_policy, trace, trace_name, enable_shaping, resume,
+                               capture_segments=False, live_server=None):
+    # one DevTools connection for the whole run; trials are separated by a player reset
+    session = await open_session(port)
+    if session is None:
+        return False
+
+    success = True
+    try:
+        for trial in trial_list:
+            collector = CDPVideoCollector(trial, duration, False, port, fsync_policy, trace, trace_name,
+                                          countdown_seconds=0, session=session, capture_segments=capture_segments,
+                                          live_server=live_server)
+            success = await collector.collect(enable_shaping=enable_shaping, resume=resume) and success
+    finally:
+        await session.close()
+    return success
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python cdp_collect.py --trial XXX [--duration N] [--with-shaping | --trace FILE] [--port N] [--resume] [--fsync row|batch|close]")
+        print("                             [--segments]   (log googlevideo segment requests to segment_timeline.csv)")
+        print("                             [--live [--live-port N]]   (running metrics over HTTP, abort with live_metrics.py)")
+        print("       python cdp_collect.py --trials 001,002,003 [...]   (back-to-back in one DevTools session)")
+        print("       python cdp_collect.py --test [--duration N]")
+        sys.exit(1)
+
+    trial_num = None
+    trial_list = None
+    duration = TOTAL_DURATION
+    is_test = False
+    enable_shaping = False
+    port = CHROME_DEBUGGING_PORT
+    resume = False
+    fsync_policy = WRITER_FSYNC_POLICY
+    trace_file = None
+    capture_segments = False
+    live_port = None
+
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '--trial':
+            trial_num = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--trials':
+            trial_list = sys.argv[i + 1].split(',')
+            i += 2
+        elif sys.argv[i] == '--duration':
+            duration = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--test':
+            is_test = True
+            trial_num = 'test'
+            i += 1
+        elif sys.argv[i] == '--with-shaping':
+            enable_shaping = True
+            i += 1
+        elif sys.argv[i] == '--port':
+            port = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--resume':
+            resume = True
+            i += 1
+        elif sys.argv[i] == '--fsync':
+            fsync_policy = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--trace':
+            trace_file = sys.argv[i + 1]
+            enable_shaping = True
+            i += 2
+        elif sys.argv[i] == '--segments':
+            capture_segments = True
+            i += 1
+        elif sys.argv[i] == '--live':
+            live_port = live_port or LIVE_PORT
+            i += 1
+        elif sys.argv[i] == '--live-port':
+            live_port = int(sys.argv[i + 1])
+            i += 2
+        else:
+            i += 1
+
+    if trial_num is None and trial_list is None:
+        print("Error: Must specify --trial XXX, --trials XXX,YYY or --test")
+        sys.exit(1)
+
+    trace = load_trace(trace_file) if trace_file else None
+    live_server = None
+    if live_port is not None:
+        live_server = LiveServer(live_port)
+        if not live_server.start():
+            sys.exit(1)
+
+    if trial_list is None:
+        collector = CDPVideoCollector(trial_num, duration, is_test, port, fsync_policy, trace, trace_file or 'default',
+                                      capture_segments=capture_segments, live_server=live_server)
+        success = asyncio.run(collector.collect(enable_shaping=enable_shaping, resume=resume))
+    else:
+        success = asyncio.run(collect_back_to_back(trial_list, duration, port, fsync_policy, trace,
+                                                   trace_file or 'default', enable_shaping, resume, capture_segments,
+                                                   live_server))
+
+    if not success:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -9,9 +9,49 @@ CHROME_OPTIONS = [
     "--disable-dev-shm-usage"
 ]
 
+CHROME_BINARY = "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"
+CHROME_HEADLESS_OPTIONS = [
+    "--headless=new",
+    "--mute-audio",
+    "--autoplay-policy=no-user-gesture-required",
+    "--no-first-run",
+    "--no-default-browser-check"
+]
+CHROME_STARTUP_TIMEOUT = 15
+
+# back-to-back trials in one browser session: 'seek' rewinds the loaded player, 'reload' navigates again
+SESSION_RESET = 'seek'
+PLAYER_READY_TIMEOUT = 20
+
 POLLING_INTERVAL = 1.5
 MIN_EVENT_SPACING = 15
 
+SAMPLER_INTERVAL_MS = 100
+SAMPLER_CAPACITY = 600
+SAMPLER_DRAIN_INTERVAL = 3.0
+
+CDP_HEARTBEAT_MS = 1000
+
+# Network-domain capture (cdp_collect.py --segments): requests matching this URL fragment are logged
+SEGMENT_URL_PATTERN = 'googlevideo.com/videoplayback'
+SEGMENT_MAX_INFLIGHT = 256
+
+WRITER_FSYNC_POLICY = 'batch'
+WRITER_BATCH_SIZE = 20
+WRITER_FLUSH_INTERVAL = 5.0
+
+BATCH_JITTER_WARN_MS = 50
+
+# live metrics endpoint (--live): collectors publish running metrics on http://127.0.0.1:LIVE_PORT/
+LIVE_PORT = 8765
+# a trial that has produced no sample for this long is flagged in the live view
+LIVE_STALE_SECONDS = 5
+
+# a trial is flagged 'degraded' in its manifest when the polling loop exceeds any of these
+FIDELITY_MAX_MISSED_FRACTION = 0.02
+FIDELITY_JITTER_P95_MS = 100
+FIDELITY_SHAPING_LATENESS_MS = 500
+
 BITRATE_MAP = {
     (426, 240): 400,
     (640, 360): 800,
@@ -0,0 +1,124 @@
+import time
+from collector_config import *
+
+TIMING_COLUMNS = ['time_seconds', 'deadline_seconds', 'lateness_ms', 'interval_ms', 'round_trip_ms',
+                  'missed_deadlines', 'action']
+
+HISTOGRAM_WIDTH = 40
+JITTER_EDGES_MS = [0, 5, 10, 25, 50, 100, 250, 500]
+ROUND_TRIP_EDGES_MS = [0, 10, 25, 50, 100, 250, 500]
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def spread(values):
+    if not values:
+        return {'p50': None, 'p95': None, 'max': None}
+    return {'p50': round(percentile(values, 0.5), 1), 'p95': round(percentile(values, 0.95), 1),
+            'max': round(max(values), 1)}
+
+def histogram(values, edges):
+    # last bin is open-ended so outliers stay visible instead of stretching the scale
+    counts = [0] * len(edges)
+    for value in values:
+        i = 0
+        while i + 1 < len(edges) and value >= edges[i + 1]:
+            i += 1
+        counts[i] += 1
+    return counts
+
+def print_histogram(title, values, edges):
+    if not values:
+        return
+    counts = histogram(values, edges)
+    peak = max(counts)
+    print(title)
+    for i, count in enumerate(counts):
+        label = f"{edges[i]:>6.0f}-{edges[i + 1]:<6.0f}" if i + 1 < len(edges) else f"{edges[i]:>6.0f}+      "
+        bar = '#' * (round(count / peak * HISTOGRAM_WIDTH) if peak else 0)
+        print(f"  {label} ms {count:>5}  {bar}")
+
+class CollectorTiming:
+    # per-iteration timing of the collection loop, written next to the trial as collector_timing.csv
+    def __init__(self, writer, interval=POLLING_INTERVAL):
+        self.writer = writer
+        self.interval = interval
+        self.last_start = None
+        self.intervals = []
+        self.round_trips = []
+        self.lateness = []
+        self.shaping_lateness = []
+        self.missed = 0
+        self.iterations = 0
+
+    def open(self, resume=False):
+        self.writer.add_stream('timing', 'collector_timing.csv', TIMING_COLUMNS, resume=resume)
+
+    def timed(self, call):
+        before = time.monotonic()
+        result = call()
+        return result, (time.monotonic() - before) * 1000
+
+    def record(self, started, elapsed, deadline, round_trip_ms, missed=0, action='poll'):
+        # started is the monotonic time the iteration began, elapsed and deadline are trial seconds
+        interval_ms = (started - self.last_start) * 1000 if self.last_start is not None else None
+        lateness_ms = (elapsed - deadline) * 1000
+        self.last_start = started
+        self.iterations += 1
+        self.missed += missed
+        self.lateness.append(lateness_ms)
+        if interval_ms is not None:
+            self.intervals.append(interval_ms)
+        if round_trip_ms is not None:
+            self.round_trips.append(round_trip_ms)
+
+        self.writer.append('timing', [round(elapsed, 3), round(deadline, 3), round(lateness_ms, 1),
+                                      None if interval_ms is None else round(interval_ms, 1),
+                                      None if round_trip_ms is None else round(round_trip_ms, 1),
+                                      missed, action])
+
+    def record_shaping(self, lateness_ms):
+        self.shaping_lateness.append(lateness_ms)
+
+    def summary(self):
+        expected_ms = self.interval * 1000
+        deviations = [abs(interval - expected_ms) for interval in self.intervals]
+        shaping = [abs(lateness) for lateness in self.shaping_lateness]
+        summary = {
+            'iterations': self.iterations,
+            'missed_deadlines': self.missed,
+            'expected_interval_ms': round(expected_ms, 1),
+            'interval_ms': spread(self.intervals),
+            'interval_jitter_ms': spread(deviations),
+            'round_trip_ms': spread(self.round_trips),
+            'lateness_ms': spread(self.lateness),
+            'shaping_lateness_ms': spread(shaping)
+        }
+
+        reasons = []
+        slots = self.iterations + self.missed
+        if slots and self.missed / slots > FIDELITY_MAX_MISSED_FRACTION:
+            reasons.append(f"{self.missed} of {slots} polling deadlines missed")
+        if deviations and summary['interval_jitter_ms']['p95'] > FIDELITY_JITTER_P95_MS:
+            reasons.append(f"p95 interval jitter {summary['interval_jitter_ms']['p95']} ms")
+        if shaping and summary['shaping_lateness_ms']['max'] > FIDELITY_SHAPING_LATENESS_MS:
+            reasons.append(f"shaping change applied {summary['shaping_lateness_ms']['max']} ms late")
+        summary['fidelity'] = 'degraded' if reasons else 'ok'
+        summary['fidelity_reasons'] = reasons
+        return summary
+
+    def report(self, summary):
+        expected_ms = self.interval * 1000
+        print_histogram(f"Sample interval jitter (|interval - {expected_ms:.0f} ms|):",
+                        [abs(interval - expected_ms) for interval in self.intervals], JITTER_EDGES_MS)
+        print_histogram("execute_script round trip:", self.round_trips, ROUND_TRIP_EDGES_MS)
+
+        rt = summary['round_trip_ms']
+        jitter = summary['interval_jitter_ms']
+        print(f"Timing: {summary['iterations']} iterations, {summary['missed_deadlines']} missed deadlines, "
+              f"jitter p95 {jitter['p95']} ms, round trip p50/p95 {rt['p50']}/{rt['p95']} ms")
+        if summary['shaping_lateness_ms']['max'] is not None:
+            print(f"Shaping lateness: max {summary['shaping_lateness_ms']['max']} ms")
+        if summary['fidelity'] != 'ok':
+            print(f"Warning: collection fidelity degraded ({'; '.join(summary['fidelity_reasons'])})")
@@ -0,0 +1,326 @@
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+from collector_config import *
+
+VIEW_COLUMNS = [('trial', 8), ('status', 11), ('time', 6), ('quality', 10), ('buffer', 7), ('min', 6),
+                ('switches', 8), ('phase', 12), ('since', 6), ('rebuf', 6)]
+
+class LiveMetrics:
+    # running metrics for one trial; every update is O(1), so they can be fed every sample from the
+    # collection loop, while the HTTP thread reads consistent snapshots under the same lock
+    def __init__(self, trial_num):
+        self.trial_num = trial_num
+        self.lock = threading.Lock()
+        self.status = 'waiting'
+        self.start_time = None
+        self.time_offset = 0
+        self.abort = threading.Event()
+        self.requeue = False
+
+        self.samples = 0
+        self.last_time = None
+        self.last_sample_at = None
+        self.rendition = None
+        self.bitrate = None
+        self.buffer = None
+        self.min_buffer = None
+        self.switches = 0
+
+        # phase labels follow process_trial.py: phaseN counts bandwidth changes, high/low is against half the peak
+        self.phase_labels = {}
+        self.phase = None
+        self.bandwidth = None
+        self.shaped_at = None
+        # per phase: [seconds, bitrate x seconds, buffer x seconds], each value held until the next sample
+        self.phases = OrderedDict()
+
+        self.rebuffer_count = 0
+        self.rebuffer_seconds = 0.0
+        self.stalled_since = None
+
+    def set_trace(self, trace):
+        peak = max(step['bandwidth_kbps'] for step in trace)
+        phase = 0
+        previous = None
+        for step in trace:
+            if step['bandwidth_kbps'] != previous:
+                phase += 1
+                previous = step['bandwidth_kbps']
+            level = 'high' if step['bandwidth_kbps'] >= peak / 2 else 'low'
+            self.phase_labels[step['time_seconds']] = f'phase{phase}_{level}'
+
+    def start(self, start_time, time_offset=0):
+        with self.lock:
+            self.start_time = start_time
+            self.time_offset = time_offset
+            self.status = 'collecting'
+
+    def trial_time(self):
+        if self.start_time is None:
+            return None
+        return self.time_offset + time.monotonic() - self.start_time
+
+    def advance(self, timestamp):
+        if self.last_time is not None and self.phase is not None and timestamp > self.last_time:
+            held = timestamp - self.last_time
+            totals = self.phases.setdefault(self.phase, [0.0, 0.0, 0.0])
+            totals[0] += held
+            totals[1] += self.bitrate * held
+            totals[2] += self.buffer * held
+        if self.last_time is not None:
+            self.last_time = max(self.last_time, timestamp)
+
+    def observe(self, timestamp, width, height, bitrate, buffer_seconds):
+        with self.lock:
+            self.advance(timestamp)
+            if self.rendition is not None and (width, height) != self.rendition:
+                self.switches += 1
+            self.rendition = (width, height)
+            self.bitrate = bitrate
+            self.buffer = buffer_seconds
+            self.min_buffer = buffer_seconds if self.min_buffer is None else min(self.min_buffer, buffer_seconds)
+            if self.last_time is None:
+                self.last_time = timestamp
+            self.samples += 1
+            self.last_sample_at = time.monotonic()
+
+    def shaping(self, step, applied_at):
+        with self.lock:
+            self.advance(applied_at)
+            self.phase = self.phase_labels.get(step['time_seconds'], self.phase)
+            self.bandwidth = step['bandwidth_kbps']
+            self.shaped_at = applied_at
+
+    def stall(self, start, end, kind):
+        if kind != 'waiting':
+            return
+        with self.lock:
+            self.rebuffer_count += 1
+            self.rebuffer_seconds += max(0.0, end - start)
+
+    def stalled(self, since):
+        with self.lock:
+            self.stalled_since = since
+
+    def request_abort(self, requeue=False):
+        with self.lock:
+            self.requeue = requeue
+        self.abort.set()
+
+    def finish(self, timestamp, status):
+        with self.lock:
+            if timestamp is not None:
+                self.advance(timestamp)
+            self.status = status
+            self.stalled_since = None
+
+    def snapshot(self):
+        with self.lock:
+            now = self.trial_time() if self.status == 'collecting' else self.last_time
+            phases = {
+                name: {'seconds': round(seconds, 1),
+                       'avg_bitrate_kbps': round(bitrate / seconds) if seconds else None,
+                       'avg_buffer_seconds': round(buffer / seconds, 1) if seconds else None}
+                for name, (seconds, bitrate, buffer) in self.phases.items()
+            }
+            warnings = []
+            if self.status == 'collecting' and self.last_sample_at is not None:
+                idle = time.monotonic() - self.last_sample_at
+                if idle > LIVE_STALE_SECONDS:
+                    warnings.append(f"no samples for {idle:.0f}s")
+            if self.stalled_since is not None:
+                warnings.append(f"rebuffering since {self.stalled_since:.1f}s")
+
+            return {
+                'trial': self.trial_num,
+                'status': self.status,
+                'abort_requested': self.abort.is_set(),
+                'requeue': self.requeue,
+                'time_seconds': round(now, 1) if now is not None else None,
+                'samples': self.samples,
+                'resolution': f'{self.rendition[0]}x{self.rendition[1]}' if self.rendition else None,
+                'bitrate_kbps': self.bitrate,
+                'buffer_seconds': round(self.buffer, 1) if self.buffer is not None else None,
+                'min_buffer_seconds': round(self.min_buffer, 1) if self.min_buffer is not None else None,
+                'quality_switches': self.switches,
+                'phase': self.phase,
+                'bandwidth_kbps': self.bandwidth,
+                'since_shaping_seconds': round(now - self.shaped_at, 1) if now is not None and self.shaped_at is not None else None,
+                'phases': phases,
+                'rebuffer_count': self.rebuffer_count,
+                'rebuffer_seconds': round(self.rebuffer_seconds, 2),
+                'warnings': warnings
+            }
+
+class LiveHandler(BaseHTTPRequestHandler):
+    # GET /            every trial this process has collected or is collecting
+    # GET /XXX         one trial
+    # POST /XXX/abort  stop the trial early (status 'aborted'); /XXX/requeue also puts a batch job back in the queue
+    def send_json(self, code, data):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = [p for p in self.path.split('?')[0].split('/') if p]
+        if not parts:
+            self.send_json(200, {'trials': [live.snapshot() for live in self.server.live.trials()]})
+            return
+        live = self.server.live.get(parts[0])
+        if live is None or len(parts) > 1:
+            self.send_json(404, {'error': f"unknown trial {parts[0]}"})
+            return
+        self.send_json(200, live.snapshot())
+
+    def do_POST(self):
+        parts = [p for p in self.path.split('?')[0].split('/') if p]
+        if len(parts) != 2 or parts[1] not in ('abort', 'requeue'):
+            self.send_json(404, {'error': "expected POST /TRIAL/abort or /TRIAL/requeue"})
+            return
+        live = self.server.live.get(parts[0])
+        if live is None:
+            self.send_json(404, {'error': f"unknown trial {parts[0]}"})
+            return
+        if live.status not in ('waiting', 'collecting'):
+            self.send_json(409, {'error': f"trial {parts[0]} is {live.status}"})
+            return
+        live.request_abort(requeue=parts[1] == 'requeue')
+        print(f"[live] {parts[1]} requested for trial {parts[0]}")
+        self.send_json(202, live.snapshot())
+
+    def log_message(self, format, *args):
+        pass
+
+class LiveServer:
+    # one local endpoint per collector process; batch sessions register every trial they start
+    def __init__(self, port=LIVE_PORT, host='127.0.0.1'):
+        self.port = port
+        self.host = host
+        self.lock = threading.Lock()
+        self.metrics = OrderedDict()
+        self.httpd = None
+
+    def start(self):
+        try:
+            self.httpd = ThreadingHTTPServer((self.host, self.port), LiveHandler)
+        except OSError as e:
+            print(f"Error: cannot serve live metrics on port {self.port}: {e}")
+            return False
+        self.httpd.daemon_threads = True
+        self.httpd.live = self
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        print(f"Live metrics on http://{self.host}:{self.port}/ (python scripts/collection/live_metrics.py to watch)")
+        return True
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+    def register(self, live):
+        with self.lock:
+            # a requeued trial replaces its earlier attempt
+            self.metrics.pop(live.trial_num, None)
+            self.metrics[live.trial_num] = live
+
+    def trials(self):
+        with self.lock:
+            return list(self.metrics.values())
+
+    def get(self, trial_num):
+        with self.lock:
+            return self.metrics.get(trial_num)
+
+def request(port, path, method='GET'):
+    with urlopen(Request(f'http://127.0.0.1:{port}{path}', method=method), timeout=5) as response:
+        return json.loads(response.read())
+
+def format_row(trial):
+    quality = f"{trial['bitrate_kbps']}k" if trial['bitrate_kbps'] is not None else '-'
+    value = lambda v, fmt='{:.1f}': fmt.format(v) if v is not None else '-'
+    cells = [trial['trial'], trial['status'], value(trial['time_seconds'], '{:.0f}'), quality,
+             value(trial['buffer_seconds']), value(trial['min_buffer_seconds']), str(trial['quality_switches']),
+             trial['phase'] or '-', value(trial['since_shaping_seconds'], '{:.0f}'), str(trial['rebuffer_count'])]
+    line = ' '.join(f"{cell:<{width}}" for cell, (_, width) in zip(cells, VIEW_COLUMNS)).rstrip()
+    if trial['warnings']:
+        line += '  ! ' + '; '.join(trial['warnings'])
+    return line
+
+def watch(port, interval):
+    # terminal view: redraws the table in place until interrupted
+    while True:
+        try:
+            trials = request(port, '/')['trials']
+        except (URLError, OSError):
+            trials = None
+        print('\033[2J\033[H', end='')
+        if trials is None:
+            print(f"No collector serving live metrics on port {port} (start one with --live)")
+        else:
+            print(' '.join(f"{name:<{width}}" for name, width in VIEW_COLUMNS).rstrip())
+            for trial in trials:
+                print(format_row(trial))
+            print(f"\nabort: python scripts/collection/live_metrics.py abort XXX [--requeue]")
+        time.sleep(interval)
+
+def main():
+    port = LIVE_PORT
+    interval = 1.0
+    command = None
+    trial_num = None
+    requeue = False
+
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '--port':
+            port = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--interval':
+            interval = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--requeue':
+            requeue = True
+            i += 1
+        elif sys.argv[i] in ('-h', '--help'):
+            print("Usage: python live_metrics.py [--port N] [--interval S]      (live view of running collectors)")
+            print("       python live_metrics.py abort XXX [--requeue] [--port N]")
+            print("       python live_metrics.py show [XXX] [--port N]          (JSON)")
+            sys.exit(0)
+        elif command is None:
+            command = sys.argv[i]
+            i += 1
+        else:
+            trial_num = sys.argv[i]
+            i += 1
+
+    try:
+        if command == 'abort':
+            if trial_num is None:
+                print("Error: Must specify the trial to abort")
+                sys.exit(1)
+            trial = request(port, f"/{trial_num}/{'requeue' if requeue else 'abort'}", 'POST')
+            print(f"Abort requested for trial {trial['trial']} at {trial['time_seconds']}s")
+        elif command == 'show':
+            print(json.dumps(request(port, f"/{trial_num or ''}"), indent=2))
+        else:
+            watch(port, interval)
+    except HTTPError as e:
+        print(f"Error: {json.loads(e.read()).get('error', e)}")
+        sys.exit(1)
+    except (URLError, OSError) as e:
+        print(f"Error: no collector serving live metrics on port {port} ({e})")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import csv
+from pathlib import Path
+from collector_config import *
+
+MAHIMAHI_SUFFIXES = ('.mahi', '.down', '.up')
+MAHIMAHI_PACKET_BYTES = 1500
+
+def make_step(time_seconds, bandwidth_kbps, latency_ms=LATENCY_MS):
+    return {'time_seconds': float(time_seconds), 'bandwidth_kbps': float(bandwidth_kbps), 'latency_ms': float(latency_ms)}
+
+def default_trace():
+    return [
+        make_step(0, PHASE1_BANDWIDTH_KBPS),
+        make_step(PHASE1_DURATION, PHASE2_BANDWIDTH_KBPS),
+        make_step(PHASE1_DURATION + PHASE2_DURATION, PHASE3_BANDWIDTH_KBPS)
+    ]
+
+def compress_steps(steps):
+    # only keep the points where bandwidth or latency actually changes
+    compressed = []
+    for step in steps:
+        if compressed and (step['bandwidth_kbps'], step['latency_ms']) == \
+                (compressed[-1]['bandwidth_kbps'], compressed[-1]['latency_ms']):
+            continue
+        compressed.append(step)
+    return compressed
+
+def parse_csv_trace(lines, latency_ms):
+    rows = list(csv.reader(lines))
+    if rows and not rows[0][0].replace('.', '', 1).isdigit():
+        header = [c.strip() for c in rows[0]]
+        rows = [dict(zip(header, row)) for row in rows[1:]]
+    else:
+        rows = [dict(zip(['time_seconds', 'bandwidth_kbps', 'latency_ms'], row)) for row in rows]
+
+    return [make_step(row['time_seconds'], row['bandwidth_kbps'], row.get('latency_ms') or latency_ms) for row in rows]
+
+def parse_per_second_trace(lines, latency_ms):
+    return [make_step(i, value, latency_ms) for i, value in enumerate(lines)]
+
+def parse_mahimahi_trace(lines, latency_ms, window=1.0):
+    # each line is a millisecond timestamp at which one MTU-sized packet may be delivered
+    timestamps = [int(line) for line in lines]
+    n_windows = int(timestamps[-1] / 1000 // window) + 1
+    counts = [0] * n_windows
+    for ts in timestamps:
+        counts[min(int(ts / 1000 // window), n_windows - 1)] += 1
+
+    kbps_per_packet = MAHIMAHI_PACKET_BYTES * 8 / 1000 / window
+    return [make_step(i * window, count * kbps_per_packet, latency_ms) for i, count in enumerate(counts)]
+
+def load_trace(path, trace_format='auto', latency_ms=LATENCY_MS):
+    path = Path(path)
+    lines = [line.strip() for line in path.read_text().splitlines()]
+    lines = [line for line in lines if line and not line.startswith('#')]
+    if not lines:
+        raise ValueError(f"Trace file {path} is empty")
+
+    if trace_format == 'auto':
+        if path.suffix == '.csv' or ',' in lines[0]:
+            trace_format = 'csv'
+        elif path.suffix in MAHIMAHI_SUFFIXES:
+            trace_format = 'mahimahi'
+        else:
+            trace_format = 'per-second'
+
+    if trace_format == 'csv':
+        steps = parse_csv_trace(lines, latency_ms)
+    elif trace_format == 'mahimahi':
+        steps = parse_mahimahi_trace(lines, latency_ms)
+    elif trace_format == 'per-second':
+        steps = parse_per_second_trace(lines, latency_ms)
+    else:
+        raise ValueError(f"Unknown trace format: {trace_format}")
+
+    return compress_steps(sorted(steps, key=lambda s: s['time_seconds']))
+
+def with_latency(trace, latency_ms):
+    # the same bandwidth steps with one fixed latency (scenario sweeps vary the two independently)
+    return compress_steps([make_step(s['time_seconds'], s['bandwidth_kbps'], latency_ms) for s in trace])
+
+def step_at(trace, time_seconds):
+    current = trace[0]
+    for step in trace:
+        if step['time_seconds'] > time_seconds:
+            break
+        current = step
+    return current
+
+def describe_step(step):
+    return f"{step['bandwidth_kbps'] / 1000:g} Mbps, {step['latency_ms']:g}ms latency"
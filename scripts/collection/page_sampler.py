@@ -0,0 +1,134 @@
+from page_scripts import PLAYBACK_STATE_FN
+
+# each sample is [page time, width, height, buffer ahead, currentTime, dropped frames, total frames]; stall
+# intervals come from playbackState()'s listeners and are handed over once per drain
+INSTALL_JS = PLAYBACK_STATE_FN + """
+const intervalMs = arguments[0];
+const capacity = arguments[1];
+const useFrames = arguments[2];
+
+if (window.__abrSampler) {
+    window.__abrSampler.stop();
+}
+
+const s = {buf: new Array(capacity), head: 0, count: 0, dropped: 0, stopped: false, timer: null};
+
+function sample() {
+    const video = document.querySelector('video');
+    if (!video) return;
+    const quality = video.getVideoPlaybackQuality ? video.getVideoPlaybackQuality() : {};
+    s.buf[s.head] = [
+        performance.now(),
+        video.videoWidth,
+        video.videoHeight,
+        bufferAhead(video),
+        video.currentTime,
+        quality.droppedVideoFrames || 0,
+        quality.totalVideoFrames || 0
+    ];
+    s.head = (s.head + 1) % capacity;
+    if (s.count < capacity) {
+        s.count++;
+    } else {
+        s.dropped++;
+    }
+}
+
+s.drain = function() {
+    const out = [];
+    const start = (s.head - s.count + capacity) % capacity;
+    for (let i = 0; i < s.count; i++) {
+        out.push(s.buf[(start + i) % capacity]);
+    }
+    const dropped = s.dropped;
+    s.count = 0;
+    s.dropped = 0;
+    const video = document.querySelector('video');
+    const stalls = video ? playbackState(video).stalls : [];
+    return {samples: out, dropped: dropped, stalls: stalls, now: performance.now()};
+};
+
+s.stop = function() {
+    s.stopped = true;
+    if (s.timer !== null) clearInterval(s.timer);
+};
+
+const video = document.querySelector('video');
+if (video) {
+    // attaches the waiting/stalled listeners, so stalls are tracked from install on
+    playbackState(video);
+}
+if (useFrames && video && 'requestVideoFrameCallback' in video) {
+    let last = -Infinity;
+    const onFrame = function(now) {
+        if (s.stopped) return;
+        if (now - last >= intervalMs) {
+            sample();
+            last = now;
+        }
+        video.requestVideoFrameCallback(onFrame);
+    };
+    video.requestVideoFrameCallback(onFrame);
+    s.mode = 'frame';
+} else {
+    s.timer = setInterval(sample, intervalMs);
+    s.mode = 'interval';
+}
+
+window.__abrSampler = s;
+return s.mode;
+"""
+
+DRAIN_JS = "return window.__abrSampler ? window.__abrSampler.drain() : null;"
+
+STOP_JS = "if (window.__abrSampler) { window.__abrSampler.stop(); }"
+
+class PageSampler:
+    def __init__(self, driver, interval_ms, capacity, use_frames=False):
+        self.driver = driver
+        self.interval_ms = interval_ms
+        self.capacity = capacity
+        self.use_frames = use_frames
+        self.page_start_ms = None
+        self.dropped = 0
+        self.drains = 0
+
+    def install(self):
+        mode = self.driver.execute_script(INSTALL_JS, self.interval_ms, self.capacity, self.use_frames)
+        print(f"Sampler installed: {mode} mode, {self.interval_ms} ms, capacity {self.capacity}")
+        return mode
+
+    def mark_start(self):
+        # discard preroll samples and pin the page clock (performance.now) to the collector's t=0
+        result = self.driver.execute_script(DRAIN_JS)
+        self.page_start_ms = result['now']
+
+    def drain(self):
+        # the samples, plus the page's stall intervals with the page clock they were read at, as
+        # TrialRecorder.record_playback expects them
+        result = self.driver.execute_script(DRAIN_JS)
+        self.drains += 1
+        if not result:
+            return [], None
+
+        if result['dropped'] > 0:
+            self.dropped += result['dropped']
+            print(f"Warning: sampler ring buffer overflowed, {result['dropped']} samples lost")
+
+        samples = []
+        for t, width, height, buffer_seconds, current_time, dropped_frames, total_frames in result['samples']:
+            samples.append({
+                'elapsed': (t - self.page_start_ms) / 1000,
+                'width': width,
+                'height': height,
+                'buffer': buffer_seconds,
+                'currentTime': current_time,
+                'droppedFrames': dropped_frames,
+                'totalFrames': total_frames
+            })
+        playback = {'elapsed': (result['now'] - self.page_start_ms) / 1000, 'stalls': result['stalls'],
+                    'now': result['now']}
+        return samples, playback
+
+    def stop(self):
+        self.driver.execute_script(STOP_JS)
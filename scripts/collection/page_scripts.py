@@ -0,0 +1,134 @@
+# resolves once the <video> element exists and fires 'playing'; pressing play if the page left it paused
+READY_PROMISE_JS = """
+(function(timeoutMs) {
+    return new Promise(function(resolve) {
+        let observer = null;
+        let timer = null;
+
+        const finish = function(state) {
+            if (observer) observer.disconnect();
+            clearTimeout(timer);
+            const video = document.querySelector('video');
+            resolve({state: state, width: video ? video.videoWidth : 0, height: video ? video.videoHeight : 0});
+        };
+
+        const play = function(video) {
+            if (!video.paused) return;
+            const playButton = document.querySelector('.ytp-play-button');
+            if (playButton) {
+                playButton.click();
+            } else {
+                video.play().catch(function() {});
+            }
+        };
+
+        const attach = function(video) {
+            if (!video.paused && video.readyState >= 2 && video.videoWidth > 0) {
+                finish('playing');
+                return;
+            }
+            video.addEventListener('playing', function() { finish('playing'); }, {once: true});
+            video.addEventListener('loadeddata', function() { play(video); }, {once: true});
+            play(video);
+        };
+
+        timer = setTimeout(function() { finish('timeout'); }, timeoutMs);
+
+        const video = document.querySelector('video');
+        if (video) {
+            attach(video);
+            return;
+        }
+        observer = new MutationObserver(function() {
+            const found = document.querySelector('video');
+            if (found) {
+                observer.disconnect();
+                observer = null;
+                attach(found);
+            }
+        });
+        observer.observe(document.documentElement, {childList: true, subtree: true});
+    });
+})
+"""
+
+# WebDriver flavour: execute_async_script passes its completion callback as the last argument
+READY_ASYNC_JS = READY_PROMISE_JS + "(arguments[0]).then(arguments[arguments.length - 1]);"
+
+RESET_PLAYER_JS = """
+['localStorage', 'sessionStorage'].forEach(function(name) {
+    const storage = window[name];
+    Object.keys(storage).forEach(function(key) {
+        if (key.indexOf('yt-player') === 0) storage.removeItem(key);
+    });
+});
+const video = document.querySelector('video');
+if (!video) return false;
+video.pause();
+video.currentTime = 0;
+return true;
+"""
+
+CURRENT_URL_JS = "return location.href;"
+
+# buffer ahead of the playhead, read from the range that contains currentTime; after a seek or an evicted
+# range, buffered.end(0) belongs to a different part of the video
+BUFFER_AHEAD_FN = """
+function bufferAhead(video) {
+    const t = video.currentTime;
+    for (let i = 0; i < video.buffered.length; i++) {
+        if (video.buffered.start(i) <= t + 0.1 && t <= video.buffered.end(i)) return video.buffered.end(i) - t;
+    }
+    return 0;
+}
+"""
+
+# everything one observation returns. Frame counters are cumulative. 'waiting' (playback stopped for data)
+# and 'stalled' (download stopped making progress) are tracked by listeners installed on first use, as
+# [type, start, end] on the page clock; closed intervals are handed over once, open ones have end null
+PLAYBACK_STATE_FN = BUFFER_AHEAD_FN + """
+function playbackState(video) {
+    let s = window.__abrStalls;
+    if (!s || s.video !== video) {
+        s = {video: video, open: {}, closed: []};
+        const begin = function(e) {
+            if (!(e.type in s.open)) s.open[e.type] = performance.now();
+        };
+        const end = function(type) {
+            return function() {
+                if (!(type in s.open)) return;
+                s.closed.push([type, s.open[type], performance.now()]);
+                delete s.open[type];
+            };
+        };
+        video.addEventListener('waiting', begin);
+        video.addEventListener('stalled', begin);
+        video.addEventListener('playing', end('waiting'));
+        video.addEventListener('progress', end('stalled'));
+        window.__abrStalls = s;
+    }
+    const quality = video.getVideoPlaybackQuality ? video.getVideoPlaybackQuality() : {};
+    const stalls = s.closed.concat(Object.keys(s.open).map(function(type) { return [type, s.open[type], null]; }));
+    s.closed = [];
+    return {
+        width: video.videoWidth,
+        height: video.videoHeight,
+        buffer: bufferAhead(video),
+        currentTime: video.currentTime,
+        droppedFrames: quality.droppedVideoFrames || 0,
+        totalFrames: quality.totalVideoFrames || 0,
+        stalls: stalls,
+        now: performance.now()
+    };
+}
+"""
+
+VIDEO_STATE_JS = PLAYBACK_STATE_FN + """
+const video = document.querySelector('video');
+if (!video) return null;
+return playbackState(video);
+"""
+
+def as_expression(body):
+    # the snippets are written as WebDriver function bodies; CDP Runtime.evaluate needs an expression
+    return f"(function() {{{body}}})()"
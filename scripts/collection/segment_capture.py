@@ -0,0 +1,110 @@
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+from collector_config import *
+
+SEGMENT_COLUMNS = ['time_seconds', 'request_seconds', 'response_seconds', 'itag', 'media', 'bytes',
+                   'stream_kbps', 'status']
+
+NETWORK_EVENTS = ['Network.requestWillBeSent', 'Network.responseReceived', 'Network.loadingFinished',
+                  'Network.loadingFailed']
+
+def segment_fields(url):
+    # googlevideo URLs carry the rendition in the query: itag, mime, and for range requests the
+    # stream's total length (clen, bytes) and duration (dur, seconds), which give its encoded bitrate
+    query = parse_qs(urlsplit(url).query)
+    first = lambda key: query.get(key, [None])[0]
+    mime = first('mime') or ''
+    stream_kbps = None
+    try:
+        stream_kbps = round(int(first('clen')) * 8 / float(first('dur')) / 1000)
+    except (TypeError, ValueError, ZeroDivisionError):
+        pass
+    return {'itag': first('itag'), 'media': mime.split('/')[0] or None, 'stream_kbps': stream_kbps}
+
+class SegmentCapture:
+    # only requests still in flight are held in memory; each one becomes a row when it finishes or fails
+    def __init__(self, writer, pattern=SEGMENT_URL_PATTERN, max_inflight=SEGMENT_MAX_INFLIGHT):
+        self.writer = writer
+        self.pattern = pattern
+        self.max_inflight = max_inflight
+        self.inflight = OrderedDict()
+        self.session = None
+        self.start_time = None
+        self.time_offset = 0
+        # DevTools timestamps are on the browser's monotonic clock; the smallest (arrival - timestamp)
+        # seen so far is the best estimate of the offset to ours
+        self.clock_offset = None
+        self.segments = 0
+        self.bytes = 0
+        self.evicted = 0
+        self.handlers = {
+            'Network.requestWillBeSent': self.on_request,
+            'Network.responseReceived': self.on_response,
+            'Network.loadingFinished': self.on_finished,
+            'Network.loadingFailed': self.on_failed
+        }
+
+    def open(self, resume=False):
+        self.writer.add_stream('segments', 'segment_timeline.csv', SEGMENT_COLUMNS, resume=resume)
+
+    def start(self, session, start_time, time_offset=0):
+        self.session = session
+        self.start_time = start_time
+        self.time_offset = time_offset
+        for method in NETWORK_EVENTS:
+            session.on(method, self.handlers[method])
+
+    def stop(self):
+        if self.session is not None:
+            for method in NETWORK_EVENTS:
+                self.session.off(method, self.handlers[method])
+        # requests still open at the end never finished inside the trial
+        for request in list(self.inflight.values()):
+            self.write(request, None, 0, 'incomplete')
+        self.inflight.clear()
+
+    def trial_time(self, params, received):
+        offset = received - params['timestamp']
+        if self.clock_offset is None or offset < self.clock_offset:
+            self.clock_offset = offset
+        return round(self.time_offset + params['timestamp'] + self.clock_offset - self.start_time, 3)
+
+    def on_request(self, params, received):
+        url = params.get('request', {}).get('url', '')
+        if self.pattern not in url:
+            return
+        request = segment_fields(url)
+        request['request_seconds'] = self.trial_time(params, received)
+        request['response_seconds'] = None
+        self.inflight[params['requestId']] = request
+        if len(self.inflight) > self.max_inflight:
+            self.inflight.popitem(last=False)
+            self.evicted += 1
+
+    def on_response(self, params, received):
+        request = self.inflight.get(params['requestId'])
+        if request is not None:
+            request['response_seconds'] = self.trial_time(params, received)
+
+    def on_finished(self, params, received):
+        request = self.inflight.pop(params['requestId'], None)
+        if request is not None:
+            self.write(request, self.trial_time(params, received), int(params.get('encodedDataLength', 0)), 'ok')
+
+    def on_failed(self, params, received):
+        request = self.inflight.pop(params['requestId'], None)
+        if request is not None:
+            status = 'canceled' if params.get('canceled') else 'failed'
+            self.write(request, self.trial_time(params, received), 0, status)
+
+    def write(self, request, finished, size, status):
+        self.segments += 1
+        self.bytes += size
+        self.writer.append('segments', [finished, request['request_seconds'], request['response_seconds'],
+                                        request['itag'], request['media'], size, request['stream_kbps'], status])
+
+    def describe(self):
+        text = f"{self.segments} segment requests, {self.bytes / 1e6:.1f} MB"
+        if self.evicted:
+            text += f", {self.evicted} dropped (more than {self.max_inflight} in flight)"
+        return text
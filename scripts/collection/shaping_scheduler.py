@@ -0,0 +1,60 @@
+import asyncio
+import threading
+import time
+from network_trace import step_at
+
+class ShapingScheduler:
+    def __init__(self, trace, apply_step, on_applied):
+        self.trace = trace
+        self.apply_step = apply_step
+        self.on_applied = on_applied
+        self.stop_event = threading.Event()
+        self.thread = None
+        # a failed shaping command ends the schedule; the collector fails the trial through check(), since
+        # everything after it would be labelled with trace steps that were never applied
+        self.error = None
+
+    def plan(self, offset=0):
+        # on resume, re-apply the step that is active at the offset, then everything after it
+        current = step_at(self.trace, offset)
+        steps = [dict(current, time_seconds=max(current['time_seconds'], offset))]
+        steps += [step for step in self.trace if step['time_seconds'] > offset]
+        return steps
+
+    def applied(self, step, start_time, offset):
+        applied_at = offset + time.monotonic() - start_time
+        self.on_applied(step, applied_at)
+
+    def start(self, start_time, offset=0):
+        self.thread = threading.Thread(target=self.run, args=(start_time, offset), daemon=True)
+        self.thread.start()
+
+    def run(self, start_time, offset=0):
+        # deadlines are absolute on the monotonic clock, so late wake-ups never accumulate
+        try:
+            for step in self.plan(offset):
+                deadline = start_time + step['time_seconds'] - offset
+                if self.stop_event.wait(max(0, deadline - time.monotonic())):
+                    return
+                self.apply_step(step)
+                self.applied(step, start_time, offset)
+        except Exception as e:
+            self.error = e
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    async def run_async(self, start_time, offset=0):
+        try:
+            for step in self.plan(offset):
+                await asyncio.sleep(max(0, start_time + step['time_seconds'] - offset - time.monotonic()))
+                await self.apply_step(step)
+                self.applied(step, start_time, offset)
+        except Exception as e:
+            self.error = e
+
+    def check(self):
+        if self.error is not None:
+            raise RuntimeError(f"network shaping failed: {self.error}") from self.error
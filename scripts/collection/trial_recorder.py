@@ -0,0 +1,162 @@
+from collector_config import *
+from network_trace import describe_step
+from trial_writer import TrialWriter
+from live_metrics import LiveMetrics
+
+class TrialRecorder:
+    def __init__(self, trial_num, is_test=False, fsync_policy=WRITER_FSYNC_POLICY, live_server=None):
+        self.trial_num = trial_num
+        self.is_test = is_test
+
+        if is_test:
+            self.output_dir = get_test_dir()
+        else:
+            self.output_dir = get_trial_dir(trial_num)
+
+        self.writer = TrialWriter(self.output_dir, fsync_policy)
+        self.time_offset = 0
+
+        self.last_width = None
+        self.last_height = None
+        self.last_buffer_milestone = -1
+        self.last_forced_record = -1
+        self.last_status_print = 0
+        # waiting / stalled intervals the page still reports as open, by type, in trial seconds
+        self.open_stalls = {}
+
+        self.live = LiveMetrics(trial_num)
+        if live_server is not None:
+            live_server.register(self.live)
+
+    def detect_quality_change(self, width, height):
+        if self.last_width is None or self.last_height is None:
+            return True
+        return (width, height) != (self.last_width, self.last_height)
+
+    def detect_buffer_milestone(self, buffer_seconds):
+        current_milestone = int(buffer_seconds // 5) * 5
+        if current_milestone > self.last_buffer_milestone and current_milestone in BUFFER_MILESTONES:
+            return True
+        return False
+
+    def estimate_bitrate(self, width, height):
+        return BITRATE_MAP.get((width, height), 1200)
+
+    def record_quality_event(self, timestamp, width, height, note=""):
+        bitrate = self.estimate_bitrate(width, height)
+        self.writer.append('quality', [timestamp, width, height, bitrate, note])
+        self.last_width = width
+        self.last_height = height
+
+    def record_state(self, timestamp, state, note):
+        # startup, resume and end of a trial: both streams get a row regardless of what changed
+        self.record_quality_event(timestamp, state['width'], state['height'], note)
+        self.record_buffer_event(timestamp, state['buffer'], note)
+        self.live.observe(timestamp, state['width'], state['height'],
+                          self.estimate_bitrate(state['width'], state['height']), state['buffer'])
+
+    def record_buffer_event(self, timestamp, buffer_seconds, note=""):
+        self.writer.append('buffer', [timestamp, round(buffer_seconds, 1), note])
+        current_milestone = int(buffer_seconds // 5) * 5
+        if current_milestone > self.last_buffer_milestone:
+            self.last_buffer_milestone = current_milestone
+
+    def record_shaping_event(self, step, applied_at):
+        lateness_ms = (applied_at - step['time_seconds']) * 1000
+        # shaping changes are rare and matter for alignment, so push them to disk right away
+        self.writer.append('shaping', [round(applied_at, 3), step['time_seconds'], step['bandwidth_kbps'],
+                                       step['latency_ms'], round(lateness_ms, 1)], flush=True)
+        self.live.shaping(step, applied_at)
+        print(f"[{applied_at:.1f}s] Shaping: {describe_step(step)} ({lateness_ms:+.0f} ms)")
+
+    def record_playback(self, timestamp, state, frames=True):
+        # state is the page's playbackState(); its stall times are on the page clock, which maps onto the
+        # trial clock through the 'now' it was read at
+        if frames:
+            self.record_frames(timestamp, state)
+
+        page_time = lambda ms: round(timestamp - (state['now'] - ms) / 1000, 2)
+        still_open = {}
+        for kind, start, end in state['stalls']:
+            if end is None:
+                still_open[kind] = max(page_time(start), self.time_offset)
+            elif page_time(end) > self.time_offset:
+                # intervals that ended before this trial started belong to the preroll or the previous trial
+                self.record_stall(max(page_time(start), self.time_offset), page_time(end), kind)
+        self.open_stalls = still_open
+        self.live.stalled(still_open.get('waiting'))
+
+    def record_frames(self, timestamp, state):
+        self.writer.append('playback', [round(timestamp, 2), state['droppedFrames'], state['totalFrames']])
+
+    def record_stall(self, start, end, kind, note=""):
+        self.writer.append('stalls', [start, end, kind, note])
+        self.live.stall(start, end, kind)
+        if kind == 'waiting':
+            print(f"[{start:.1f}s] Rebuffering for {end - start:.2f}s")
+
+    def close_open_stalls(self, timestamp):
+        # cut at the end of the trial so the stall time still counts
+        for kind, start in self.open_stalls.items():
+            self.record_stall(start, timestamp, kind, "open")
+        self.open_stalls = {}
+
+    def handle_sample(self, timestamp, width, height, buffer_seconds):
+        bitrate = self.estimate_bitrate(width, height)
+        self.live.observe(timestamp, width, height, bitrate, buffer_seconds)
+        quality_changed = self.detect_quality_change(width, height)
+        buffer_milestone = self.detect_buffer_milestone(buffer_seconds)
+        force_record = timestamp - self.last_forced_record >= MIN_EVENT_SPACING
+
+        if quality_changed:
+            self.record_quality_event(timestamp, width, height, "quality_change")
+
+        if buffer_milestone:
+            self.record_buffer_event(timestamp, buffer_seconds, "buffer_milestone")
+
+        if force_record and not quality_changed:
+            self.record_quality_event(timestamp, width, height, "periodic")
+            if not buffer_milestone:
+                self.record_buffer_event(timestamp, buffer_seconds, "periodic")
+            self.last_forced_record = timestamp
+
+        if timestamp - self.last_status_print >= 15:
+            print(f"[{timestamp}s] Quality: {width}x{height} ({bitrate} kbps), Buffer: {buffer_seconds:.1f}s "
+                  f"(min {self.live.min_buffer:.1f}s, {self.live.switches} switches)")
+            self.last_status_print = timestamp
+
+    def open_trial_files(self, duration, resume=False):
+        previous = self.writer.load_manifest() if resume else None
+        if previous is not None and previous['status'] == 'complete':
+            print(f"trial_{self.trial_num} is already complete, nothing to resume")
+            return None
+
+        self.time_offset = self.writer.open(self.trial_num, duration, resume)
+        if self.time_offset > 0:
+            self.restore_state()
+            print(f"Resuming trial_{self.trial_num} at {self.time_offset}s")
+        return self.time_offset
+
+    def restore_state(self):
+        quality_rows = self.writer.read_rows('quality')
+        buffer_rows = self.writer.read_rows('buffer')
+
+        if quality_rows:
+            self.last_width = int(quality_rows[-1][1])
+            self.last_height = int(quality_rows[-1][2])
+        periodic = [float(row[0]) for row in quality_rows if row[4] == 'periodic']
+        if periodic:
+            self.last_forced_record = periodic[-1]
+        for row in buffer_rows:
+            self.last_buffer_milestone = max(self.last_buffer_milestone, int(float(row[1]) // 5) * 5)
+        self.last_status_print = self.time_offset
+
+    def finish_trial_files(self, status='complete'):
+        self.live.finish(self.live.trial_time(), status)
+        self.writer.close(status)
+
+        rows = self.writer.manifest['rows']
+        trial_label = "test" if self.is_test else self.trial_num
+        print(f"Saved: {self.output_dir / 'quality_timeline.csv'} ({rows['quality']} events)")
+        print(f"Saved: {self.output_dir / 'buffer_timeline.csv'} ({rows['buffer']} events)")
+        print(f"Collection {status}: trial_{trial_label}")
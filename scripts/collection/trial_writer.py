@@ -0,0 +1,176 @@
+import csv
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from collector_config import *
+
+QUALITY_COLUMNS = ['time_seconds', 'resolution_width', 'resolution_height', 'bitrate_kbps', 'notes']
+BUFFER_COLUMNS = ['time_seconds', 'buffer_seconds', 'notes']
+SHAPING_COLUMNS = ['time_seconds', 'scheduled_seconds', 'bandwidth_kbps', 'latency_ms', 'lateness_ms']
+PLAYBACK_COLUMNS = ['time_seconds', 'dropped_frames', 'total_frames']
+STALL_COLUMNS = ['time_seconds', 'end_seconds', 'type', 'notes']
+
+FSYNC_POLICIES = ('row', 'batch', 'close')
+# streams whose rows are player samples; shaping and timing rows don't advance the resume point
+TIMELINE_STREAMS = ('quality', 'buffer')
+
+def repair_partial_line(path):
+    # a crash mid-write can leave a torn last row; cut the file back to the last newline
+    with path.open('rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+
+def has_rows(path):
+    # anything past the header line
+    if not path.exists():
+        return False
+    with path.open('rb') as f:
+        f.readline()
+        return bool(f.readline())
+
+class TrialWriter:
+    def __init__(self, output_dir, fsync_policy=WRITER_FSYNC_POLICY, batch_size=WRITER_BATCH_SIZE,
+                 flush_interval=WRITER_FLUSH_INTERVAL):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"fsync policy must be one of {FSYNC_POLICIES}, got {fsync_policy!r}")
+        self.output_dir = output_dir
+        self.manifest_file = output_dir / 'trial_manifest.json'
+        self.fsync_policy = fsync_policy
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.streams = {}
+        self.manifest = None
+        self.last_flush = time.monotonic()
+        # the shaping scheduler appends from its own thread
+        self.lock = threading.RLock()
+
+    def load_manifest(self):
+        if not self.manifest_file.exists():
+            return None
+        with self.manifest_file.open() as f:
+            return json.load(f)
+
+    def open(self, trial_num, duration, resume=False):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        now = datetime.now().isoformat(timespec='seconds')
+
+        previous = self.load_manifest() if resume else None
+        if resume and previous is None:
+            # rows without a manifest (e.g. trials collected before manifests existed) can't be resumed safely,
+            # and opening the streams fresh would truncate them
+            existing = sorted(path.name for path in self.output_dir.glob('*.csv') if has_rows(path))
+            if existing:
+                raise FileExistsError(f"{self.output_dir} has {', '.join(existing)} but no {self.manifest_file.name}, "
+                                      f"refusing to resume over it")
+        if previous is not None:
+            self.manifest = previous
+            self.manifest['status'] = 'collecting'
+            self.manifest['segments'].append({'started_at': now, 'offset_seconds': previous['last_time_seconds']})
+        else:
+            self.manifest = {
+                'trial': trial_num,
+                'status': 'collecting',
+                'duration': duration,
+                'fsync_policy': self.fsync_policy,
+                'started_at': now,
+                'updated_at': now,
+                'last_time_seconds': 0,
+                'rows': {},
+                'files': {},
+                'segments': [{'started_at': now, 'offset_seconds': 0}]
+            }
+
+        self.add_stream('quality', 'quality_timeline.csv', QUALITY_COLUMNS, resume=previous is not None)
+        self.add_stream('buffer', 'buffer_timeline.csv', BUFFER_COLUMNS, resume=previous is not None)
+        self.add_stream('shaping', 'shaping_timeline.csv', SHAPING_COLUMNS, resume=previous is not None)
+        self.add_stream('playback', 'playback_timeline.csv', PLAYBACK_COLUMNS, resume=previous is not None)
+        self.add_stream('stalls', 'stall_timeline.csv', STALL_COLUMNS, resume=previous is not None)
+
+        if previous is not None:
+            # trust what actually reached the disk over the manifest's last checkpoint
+            last_times = [float(rows[-1][0]) for rows in map(self.read_rows, ['quality', 'buffer']) if rows]
+            self.manifest['last_time_seconds'] = max(last_times, default=0)
+            self.manifest['segments'][-1]['offset_seconds'] = self.manifest['last_time_seconds']
+
+        self.write_manifest()
+        return self.manifest['last_time_seconds']
+
+    def add_stream(self, name, filename, columns, resume=False):
+        path = self.output_dir / filename
+        if resume and path.exists():
+            repair_partial_line(path)
+        else:
+            path.write_text('')
+
+        f = path.open('a', newline='')
+        writer = csv.writer(f)
+        if f.tell() == 0:
+            writer.writerow(columns)
+
+        self.streams[name] = {'path': path, 'file': f, 'writer': writer, 'pending': []}
+        self.manifest['files'][name] = filename
+        self.manifest['rows'].setdefault(name, 0)
+        if resume:
+            self.manifest['rows'][name] = len(self.read_rows(name))
+
+    def read_rows(self, name):
+        with self.streams[name]['path'].open(newline='') as f:
+            rows = list(csv.reader(f))
+        return rows[1:]
+
+    def append(self, name, row, flush=False):
+        with self.lock:
+            stream = self.streams[name]
+            stream['pending'].append(row)
+            self.manifest['rows'][name] += 1
+            if name in TIMELINE_STREAMS:
+                self.manifest['last_time_seconds'] = max(self.manifest['last_time_seconds'], row[0])
+
+            if (flush or self.fsync_policy == 'row' or len(stream['pending']) >= self.batch_size
+                    or time.monotonic() - self.last_flush >= self.flush_interval):
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            for stream in self.streams.values():
+                if stream['pending']:
+                    stream['writer'].writerows(stream['pending'])
+                    stream['pending'] = []
+                stream['file'].flush()
+                if self.fsync_policy != 'close':
+                    os.fsync(stream['file'].fileno())
+            self.write_manifest()
+            self.last_flush = time.monotonic()
+
+    def write_manifest(self, sync=None):
+        if sync is None:
+            sync = self.fsync_policy != 'close'
+        self.manifest['updated_at'] = datetime.now().isoformat(timespec='seconds')
+        tmp_file = self.manifest_file.with_suffix('.tmp')
+        with tmp_file.open('w') as f:
+            json.dump(self.manifest, f, indent=2)
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+        os.replace(tmp_file, self.manifest_file)
+
+    def set_metadata(self, key, value):
+        with self.lock:
+            self.manifest[key] = value
+
+    def close(self, status='complete'):
+        if self.manifest is None:
+            return
+        self.manifest['status'] = status
+        for stream in self.streams.values():
+            if stream['pending']:
+                stream['writer'].writerows(stream['pending'])
+                stream['pending'] = []
+            stream['file'].flush()
+            os.fsync(stream['file'].fileno())
+            stream['file'].close()
+        self.write_manifest(sync=True)
+        self.streams = {}
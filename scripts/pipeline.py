@@ -0,0 +1,325 @@
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+for subdir in ('collection', 'analysis', 'visualization'):
+    sys.path.insert(0, str(SCRIPTS_DIR / subdir))
+
+import matplotlib
+matplotlib.use('Agg')
+
+import pandas as pd
+from network_trace import load_trace
+from trial_store import PROC_DIR, RAW_DIR, list_trials, source_path, update_index
+from process_trial import GRID_STEP, process_trials, write_unified_timelines
+from calculate_metrics import calculate_metrics
+from validate_data import REPORT_FILE, quarantined_trials, read_report, validate_trials, write_report
+import adaptation_latency
+from plot_config import DPI, FIGURE_SIZE, FIGURE_SIZE_WIDE
+from batch_render import render_timelines
+
+CACHE_FILE = Path('data/.pipeline_cache.json')
+CACHE_VERSION = 1
+FIGURES_DIR = Path('figures')
+METRICS_FILE = PROC_DIR / 'metrics_summary.csv'
+AGGREGATE = 'all'
+
+def chunks(items, n):
+    size = max(1, -(-len(items) // max(1, n)))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+# stage bodies are module-level so worker processes can unpickle them
+
+def process_shard(trial_nums, step, trace_path):
+    trace = load_trace(trace_path) if trace_path else None
+    write_unified_timelines(process_trials(trial_nums, step, trace), index=False)
+    return trial_nums
+
+class Stage:
+    def __init__(self, name, deps, code, params, inputs, outputs, run, per_trial=True, present=None):
+        self.name = name
+        self.deps = deps
+        self.code = code
+        self.params = params
+        self.inputs = inputs
+        self.outputs = outputs
+        self.run = run
+        self.per_trial = per_trial
+        # whether a unit's result is actually in its outputs, beyond the files existing
+        self.present = present or (lambda unit: True)
+
+class Pipeline:
+    def __init__(self, step=GRID_STEP, trace_path=None, workers=os.cpu_count(), force=False, dry_run=False,
+                 targets=None):
+        self.step = step
+        self.trace_path = trace_path
+        self.workers = max(1, workers or 1)
+        self.force = force
+        self.dry_run = dry_run
+        # stages to bring up to date, with everything they depend on; all of them when None
+        self.targets = targets
+        self.cache = self.load_cache()
+        self.trials = []
+        self.summary = None
+        self.validated = None
+        self.stages = self.build_stages()
+
+    def load_cache(self):
+        if CACHE_FILE.exists():
+            with CACHE_FILE.open() as f:
+                cache = json.load(f)
+            if cache.get('version') == CACHE_VERSION:
+                return cache
+        return {'version': CACHE_VERSION, 'files': {}, 'stages': {}}
+
+    def save_cache(self):
+        CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp = CACHE_FILE.with_suffix('.tmp')
+        with tmp.open('w') as f:
+            json.dump(self.cache, f, indent=1, sort_keys=True)
+        os.replace(tmp, CACHE_FILE)
+
+    def file_hash(self, path):
+        # content hash, memoised on (size, mtime) so unchanged files are never re-read
+        path = Path(path)
+        if not path.exists():
+            return None
+        stat = path.stat()
+        cached = self.cache['files'].get(str(path))
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        digest = hashlib.sha256(path.read_bytes()).hexdigest()
+        self.cache['files'][str(path)] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def stage_key(self, stage, trial_num):
+        h = hashlib.sha256()
+        h.update(json.dumps([stage.name, stage.params], sort_keys=True).encode())
+        for path in stage.code:
+            h.update((self.file_hash(SCRIPTS_DIR / path) or '-').encode())
+        for path in stage.inputs(trial_num):
+            h.update(str(path).encode())
+            h.update((self.file_hash(path) or '-').encode())
+        return h.hexdigest()
+
+    def build_stages(self):
+        trace_hash = self.file_hash(self.trace_path) if self.trace_path else 'default'
+        raw_inputs = lambda t: [source_path(t, table) for table in ('quality', 'buffer', 'shaping')]
+        timeline = lambda t: [source_path(t, 'processed')]
+
+        stages = [
+            Stage('process', [], ['analysis/process_trial.py', 'collection/network_trace.py'],
+                  {'step': self.step, 'trace': trace_hash}, lambda t: raw_inputs(t) + [source_path(t, 'segments')],
+                  timeline, self.run_process),
+            Stage('validate', ['process'], ['analysis/validate_data.py', 'collection/collector_config.py'], {},
+                  lambda t: timeline(t) + [source_path(t, table) for table in ('buffer', 'shaping')] +
+                  [RAW_DIR / f'trial_{t}' / 'trial_manifest.json'],
+                  lambda t: [REPORT_FILE], self.run_validate,
+                  present=lambda t: t in self.validated_trials()),
+            Stage('metrics', ['validate'], ['analysis/calculate_metrics.py'], {},
+                  lambda t: timeline(t) + [source_path(t, table) for table in ('stalls', 'playback')],
+                  lambda t: [METRICS_FILE], self.run_metrics,
+                  present=lambda t: t in self.summary_trials()),
+            Stage('timeline_plot', ['validate'], ['visualization/batch_render.py', 'visualization/plot_config.py',
+                                                 'visualization/downsample.py'],
+                  {'dpi': DPI, 'size': FIGURE_SIZE}, timeline,
+                  lambda t: [FIGURES_DIR / f'trial_{t}_timeline.png'], self.run_timeline_plots),
+            Stage('comparison_plot', ['metrics'], ['visualization/plot_comparison.py', 'visualization/plot_config.py'],
+                  {'dpi': DPI, 'size': FIGURE_SIZE_WIDE},
+                  lambda _: [METRICS_FILE] + [source_path(t, 'processed') for t in self.trials],
+                  lambda _: [FIGURES_DIR / 'metrics_comparison.png', FIGURES_DIR / 'bitrate_overlay.png'],
+                  self.run_comparison_plot, per_trial=False),
+            Stage('bands_plot', ['validate'], ['analysis/aggregate.py', 'visualization/plot_bands.py',
+                                              'visualization/plot_config.py'],
+                  {'dpi': DPI, 'size': FIGURE_SIZE},
+                  lambda _: [source_path(t, 'processed') for t in self.trials],
+                  lambda _: [FIGURES_DIR / 'bitrate_buffer_bands.png'],
+                  self.run_bands_plot, per_trial=False),
+            Stage('latency', ['validate'], ['analysis/adaptation_latency.py', 'analysis/process_trial.py',
+                                  'collection/network_trace.py'],
+                  {'trace': trace_hash, 'steady': adaptation_latency.STEADY_SECONDS},
+                  lambda _: [p for t in self.trials for p in raw_inputs(t)],
+                  lambda _: [adaptation_latency.OUTPUT_FILE], self.run_latency, per_trial=False),
+        ]
+        return {stage.name: stage for stage in stages}
+
+    def order(self):
+        # depth-first topological sort of the stage graph
+        ordered = []
+        def visit(name):
+            if name not in ordered:
+                for dep in self.stages[name].deps:
+                    visit(dep)
+                ordered.append(name)
+        for name in self.targets or self.stages:
+            visit(name)
+        return ordered
+
+    def stale(self, stage):
+        units = self.trials if stage.per_trial else [AGGREGATE]
+        done = self.cache['stages'].setdefault(stage.name, {})
+        stale = []
+        for unit in units:
+            outputs_present = all(Path(p).exists() for p in stage.outputs(unit)) and stage.present(unit)
+            if self.force or not outputs_present or done.get(unit) != self.stage_key(stage, unit):
+                stale.append(unit)
+        return stale
+
+    def run_process(self, trial_nums):
+        # trials are processed as vectorized batches, one batch per worker
+        shards = chunks(trial_nums, self.workers)
+        if len(shards) == 1:
+            process_shard(shards[0], self.step, self.trace_path)
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                list(pool.map(process_shard, shards, [self.step] * len(shards), [self.trace_path] * len(shards)))
+        update_index(trial_nums)
+
+    def validated_trials(self):
+        if self.validated is None:
+            report = read_report()
+            self.validated = {r['trial'] for r in report['results']} if report else set()
+        return self.validated
+
+    def run_validate(self, trial_nums):
+        # like metrics, only stale trials are checked again and the rest of the report is carried over
+        results = [r for shard in validate_trials(trial_nums, self.workers) for r in shard]
+        report = read_report()
+        if report:
+            results += [r for r in report['results'] if r['trial'] in self.trials and r['trial'] not in trial_nums]
+        self.validated = {r['trial'] for r in results}
+        write_report(results)
+
+    def apply_quarantine(self):
+        # trials that failed validation are left out of every stage after it
+        quarantined = quarantined_trials() & set(self.trials)
+        if quarantined:
+            print(f"validate: quarantined {len(quarantined)} trials ({', '.join(sorted(quarantined))}), see {REPORT_FILE}")
+            self.trials = [t for t in self.trials if t not in quarantined]
+
+    def summary_trials(self):
+        if self.summary is None:
+            self.summary = set()
+            if METRICS_FILE.exists():
+                self.summary = set(pd.read_csv(METRICS_FILE, dtype={'trial': str}, usecols=['trial'])['trial'])
+        return self.summary
+
+    def run_metrics(self, trial_nums):
+        # only stale rows are recomputed; everything else is carried over from the existing summary
+        fresh = calculate_metrics(trial_nums, self.workers)
+        if METRICS_FILE.exists():
+            previous = pd.read_csv(METRICS_FILE, dtype={'trial': str})
+            previous = previous[previous['trial'].isin(self.trials) & ~previous['trial'].isin(trial_nums)]
+            fresh = pd.concat([previous, fresh], ignore_index=True)
+        fresh = fresh.sort_values('trial', kind='stable').reset_index(drop=True)
+        fresh.to_csv(METRICS_FILE, index=False)
+        self.summary = set(fresh['trial'])
+
+    def run_timeline_plots(self, trial_nums):
+        # staleness is already decided here, so the renderer's own skip check is bypassed
+        render_timelines(trial_nums, self.workers, force=True)
+
+    def run_comparison_plot(self, _):
+        import plot_comparison
+        FIGURES_DIR.mkdir(exist_ok=True)
+        plot_comparison.plot_metrics_comparison()
+        plot_comparison.plot_bitrate_overlay(trial_nums=self.trials)
+
+    def run_bands_plot(self, _):
+        from plot_bands import plot_bands
+        FIGURES_DIR.mkdir(exist_ok=True)
+        plot_bands(self.trials)
+
+    def run_latency(self, _):
+        trace = load_trace(self.trace_path) if self.trace_path else None
+        quality, buffer, shaping = adaptation_latency.load_raw_trials(self.trials)
+        latency = adaptation_latency.compute_latency(self.trials, quality, buffer, shaping, trace)
+        latency.to_csv(adaptation_latency.OUTPUT_FILE, index=False, float_format='%.6g')
+
+    def run(self):
+        # the store may keep trials whose CSVs were removed; the pipeline only follows what is in data/raw
+        self.trials = [t for t in list_trials('quality') if source_path(t, 'quality').exists()]
+        if not self.trials:
+            print("No trials found in data/raw")
+            return False
+
+        unknown = set(self.targets or []) - set(self.stages)
+        if unknown:
+            print(f"Unknown stage {', '.join(sorted(unknown))} (choose from {', '.join(self.stages)})")
+            return False
+
+        for name in self.order():
+            stage = self.stages[name]
+            stale = self.stale(stage)
+            if name == 'metrics' and not stale and not self.dry_run and self.summary_trials() - set(self.trials):
+                # a trial that disappeared from data/raw still has to leave the summary
+                self.run_metrics([])
+
+            total = len(self.trials) if stage.per_trial else 1
+            if not stale:
+                print(f"{name}: up to date ({total} {'trials' if stage.per_trial else 'outputs'})")
+            elif self.dry_run:
+                print(f"{name}: {len(stale)}/{total} stale")
+            else:
+                start = time.monotonic()
+                stage.run(stale)
+                done = self.cache['stages'][name]
+                for unit in stale:
+                    done[unit] = self.stage_key(stage, unit)
+                # drop cache entries for trials that no longer exist
+                for unit in set(done) - set(self.trials) - {AGGREGATE}:
+                    del done[unit]
+                self.save_cache()
+                print(f"{name}: rebuilt {len(stale)}/{total} in {time.monotonic() - start:.1f}s")
+
+            if name == 'validate' and not self.dry_run:
+                self.apply_quarantine()
+
+        self.save_cache()
+        return True
+
+def main():
+    step = GRID_STEP
+    trace_path = None
+    workers = os.cpu_count()
+    force = False
+    dry_run = False
+    targets = None
+
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '--step':
+            step = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--trace':
+            trace_path = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--workers':
+            workers = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--force':
+            force = True
+            i += 1
+        elif sys.argv[i] == '--dry-run':
+            dry_run = True
+            i += 1
+        elif sys.argv[i] == '--stages':
+            targets = sys.argv[i + 1].split(',')
+            i += 2
+        elif sys.argv[i] in ('-h', '--help'):
+            print("Usage: python scripts/pipeline.py [--workers N] [--step SECONDS] [--trace FILE] [--force] [--dry-run] "
+                  "[--stages metrics,latency]")
+            sys.exit(0)
+        else:
+            i += 1
+
+    if not Pipeline(step, trace_path, workers, force, dry_run, targets).run():
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import sys
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+for subdir in ('collection', 'simulation', 'analysis', 'visualization'):
+    sys.path.insert(0, str(SCRIPTS_DIR / subdir))
+
+import pandas as pd
+from collector_config import *
+from network_trace import default_trace, load_trace, with_latency
+from trial_store import PROC_DIR, RAW_DIR, list_trials
+
+# a spec is a JSON grid; every combination of these is one scenario cell, collected `repetitions` times
+DIMENSIONS = ['backend', 'video', 'trace', 'latency_ms', 'policy']
+BACKENDS = ['browser', 'simulator']
+OUTPUT_FILE = PROC_DIR / 'scenario_metrics.csv'
+FIGURES_DIR = Path('figures')
+
+def parse_video(entry):
+    # a plain URL, or {"name": ..., "url": ..., "ladder": "426x240:400,..."}; the simulator plays the ladder
+    if isinstance(entry, str):
+        entry = {'url': entry}
+    url = entry.get('url', YOUTUBE_VIDEO_URL)
+    return {'name': entry.get('name', url), 'url': url, 'ladder': entry.get('ladder')}
+
+def load_spec(path):
+    with open(path) as f:
+        spec = json.load(f)
+    spec.setdefault('name', Path(path).stem)
+    spec.setdefault('prefix', spec['name'])
+    spec.setdefault('backend', 'browser')
+    spec.setdefault('repetitions', 1)
+    spec.setdefault('duration', TOTAL_DURATION)
+    if spec['backend'] not in BACKENDS:
+        raise ValueError(f"backend must be one of {', '.join(BACKENDS)}, got {spec['backend']!r}")
+    spec['videos'] = [parse_video(v) for v in spec.get('videos', [YOUTUBE_VIDEO_URL])]
+    spec.setdefault('traces', ['default'])
+    spec.setdefault('latencies_ms', [LATENCY_MS])
+    # the ABR policy is a condition only the simulator can vary; in the browser it is YouTube's own
+    if spec['backend'] == 'simulator':
+        spec.setdefault('policies', ['hybrid'])
+        spec.setdefault('seed', 0)
+        spec.setdefault('noise', None)
+    else:
+        spec['policies'] = [None]
+    return spec
+
+def resolve_trace(name, latency_ms):
+    trace = default_trace() if name == 'default' else load_trace(name)
+    return with_latency(trace, latency_ms)
+
+def scenario_id(spec, params, trace, ladder):
+    # the resolved trace steps and ladder are part of the key, so editing a trace file makes its cells new ones
+    settings = {k: spec.get(k) for k in ('duration', 'seed', 'noise')}
+    key = json.dumps([params, trace, ladder, settings], sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()[:8]
+
+def expand_spec(spec):
+    cells = []
+    for video, trace_name, latency_ms, policy in itertools.product(spec['videos'], spec['traces'],
+                                                                   spec['latencies_ms'], spec['policies']):
+        params = {'backend': spec['backend'], 'video': video['name'], 'trace': trace_name,
+                  'latency_ms': latency_ms, 'policy': policy}
+        trace = resolve_trace(trace_name, latency_ms)
+        cell_id = scenario_id(spec, params, trace, video['ladder'])
+        trials = [(rep, f"{spec['prefix']}-{cell_id}-{rep:02d}") for rep in range(1, spec['repetitions'] + 1)]
+        cells.append({'id': cell_id, 'params': params, 'video': video, 'trace': trace, 'trials': trials})
+    return cells
+
+def read_tags():
+    # scenario tags of every trial in data/raw, straight from the manifests
+    tags = {}
+    for trial_num in list_trials('quality'):
+        manifest_file = RAW_DIR / f'trial_{trial_num}' / 'trial_manifest.json'
+        if not manifest_file.exists():
+            continue
+        with manifest_file.open() as f:
+            manifest = json.load(f)
+        if 'scenario' in manifest:
+            tags[trial_num] = dict(manifest['scenario'], status=manifest.get('status'))
+    return tags
+
+def plan(cells, tags):
+    # a repetition is present when some complete trial carries its cell id, whichever spec collected it;
+    # failed or aborted attempts are collected again
+    present = {}
+    for trial_num, tag in tags.items():
+        if tag['status'] == 'complete':
+            present.setdefault(tag['id'], {})[tag['repetition']] = trial_num
+    for cell in cells:
+        have = present.get(cell['id'], {})
+        cell['present'] = [have[rep] for rep, _ in cell['trials'] if rep in have]
+        cell['pending'] = [(rep, name) for rep, name in cell['trials'] if rep not in have]
+    return cells
+
+def scenario_tag(spec, cell, rep):
+    return {'id': cell['id'], 'spec': spec['name'], **cell['params'], 'repetition': rep}
+
+def print_plan(cells):
+    print(f"{'cell':<9} {'video':<24} {'trace':<16} {'latency':>7} {'policy':<10} {'have':>5} {'new':>5}")
+    for cell in cells:
+        p = cell['params']
+        video = p['video'] if len(p['video']) <= 24 else '..' + p['video'][-22:]
+        print(f"{cell['id']:<9} {video:<24} {Path(p['trace']).name:<16} {p['latency_ms']:>7g} "
+              f"{p['policy'] or '-':<10} {len(cell['present']):>5} {len(cell['pending']):>5}")
+    pending = sum(len(c['pending']) for c in cells)
+    print(f"\n{len(cells)} cells, {sum(len(c['present']) for c in cells)} trials present, {pending} to collect")
+
+def collect_simulated(spec, cells, workers):
+    from abr_simulator import THROUGHPUT_NOISE, parse_ladder, simulate_trials
+    noise = spec['noise'] if spec['noise'] is not None else THROUGHPUT_NOISE
+    for cell in cells:
+        if not cell['pending']:
+            continue
+        reps = [rep for rep, _ in cell['pending']]
+        ladder = cell['video']['ladder']
+        # noise is seeded by repetition, so repetition k sees the same throughput noise in every cell
+        # and cells differ only by their parameters
+        simulate_trials([name for _, name in cell['pending']], cell['params']['policy'], cell['trace'],
+                        cell['params']['trace'], spec['duration'], spec['seed'], noise,
+                        parse_ladder(ladder) if ladder else BITRATE_MAP, workers=workers,
+                        indices=[rep - 1 for rep in reps],
+                        metadata=[{'scenario': scenario_tag(spec, cell, rep)} for rep in reps])
+        print(f"Simulated {len(reps)} trials for cell {cell['id']}")
+    return True
+
+def collect_browser(spec, cells, sessions, live_port=None):
+    from batch_collect import run_batch
+    from live_metrics import LiveServer
+    jobs = [{'trial': name, 'video_url': cell['video']['url'], 'trace': cell['params']['trace'],
+             'latency_ms': cell['params']['latency_ms'], 'metadata': {'scenario': scenario_tag(spec, cell, rep)}}
+            for cell in cells for rep, name in cell['pending']]
+    live_server = None
+    if live_port is not None:
+        live_server = LiveServer(live_port)
+        if not live_server.start():
+            return False
+    return asyncio.run(run_batch(jobs, sessions, spec['duration'], live_server=live_server))
+
+def scenario_table(ids=None):
+    tags = read_tags()
+    rows = [dict(tag, trial=t) for t, tag in tags.items() if tag['status'] == 'complete' and (ids is None or tag['id'] in ids)]
+    return pd.DataFrame(rows, columns=['trial', 'id', 'spec'] + DIMENSIONS + ['repetition'])
+
+def group_metrics(metrics, table, by, resamples, confidence, seed=None):
+    # one row per (group, metric): mean across the group's trials and its bootstrap CI
+    from metric_stats import confidence_intervals
+    joined = table.set_index('trial')[by].join(metrics, how='inner')
+    names = list(metrics.columns)
+    rows = []
+    for key, group in joined.groupby(by, dropna=False, sort=True):
+        key = key if isinstance(key, tuple) else (key,)
+        values = group[names].to_numpy(dtype=float)
+        low, high = confidence_intervals(values, resamples, confidence, seed)
+        counts = group[names].notna().sum()
+        means = group[names].mean()
+        for i, name in enumerate(names):
+            rows.append({**dict(zip(by, key)), 'metric': name, 'trials': int(counts[name]), 'mean': means[name],
+                         'ci_low': low[i], 'ci_high': high[i]})
+    return pd.DataFrame(rows)
+
+def varying_dimensions(table):
+    return [d for d in DIMENSIONS if table[d].nunique(dropna=False) > 1]
+
+def report(ids, by, resamples, confidence, plots=True, name='all'):
+    from metric_stats import load_trial_metrics
+    table = scenario_table(ids)
+    if table.empty:
+        print("No complete scenario trials found")
+        return False
+    by = by or varying_dimensions(table) or ['trace']
+    unknown = sorted(set(by) - set(DIMENSIONS))
+    if unknown:
+        print(f"Error: unknown dimension {', '.join(unknown)} (choose from {', '.join(DIMENSIONS)})")
+        return False
+
+    metrics = load_trial_metrics()
+    grouped = group_metrics(metrics, table, by, resamples, confidence)
+    if grouped.empty:
+        print("No metrics for the scenario trials yet (run the pipeline first)")
+        return False
+    grouped.to_csv(OUTPUT_FILE, index=False, float_format='%.6g')
+
+    overview = grouped[grouped['metric'].isin(['avg_bitrate_kbps', 'quality_switches', 'min_buffer_seconds'])]
+    overview = overview.set_index(by + ['metric'])['mean'].unstack('metric')
+    print(overview.to_string(float_format=lambda v: f'{v:.4g}'))
+    print(f"\n{len(table)} trials grouped by {', '.join(by)} -> {OUTPUT_FILE}")
+
+    if plots:
+        import matplotlib
+        matplotlib.use('Agg')
+        from plot_scenarios import plot_scenarios
+        FIGURES_DIR.mkdir(exist_ok=True)
+        filename = f"scenarios_{name}_{'_'.join(by)}.png"
+        plot_scenarios(grouped, table[table['trial'].isin(metrics.index)], by, filename)
+        print(f"Figure: {FIGURES_DIR / filename}")
+    return True
+
+def run(spec, by, workers, sessions, resamples, confidence, live_port=None, plots=True, dry_run=False):
+    cells = plan(expand_spec(spec), read_tags())
+    print_plan(cells)
+    if dry_run:
+        return True
+
+    if any(cell['pending'] for cell in cells):
+        if spec['backend'] == 'simulator':
+            collected = collect_simulated(spec, cells, workers)
+        else:
+            collected = collect_browser(spec, cells, sessions, live_port)
+        if not collected:
+            return False
+
+    # processing, validation, metrics and latency are content-hash cached, so only new trials cost anything
+    from pipeline import Pipeline
+    if not Pipeline(workers=workers, targets=['metrics', 'latency']).run():
+        return False
+    return report({cell['id'] for cell in cells}, by, resamples, confidence, plots, spec['name'])
+
+def main():
+    from metric_stats import CONFIDENCE, RESAMPLES
+    if len(sys.argv) < 2 or sys.argv[1] in ('-h', '--help'):
+        print("Usage: python scripts/scenarios.py run SPEC.json [--by DIM,...] [--workers N] [--sessions N] [--live]")
+        print("                                   [--no-plots] [--dry-run]")
+        print("       python scripts/scenarios.py report [SPEC.json] [--by DIM,...] [--resamples N] [--confidence C]")
+        print(f"       dimensions: {', '.join(DIMENSIONS)}")
+        sys.exit(0 if len(sys.argv) >= 2 else 1)
+
+    command = sys.argv[1]
+    spec_path = None
+    by = None
+    workers = os.cpu_count()
+    sessions = 2
+    resamples = RESAMPLES
+    confidence = CONFIDENCE
+    live_port = None
+    plots = True
+    dry_run = False
+
+    i = 2
+    while i < len(sys.argv):
+        if sys.argv[i] == '--by':
+            by = sys.argv[i + 1].split(',')
+            i += 2
+        elif sys.argv[i] == '--workers':
+            workers = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--sessions':
+            sessions = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--resamples':
+            resamples = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--confidence':
+            confidence = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--live':
+            live_port = live_port or LIVE_PORT
+            i += 1
+        elif sys.argv[i] == '--no-plots':
+            plots = False
+            i += 1
+        elif sys.argv[i] == '--dry-run':
+            dry_run = True
+            i += 1
+        else:
+            spec_path = sys.argv[i]
+            i += 1
+
+    spec = None
+    if spec_path is not None:
+        try:
+            spec = load_spec(spec_path)
+        except (OSError, ValueError) as e:
+            print(f"Error: cannot read spec {spec_path}: {e}")
+            sys.exit(1)
+
+    if command == 'run':
+        if spec is None:
+            print("Error: Must specify a spec file")
+            sys.exit(1)
+        ok = run(spec, by, workers, sessions, resamples, confidence, live_port, plots, dry_run)
+    elif command == 'report':
+        ids = {cell['id'] for cell in expand_spec(spec)} if spec else None
+        ok = report(ids, by, resamples, confidence, plots, spec['name'] if spec else 'all')
+    else:
+        print(f"Error: unknown command {command}")
+        sys.exit(1)
+    if not ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'collection'))
+from collector_config import *
+from network_trace import default_trace, load_trace
+from trial_writer import QUALITY_COLUMNS, BUFFER_COLUMNS, SHAPING_COLUMNS, STALL_COLUMNS
+
+RAW_DIR = Path('data/raw')
+
+SEGMENT_SECONDS = 2.0
+STARTUP_BUFFER = 4.0
+MAX_BUFFER = 30.0
+START_BITRATE_KBPS = 1200
+TRACE_STEP = 0.1
+# extra trace past the trial end, so downloads that straddle it still finish
+TRACE_TAIL = 60.0
+THROUGHPUT_NOISE = 0.15
+
+RESERVOIR = 5.0
+CUSHION = 20.0
+SAFETY = 0.8
+HISTORY = 5
+HYBRID_TARGET = 20.0
+
+BATCH_SIZE = 200
+
+def make_ladder(bitrate_map=BITRATE_MAP):
+    rungs = sorted(bitrate_map.items(), key=lambda item: item[1])
+    return {
+        'width': np.array([w for (w, h), kbps in rungs]),
+        'height': np.array([h for (w, h), kbps in rungs]),
+        'kbps': np.array([kbps for (w, h), kbps in rungs], dtype=float)
+    }
+
+def parse_ladder(text):
+    # "426x240:400,640x360:800,..."
+    bitrate_map = {}
+    for rung in text.split(','):
+        size, kbps = rung.split(':')
+        width, height = size.lower().split('x')
+        bitrate_map[(int(width), int(height))] = float(kbps)
+    return bitrate_map
+
+def rate_level(kbps, rate):
+    # highest rung the rate can sustain; the lowest rung when none fits
+    fits = kbps[None, :] <= rate[:, None]
+    return np.maximum(fits.sum(axis=1) - 1, 0)
+
+def buffer_policy(state):
+    # BBA: lowest rung inside the reservoir, then the cushion maps buffer linearly onto the ladder
+    n_levels = len(state['kbps'])
+    frac = (state['buffer'] - RESERVOIR) / CUSHION
+    return np.clip(np.floor(frac * n_levels), 0, n_levels - 1).astype(np.int64)
+
+def throughput_policy(state):
+    estimate = state['throughput']
+    chosen = rate_level(state['kbps'], np.nan_to_num(estimate) * SAFETY)
+    return np.where(np.isnan(estimate), state['level'], chosen)
+
+def hybrid_policy(state):
+    # throughput-based, more conservative on a low buffer and bolder on a full one; up one rung at a time
+    estimate = state['throughput']
+    scale = np.clip(state['buffer'] / HYBRID_TARGET, 0.5, 1.25)
+    chosen = np.minimum(rate_level(state['kbps'], np.nan_to_num(estimate) * SAFETY * scale), state['level'] + 1)
+    return np.where(np.isnan(estimate), state['level'], chosen)
+
+POLICIES = {'buffer': buffer_policy, 'throughput': throughput_policy, 'hybrid': hybrid_policy}
+
+def trace_grid(trace, duration, indices, seed, noise):
+    # per-trial bandwidth on a fine grid: the trace steps times per-second lognormal noise
+    grid = np.arange(0, duration + TRACE_TAIL, TRACE_STEP)
+    times = np.array([s['time_seconds'] for s in trace])
+    pos = np.maximum(np.searchsorted(times, grid, side='right') - 1, 0)
+    bandwidth = np.array([s['bandwidth_kbps'] for s in trace])[pos]
+    latency = np.array([s['latency_ms'] for s in trace])[pos] / 1000
+
+    seconds = (grid // 1).astype(np.int64)
+    factors = np.empty((len(indices), seconds[-1] + 1))
+    for row, index in enumerate(indices):
+        factors[row] = np.random.default_rng([seed, index]).lognormal(-noise ** 2 / 2, noise, seconds[-1] + 1)
+    # never fully zero, so cumulative capacity stays strictly increasing
+    rates = np.maximum(bandwidth[None, :] * factors[:, seconds], 1.0)
+    return grid, rates, latency
+
+def simulate_batch(indices, policy, trace, duration, seed, noise=THROUGHPUT_NOISE, ladder=None):
+    ladder = ladder or make_ladder()
+    kbps = ladder['kbps']
+    n = len(indices)
+    grid, rates, latency = trace_grid(trace, duration, indices, seed, noise)
+
+    # cumulative deliverable kbits per trial; trials are laid end to end on one axis so a single
+    # np.interp maps time -> kbits and back for every trial at once
+    capacity = np.concatenate([np.zeros((n, 1)), np.cumsum(rates[:, :-1] * TRACE_STEP, axis=1)], axis=1)
+    span_t = grid[-1] + 1.0
+    span_c = capacity[:, -1].max() + 1.0
+    offset = np.arange(n)[:, None]
+    time_axis = (offset * span_t + grid[None, :]).ravel()
+    capacity_axis = (offset * span_c + capacity).ravel()
+
+    def delivered(t):
+        return np.interp(np.arange(n) * span_t + t, time_axis, capacity_axis) - np.arange(n) * span_c
+
+    def reached(c):
+        return np.interp(np.arange(n) * span_c + c, capacity_axis, time_axis) - np.arange(n) * span_t
+
+    choose = POLICIES[policy]
+    t = np.zeros(n)
+    buffer = np.zeros(n)
+    playing = np.zeros(n, dtype=bool)
+    level = np.full(n, rate_level(kbps, np.array([START_BITRATE_KBPS]))[0])
+    history = np.full((n, HISTORY), np.nan)
+    rebuffer = np.zeros(n)
+
+    finishes, levels, buffers, states = [], [], [], []
+    active = t < duration
+    k = 0
+    while active.any():
+        # harmonic mean of the last HISTORY segment throughputs
+        samples = (~np.isnan(history)).sum(axis=1)
+        inverse = np.nansum(1 / history, axis=1)
+        estimate = np.where(samples > 0, samples / np.where(samples > 0, inverse, 1), np.nan)
+        state = {'buffer': buffer, 'throughput': estimate, 'level': level, 'kbps': kbps}
+        level = np.where(active, choose(state) if k else level, level)
+
+        size = kbps[level] * SEGMENT_SECONDS
+        rtt = latency[np.minimum((t / TRACE_STEP).astype(np.int64), len(grid) - 1)]
+        finish = reached(delivered(t + rtt) + size)
+        download = finish - t
+
+        # the buffer drains while the segment downloads; running dry is a stall
+        rebuffer += np.where(active & playing, np.maximum(download - buffer, 0), 0)
+        buffer = np.where(active, np.where(playing, np.maximum(buffer - download, 0), buffer) + SEGMENT_SECONDS, buffer)
+        playing |= buffer >= STARTUP_BUFFER
+        history[:, k % HISTORY] = np.where(active, size / download, history[:, k % HISTORY])
+
+        finishes.append(np.where(active, finish, np.inf))
+        levels.append(level.copy())
+        buffers.append(buffer.copy())
+        states.append(playing.copy())
+
+        # a full buffer pauses downloading until it drains back to the cap
+        wait = np.where(active & playing, np.maximum(buffer - MAX_BUFFER, 0), 0)
+        buffer = buffer - wait
+        t = np.where(active, finish + wait, t)
+        active &= t < duration
+        k += 1
+
+    return {
+        'finish': np.stack(finishes, axis=1), 'level': np.stack(levels, axis=1),
+        'buffer': np.stack(buffers, axis=1), 'playing': np.stack(states, axis=1),
+        'rebuffer': rebuffer, 'ladder': ladder
+    }
+
+def sample_trial(result, row, duration, interval=SAMPLER_INTERVAL_MS / 1000):
+    # player state as the page sampler would see it: rendition on screen and buffer ahead of the playhead
+    finish = result['finish'][row]
+    finish = finish[np.isfinite(finish)]
+    times = np.round(np.arange(0, duration + interval / 2, interval), 3)
+    idx = np.searchsorted(finish, times, side='right') - 1
+    seg = np.maximum(idx, 0)
+
+    after = result['buffer'][row][seg]
+    since = times - finish[seg]
+    buffer = np.where(idx < 0, 0.0, np.where(result['playing'][row][seg], np.maximum(after - since, 0), after))
+    # playback position is what was downloaded minus what is still buffered
+    position = np.where(idx < 0, 0.0, (idx + 1) * SEGMENT_SECONDS - buffer)
+    shown = np.minimum((position // SEGMENT_SECONDS).astype(np.int64), seg)
+    return times, result['level'][row][shown], buffer
+
+def recorder_rows(times, level, buffer, ladder):
+    # the same events TrialRecorder.handle_sample keeps: rendition changes, new buffer milestones, periodic rows
+    changed = np.concatenate([[True], level[1:] != level[:-1]])
+    milestone = (buffer // 5 * 5).astype(np.int64)
+    reached = np.concatenate([[-1], np.maximum.accumulate(milestone)[:-1]])
+    new_milestone = (milestone > reached) & np.isin(milestone, BUFFER_MILESTONES)
+    slot = (times // MIN_EVENT_SPACING).astype(np.int64)
+    # like the collected trials, both logs open with a startup row at t=0
+    periodic = np.concatenate([[True], slot[1:] != slot[:-1]])
+    notes = np.where(times == 0, 'startup', 'periodic')
+
+    quality_rows = []
+    for i in np.flatnonzero(changed | periodic):
+        note = 'quality_change' if changed[i] and i else notes[i]
+        lv = level[i]
+        quality_rows.append([round(float(times[i]), 1), int(ladder['width'][lv]), int(ladder['height'][lv]),
+                             int(ladder['kbps'][lv]), note])
+
+    buffer_rows = []
+    for i in np.flatnonzero(new_milestone | periodic):
+        note = 'buffer_milestone' if new_milestone[i] else notes[i]
+        buffer_rows.append([round(float(times[i]), 1), round(float(buffer[i]), 1), note])
+    return quality_rows, buffer_rows
+
+def stall_rows(result, row, duration):
+    # once playing, the player stalls when the buffer left after one download runs out before the next lands
+    finish = result['finish'][row]
+    valid = np.isfinite(finish)
+    finish, after, playing = finish[valid], result['buffer'][row][valid], result['playing'][row][valid]
+    start = finish[:-1] + after[:-1]
+    end = finish[1:]
+    stalled = playing[:-1] & (start < end - 1e-9) & (start < duration)
+    return [[round(float(a), 2), round(float(min(b, duration)), 2), 'waiting', '']
+            for a, b in zip(start[stalled], end[stalled])]
+
+def shaping_rows(trace, duration):
+    return [[s['time_seconds'], s['time_seconds'], s['bandwidth_kbps'], s['latency_ms'], 0.0]
+            for s in trace if s['time_seconds'] < duration]
+
+def write_trial(out_dir, trial_num, quality_rows, buffer_rows, trace_rows, metadata, stall_log=None):
+    trial_dir = out_dir / f'trial_{trial_num}'
+    trial_dir.mkdir(parents=True, exist_ok=True)
+    files = {'quality': 'quality_timeline.csv', 'buffer': 'buffer_timeline.csv', 'shaping': 'shaping_timeline.csv'}
+    tables = {'quality': (QUALITY_COLUMNS, quality_rows), 'buffer': (BUFFER_COLUMNS, buffer_rows),
+              'shaping': (SHAPING_COLUMNS, trace_rows)}
+    if stall_log is not None:
+        files['stalls'] = 'stall_timeline.csv'
+        tables['stalls'] = (STALL_COLUMNS, stall_log)
+    for name, (columns, rows) in tables.items():
+        with (trial_dir / files[name]).open('w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(rows)
+
+    now = datetime.now().isoformat(timespec='seconds')
+    manifest = {
+        'trial': trial_num,
+        'status': 'complete',
+        'started_at': now,
+        'updated_at': now,
+        'last_time_seconds': max(quality_rows[-1][0], buffer_rows[-1][0] if buffer_rows else 0),
+        'rows': {name: len(rows) for name, (columns, rows) in tables.items()},
+        'files': files,
+        'segments': [{'started_at': now, 'offset_seconds': 0}],
+        **metadata
+    }
+    with (trial_dir / 'trial_manifest.json').open('w') as f:
+        json.dump(manifest, f, indent=2)
+
+def run_batch(job):
+    trial_nums, indices, policy, trace, trace_name, duration, seed, noise, bitrate_map, out_dir, extra = job
+    ladder = make_ladder(bitrate_map)
+    result = simulate_batch(indices, policy, trace, duration, seed, noise, ladder)
+    trace_rows = shaping_rows(trace, duration)
+
+    summary = []
+    for row, trial_num in enumerate(trial_nums):
+        times, level, buffer = sample_trial(result, row, duration)
+        quality_rows, buffer_rows = recorder_rows(times, level, buffer, ladder)
+        metadata = {'duration': duration, 'source': 'simulator', 'policy': policy, 'seed': seed,
+                    'noise': noise, 'trace': trace_name, 'rebuffer_seconds': round(float(result['rebuffer'][row]), 3),
+                    **extra[row]}
+        write_trial(Path(out_dir), trial_num, quality_rows, buffer_rows, trace_rows, metadata,
+                    stall_rows(result, row, duration))
+        summary.append((float(ladder['kbps'][level].mean()), float(result['rebuffer'][row])))
+    return summary
+
+def simulate_trials(trial_nums, policy='hybrid', trace=None, trace_name='default', duration=TOTAL_DURATION,
+                    seed=0, noise=THROUGHPUT_NOISE, bitrate_map=BITRATE_MAP, out_dir=RAW_DIR,
+                    workers=os.cpu_count(), batch_size=BATCH_SIZE, indices=None, metadata=None):
+    if policy not in POLICIES:
+        raise ValueError(f"policy must be one of {sorted(POLICIES)}, got {policy!r}")
+    trace = trace or default_trace()
+    # noise is seeded by trial position (or the given indices), so results do not depend on batching or worker count
+    indices = list(indices) if indices is not None else list(range(len(trial_nums)))
+    # extra manifest fields per trial, e.g. the scenario a sweep simulates it for
+    metadata = list(metadata) if metadata is not None else [{}] * len(trial_nums)
+    jobs = []
+    for start in range(0, len(trial_nums), batch_size):
+        batch = trial_nums[start:start + batch_size]
+        jobs.append((batch, indices[start:start + len(batch)], policy, trace, trace_name, duration, seed, noise,
+                     bitrate_map, str(out_dir), metadata[start:start + len(batch)]))
+
+    workers = max(1, min(workers or 1, len(jobs)))
+    if workers == 1:
+        results = [run_batch(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run_batch, jobs))
+    return [s for batch in results for s in batch]
+
+def main():
+    count = 1
+    first = 1
+    prefix = 'sim'
+    policy = 'hybrid'
+    trace = None
+    trace_name = 'default'
+    duration = TOTAL_DURATION
+    seed = 0
+    noise = THROUGHPUT_NOISE
+    bitrate_map = BITRATE_MAP
+    out_dir = RAW_DIR
+    workers = os.cpu_count()
+
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+        if arg == '--trials':
+            count = int(sys.argv[i + 1])
+        elif arg == '--first':
+            first = int(sys.argv[i + 1])
+        elif arg == '--prefix':
+            prefix = sys.argv[i + 1]
+        elif arg == '--policy':
+            policy = sys.argv[i + 1]
+        elif arg == '--trace':
+            trace_name = sys.argv[i + 1]
+            trace = load_trace(trace_name)
+        elif arg == '--duration':
+            duration = float(sys.argv[i + 1])
+        elif arg == '--seed':
+            seed = int(sys.argv[i + 1])
+        elif arg == '--noise':
+            noise = float(sys.argv[i + 1])
+        elif arg == '--ladder':
+            bitrate_map = parse_ladder(sys.argv[i + 1])
+        elif arg == '--out':
+            out_dir = Path(sys.argv[i + 1])
+        elif arg == '--workers':
+            workers = int(sys.argv[i + 1])
+        else:
+            print("Usage: python abr_simulator.py [--trials N] [--first N] [--prefix sim] "
+                  f"[--policy {'|'.join(POLICIES)}] [--trace FILE] [--duration S] [--seed N] [--noise SIGMA] "
+                  "[--ladder 426x240:400,...] [--out DIR] [--workers N]")
+            sys.exit(1)
+        i += 2
+
+    if policy not in POLICIES:
+        print(f"Unknown policy: {policy} (choose from {', '.join(POLICIES)})")
+        sys.exit(1)
+
+    trial_nums = [f'{prefix}{n:04d}' for n in range(first, first + count)]
+    start = time.monotonic()
+    summary = simulate_trials(trial_nums, policy, trace, trace_name, duration, seed, noise, bitrate_map,
+                              out_dir, workers)
+    elapsed = time.monotonic() - start
+
+    bitrates = np.array([s[0] for s in summary])
+    rebuffer = np.array([s[1] for s in summary])
+    print(f"Simulated {len(summary)} trials ({policy}) in {elapsed:.1f}s -> {out_dir}/trial_{trial_nums[0]}..")
+    print(f"  mean bitrate {bitrates.mean():.0f} kbps, rebuffering in {np.mean(rebuffer > 0) * 100:.1f}% of trials "
+          f"(mean {rebuffer.mean():.2f}s)")
+
+if __name__ == "__main__":
+    main()
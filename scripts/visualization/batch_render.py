@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import matplotlib
+matplotlib.use('Agg')
+
+from plot_config import *
+from downsample import downsample_line, downsample_step, pixel_width
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'analysis'))
+from trial_store import list_trials, load_trial, source_path
+
+FIGURES_DIR = Path('figures')
+PREVIEW_DIR = FIGURES_DIR / 'preview'
+MANIFEST_NAME = '.render_manifest.json'
+TIMELINE_COLUMNS = ['time_seconds', 'bitrate_kbps', 'buffer_seconds', 'network_phase']
+CODE_FILES = [Path(__file__).resolve()] + [Path(__file__).resolve().parent / f for f in ('plot_config.py', 'downsample.py')]
+
+class TimelineTemplate:
+    # one figure per worker; each trial only swaps line data, marker positions and the title
+    def __init__(self):
+        import matplotlib.pyplot as plt
+        apply_style()
+        self.fig, (self.ax_bitrate, self.ax_buffer) = plt.subplots(2, 1, figsize=FIGURE_SIZE, sharex=True)
+        self.bitrate_line, = self.ax_bitrate.plot([], [], linewidth=2, color=COLORS['quality'])
+        self.buffer_line, = self.ax_buffer.plot([], [], linewidth=2, color=COLORS['buffer'])
+        self.markers = []
+
+        self.ax_bitrate.set_ylabel('Bitrate (Mbps)')
+        self.title = self.ax_bitrate.set_title('')
+        self.ax_buffer.set_ylabel('Buffer (seconds)')
+        self.ax_buffer.set_xlabel('Time (seconds)')
+        for ax in (self.ax_bitrate, self.ax_buffer):
+            ax.grid(True, alpha=0.3)
+        format_time_axis(self.ax_buffer)
+
+    def set_markers(self, boundaries):
+        while len(self.markers) < len(boundaries):
+            self.markers.append([ax.axvline(x=0, linestyle='--', alpha=0.6) for ax in (self.ax_bitrate, self.ax_buffer)])
+        for i, pair in enumerate(self.markers):
+            for line in pair:
+                if i < len(boundaries):
+                    x, color = boundaries[i]
+                    line.set_xdata([x, x])
+                    line.set_color(color)
+                    line.set_visible(True)
+                else:
+                    line.set_visible(False)
+
+    def update(self, trial_num, df, dpi=DPI):
+        times = df['time_seconds'].to_numpy(dtype=float)
+        bitrate = df['bitrate_kbps'].to_numpy(dtype=float, na_value=float('nan')) / 1000
+        buffer = df['buffer_seconds'].to_numpy(dtype=float, na_value=float('nan'))
+        self.bitrate_line.set_data(*downsample_step(times, bitrate, pixel_width(self.ax_bitrate, dpi)))
+        self.buffer_line.set_data(*downsample_line(times, buffer, pixel_width(self.ax_buffer, dpi)))
+        self.set_markers(trial_phase_boundaries(df))
+        self.title.set_text(f'Trial {trial_num}: Quality and Buffer')
+        for ax in (self.ax_bitrate, self.ax_buffer):
+            ax.relim(visible_only=True)
+            ax.autoscale_view()
+
+    def save(self, path, dpi):
+        self.fig.tight_layout()
+        self.fig.savefig(path, dpi=dpi, bbox_inches='tight')
+
+template = None
+
+def render_chunk(jobs, frames=None):
+    # runs inside a worker; the template is built on the first chunk and reused afterwards
+    global template
+    if template is None:
+        template = TimelineTemplate()
+    rendered = []
+    for trial_num, path, dpi in jobs:
+        df = frames[trial_num] if frames is not None else load_trial(trial_num, 'processed', TIMELINE_COLUMNS)
+        if df is None:
+            continue
+        template.update(trial_num, df, dpi)
+        template.save(path, dpi)
+        rendered.append(trial_num)
+    return rendered
+
+def digest(path, memo):
+    # content hash, reused while the file's size and mtime are unchanged
+    stat = path.stat()
+    cached = memo.get(str(path))
+    if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+        return cached[2]
+    value = hashlib.sha256(path.read_bytes()).hexdigest()
+    memo[str(path)] = [stat.st_size, stat.st_mtime_ns, value]
+    return value
+
+def load_manifest(out_dir):
+    path = out_dir / MANIFEST_NAME
+    if path.exists():
+        with path.open() as f:
+            return json.load(f)
+    return {'figures': {}, 'inputs': {}}
+
+def save_manifest(out_dir, manifest):
+    path = out_dir / MANIFEST_NAME
+    tmp = path.with_suffix('.tmp')
+    with tmp.open('w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+def render_timelines(trial_nums, workers=os.cpu_count(), dpi=DPI, fmt='png', out_dir=FIGURES_DIR, force=False,
+                     timeline=None):
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(out_dir)
+    code_key = ''.join(digest(p, manifest['inputs']) for p in CODE_FILES)
+
+    jobs = []
+    keys = {}
+    for trial_num in trial_nums:
+        source = source_path(trial_num, 'processed')
+        if not source.exists():
+            continue
+        name = f'trial_{trial_num}_timeline.{fmt}'
+        key = hashlib.sha256(f'{code_key}|{dpi}|{fmt}|{digest(source, manifest["inputs"])}'.encode()).hexdigest()
+        if not force and manifest['figures'].get(name) == key and (out_dir / name).exists():
+            continue
+        jobs.append((trial_num, str(out_dir / name), dpi))
+        keys[trial_num] = (name, key)
+
+    workers = max(1, min(workers or 1, len(jobs)))
+    # a few chunks per worker keeps the pool balanced without losing template reuse
+    size = max(1, -(-len(jobs) // (workers * 4)))
+    chunks = [jobs[i:i + size] for i in range(0, len(jobs), size)]
+    if workers == 1:
+        # in-process rendering can draw straight from an already loaded (trial x time) frame
+        frames = None
+        if timeline is not None:
+            frames = {str(t): df for t, df in timeline.groupby('trial', observed=True, sort=False)}
+        results = [render_chunk(chunk, frames) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(render_chunk, chunks))
+
+    rendered = [t for chunk in results for t in chunk]
+    for trial_num in rendered:
+        name, key = keys[trial_num]
+        manifest['figures'][name] = key
+    save_manifest(out_dir, manifest)
+    return rendered, len(trial_nums) - len(jobs)
+
+def main():
+    trial_nums = []
+    workers = os.cpu_count()
+    dpi = DPI
+    fmt = 'png'
+    out_dir = FIGURES_DIR
+    force = False
+
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '--all':
+            trial_nums = list_trials('processed')
+            i += 1
+        elif sys.argv[i] == '--workers':
+            workers = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--preview':
+            dpi = PREVIEW_DPI
+            out_dir = PREVIEW_DIR
+            i += 1
+        elif sys.argv[i] == '--dpi':
+            dpi = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--format':
+            fmt = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--out':
+            out_dir = Path(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--force':
+            force = True
+            i += 1
+        else:
+            trial_nums.append(sys.argv[i])
+            i += 1
+
+    if not trial_nums:
+        print("Usage: python batch_render.py XXX [YYY ...] | --all [--workers N] [--preview] [--dpi N] "
+              "[--format png|svg|pdf] [--out DIR] [--force]")
+        sys.exit(1)
+
+    start = time.monotonic()
+    rendered, skipped = render_timelines(trial_nums, workers, dpi, fmt, out_dir, force)
+    print(f"Rendered {len(rendered)} timelines, {skipped} unchanged, in {time.monotonic() - start:.1f}s ({out_dir})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import numpy as np
+
+def pixel_width(ax, dpi=None):
+    # about one point per horizontal pixel of the saved image; more than that is invisible once rasterised
+    scale = dpi / ax.figure.dpi if dpi else 1.0
+    return max(3, int(ax.bbox.width * scale))
+
+def lttb(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: per bucket keep the point spanning the largest triangle with the
+    # previously kept point and the next bucket's centroid, which preserves peaks and troughs
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[edges[i + 1]:edges[i + 2]].mean()
+            next_y = y[edges[i + 1]:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[n - 1], y[n - 1]
+        area = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+def step_minmax(y, n_out):
+    # cut the series into n_out buckets of consecutive samples and keep each bucket's first, last, min and max:
+    # every level a step series visits inside a pixel column survives, so no switch disappears, while the
+    # output stays at most 4 points per column however long the trial is; a NaN run keeps its first sample
+    # so gaps stay gaps
+    n = len(y)
+    if n_out >= n or n_out < 1:
+        return np.arange(n)
+
+    size = -(-n // n_out)
+    buckets = -(-n // size)
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(buckets, size)
+    missing = np.isnan(padded)
+    missing[-1, n - (buckets - 1) * size:] = False
+
+    starts = np.arange(buckets) * size
+    keep = np.concatenate((
+        starts,
+        np.minimum(starts + size, n) - 1,
+        starts + np.argmin(np.where(np.isnan(padded), np.inf, padded), axis=1),
+        starts + np.argmax(np.where(np.isnan(padded), -np.inf, padded), axis=1),
+        (starts + np.argmax(missing, axis=1))[missing.any(axis=1)]
+    ))
+    return np.unique(keep)
+
+def downsample_line(x, y, n_out):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # gaps stay gaps in matplotlib, but LTTB needs finite values to measure areas
+    finite = np.isfinite(y)
+    if not finite.all():
+        x, y = x[finite], y[finite]
+    keep = lttb(x, y, n_out)
+    return x[keep], y[keep]
+
+def downsample_step(x, y, n_out):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    keep = step_minmax(y, n_out)
+    return x[keep], y[keep]
@@ -0,0 +1,46 @@
+import matplotlib.pyplot as plt
+import sys
+from pathlib import Path
+from plot_config import *
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'analysis'))
+from aggregate import compute_bands, load_matrix, phase_boundaries
+
+def draw_bands(ax, bands, name, scale, color):
+    times = bands['time_seconds']
+    ax.fill_between(times, bands[f'{name}_p5'] / scale, bands[f'{name}_p95'] / scale,
+                    color=color, alpha=0.15, linewidth=0, label='p5-p95')
+    ax.fill_between(times, bands[f'{name}_p25'] / scale, bands[f'{name}_p75'] / scale,
+                    color=color, alpha=0.3, linewidth=0, label='p25-p75')
+    ax.plot(times, bands[f'{name}_p50'] / scale, color=color, linewidth=2, label='median')
+    ax.plot(times, bands[f'{name}_mean'] / scale, color=color, linewidth=1, linestyle='--', label='mean')
+
+def plot_bands(trial_nums=None, rebuild=False, timeline=None):
+    apply_style()
+    matrix = load_matrix(trial_nums, rebuild, timeline)
+    bands = compute_bands(matrix)
+
+    fig, axes = plt.subplots(2, 1, figsize=FIGURE_SIZE, sharex=True)
+    draw_bands(axes[0], bands, 'bitrate_kbps', 1000, COLORS['quality'])
+    axes[0].set_ylabel('Bitrate (Mbps)')
+    axes[0].set_title(f"Bitrate and Buffer Across {len(matrix['trials'])} Trials")
+    axes[0].legend(loc='upper right')
+
+    draw_bands(axes[1], bands, 'buffer_seconds', 1, COLORS['buffer'])
+    axes[1].set_ylabel('Buffer (seconds)')
+    axes[1].set_xlabel('Time (seconds)')
+
+    for time_seconds, phase in phase_boundaries(matrix):
+        color = COLORS['phase_marker'] if phase.endswith('_low') else COLORS['recovery']
+        for ax in axes:
+            ax.axvline(x=time_seconds, color=color, linestyle='--', alpha=0.6)
+    for ax in axes:
+        ax.grid(True, alpha=0.3)
+
+    format_time_axis(axes[1])
+    save_figure(fig, 'bitrate_buffer_bands.png')
+    plt.close()
+
+if __name__ == "__main__":
+    Path('figures').mkdir(exist_ok=True)
+    plot_bands([a for a in sys.argv[1:] if not a.startswith('--')] or None, '--rebuild' in sys.argv)
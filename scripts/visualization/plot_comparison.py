@@ -1,10 +1,17 @@
+import sys
 import pandas as pd
 import matplotlib.pyplot as plt
 from pathlib import Path
 from plot_config import *
+from downsample import downsample_step, pixel_width
 
-def plot_metrics_comparison():
-    df = pd.read_csv('data/processed/metrics_summary.csv')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'analysis'))
+from trial_store import list_trials, load_trial
+
+def plot_metrics_comparison(df=None):
+    apply_style()
+    if df is None:
+        df = pd.read_csv('data/processed/metrics_summary.csv')
 
     fig, axes = plt.subplots(2, 2, figsize=(14, 10))
 
@@ -43,24 +50,25 @@ def plot_metrics_comparison():
     save_figure(fig, 'metrics_comparison.png')
     plt.close()
 
-def plot_bitrate_overlay():
-    proc_dir = Path('data/processed')
-    # get trial directories
-    trial_dirs = []
-    for d in proc_dir.iterdir():
-        if d.is_dir() and d.name.startswith('trial_'):
-            trial_dirs.append(d)
-    trial_dirs = sorted(trial_dirs)
-
+def plot_bitrate_overlay(timeline=None, trial_nums=None):
+    apply_style()
     fig, ax = plt.subplots(figsize=FIGURE_SIZE_WIDE)
 
-    for trial_dir in trial_dirs:
-        trial_num = trial_dir.name.split('_')[1]
-        df = pd.read_csv(trial_dir / 'unified_timeline.csv')
-        ax.plot(df['time_seconds'], df['bitrate_kbps'] / 1000, label=f'Trial {trial_num}', linewidth=2, alpha=0.7)
+    if timeline is None:
+        trials = ((t, load_trial(t, 'processed', ['time_seconds', 'bitrate_kbps', 'network_phase']))
+                  for t in (trial_nums or list_trials('processed')))
+    else:
+        trials = timeline.groupby('trial', observed=True, sort=False)
+    # trials on different traces (or of different lengths) change phase at different times; one marker per
+    # distinct boundary
+    boundaries = set()
+    for trial_num, df in trials:
+        boundaries.update(trial_phase_boundaries(df))
+        times, bitrate = downsample_step(df['time_seconds'], df['bitrate_kbps'].astype(float) / 1000,
+                                         pixel_width(ax, DPI))
+        ax.plot(times, bitrate, label=f'Trial {trial_num}', linewidth=2, alpha=0.7)
 
-    ax.axvline(x=45, color='red', linestyle='--', alpha=0.5)
-    ax.axvline(x=90, color='green', linestyle='--', alpha=0.5)
+    draw_phase_markers(ax, sorted(boundaries), alpha=0.5)
     ax.set_xlabel('Time (seconds)')
     ax.set_ylabel('Bitrate (Mbps)')
     ax.set_title('Bitrate Comparison')
@@ -1,16 +1,38 @@
-import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
 
-plt.style.use('seaborn-v0_8-whitegrid')
-
 COLORS = {'network': 'blue', 'quality': 'purple', 'buffer': 'orange', 'phase_marker': 'red', 'recovery': 'green'}
 FIGURE_SIZE = (14, 8)
 FIGURE_SIZE_WIDE = (16, 6)
 DPI = 300
+PREVIEW_DPI = 72
+STYLE = 'seaborn-v0_8-whitegrid'
+
+style_applied = False
+
+def apply_style():
+    # deferred until something is actually drawn, and done once per process
+    global style_applied
+    if not style_applied:
+        import matplotlib.pyplot as plt
+        plt.style.use(STYLE)
+        style_applied = True
 
-def save_figure(fig, filename):
+def save_figure(fig, filename, dpi=DPI, out_dir='figures'):
     fig.tight_layout()
-    fig.savefig(f'figures/{filename}', dpi=DPI, bbox_inches='tight')
+    fig.savefig(f'{out_dir}/{filename}', dpi=dpi, bbox_inches='tight')
 
 def format_time_axis(ax):
     ax.xaxis.set_major_formatter(ticker.FuncFormatter(lambda v, _: f'{int(v//60)}:{int(v%60):02d}'))
+
+def trial_phase_boundaries(df):
+    # a marker wherever a trial's network_phase label changes; drops to a *_low phase use the degradation colour
+    if 'network_phase' not in df.columns or df.empty:
+        return []
+    phase = df['network_phase'].astype(str).to_numpy()
+    changes = (phase[1:] != phase[:-1]).nonzero()[0] + 1
+    times = df['time_seconds'].to_numpy()
+    return [(times[i], COLORS['phase_marker'] if phase[i].endswith('_low') else COLORS['recovery']) for i in changes]
+
+def draw_phase_markers(ax, boundaries, alpha=0.6):
+    for x, color in boundaries:
+        ax.axvline(x=x, color=color, linestyle='--', alpha=alpha)
@@ -0,0 +1,62 @@
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import sys
+from pathlib import Path
+from plot_config import *
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'analysis'))
+from aggregate import SERIES, build_matrix, compute_bands
+
+PANELS = [('avg_bitrate_kbps', 'Average Bitrate (kbps)'), ('quality_switches', 'Quality Switches'),
+          ('min_buffer_seconds', 'Minimum Buffer (seconds)'), ('drop_first_switch_seconds', 'Reaction to Drop (seconds)')]
+
+def group_label(row, by):
+    return ', '.join(f"{Path(str(row[d])).name if d == 'trace' else row[d]}" for d in by)
+
+def plot_scenarios(grouped, table, by, filename):
+    # top: mean bitrate over time per group with its p25-p75 band; bottom: group means with bootstrap CIs
+    apply_style()
+    fig = plt.figure(figsize=FIGURE_SIZE)
+    grid = fig.add_gridspec(2, len(PANELS))
+    top = fig.add_subplot(grid[0, :])
+
+    # the matrix is built for these trials only, so the cross-trial cache used by plot_bands is left alone
+    matrix = build_matrix(sorted(table['trial']))
+    # one number per group across both frames, so a bar takes its group's colour even when groups before it
+    # have no bar for that metric
+    ids = pd.concat([table[by], grouped[by]], ignore_index=True).groupby(by, dropna=False, sort=True).ngroup()
+    table = table.assign(group_id=ids.iloc[:len(table)].to_numpy())
+    grouped = grouped.assign(group_id=ids.iloc[len(table):].to_numpy())
+    colors = plt.cm.tab10(np.arange(ids.max() + 1) % 10)
+    for _, members in table.groupby('group_id', sort=True):
+        color = colors[members['group_id'].iloc[0]]
+        rows = np.isin(matrix['trials'], members['trial'].to_numpy())
+        bands = compute_bands({**matrix, **{name: matrix[name][rows] for name in SERIES}})
+        label = group_label(members.iloc[0], by)
+        top.fill_between(bands['time_seconds'], bands['bitrate_kbps_p25'] / 1000, bands['bitrate_kbps_p75'] / 1000,
+                         color=color, alpha=0.15, linewidth=0)
+        top.plot(bands['time_seconds'], bands['bitrate_kbps_mean'] / 1000, color=color, linewidth=2,
+                 label=f"{label} ({rows.sum()})")
+    top.set_ylabel('Bitrate (Mbps)')
+    top.set_title(f"Mean Bitrate by {', '.join(by)}")
+    top.legend(loc='lower right', fontsize=8)
+    top.grid(True, alpha=0.3)
+    format_time_axis(top)
+
+    for i, (metric, title) in enumerate(PANELS):
+        ax = fig.add_subplot(grid[1, i])
+        rows = grouped[grouped['metric'] == metric]
+        if rows.empty:
+            ax.set_visible(False)
+            continue
+        labels = [group_label(row, by) for _, row in rows.iterrows()]
+        err = np.vstack([rows['mean'] - rows['ci_low'], rows['ci_high'] - rows['mean']])
+        ax.bar(range(len(rows)), rows['mean'], yerr=np.nan_to_num(err), color=colors[rows['group_id'].to_numpy()], capsize=4)
+        ax.set_xticks(range(len(rows)))
+        ax.set_xticklabels(labels, rotation=30, ha='right', fontsize=8)
+        ax.set_title(title)
+        ax.grid(True, alpha=0.3)
+
+    save_figure(fig, filename)
+    plt.close()
@@ -1,26 +1,32 @@
-import pandas as pd
 import matplotlib.pyplot as plt
 import sys
 from pathlib import Path
 from plot_config import *
+from downsample import downsample_line, downsample_step, pixel_width
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'analysis'))
+from trial_store import load_trial
 
 def plot_trial_timeline(trial_num):
-    df = pd.read_csv(f'data/processed/trial_{trial_num}/unified_timeline.csv')
+    apply_style()
+    df = load_trial(trial_num, 'processed', ['time_seconds', 'bitrate_kbps', 'buffer_seconds', 'network_phase'])
 
     fig, axes = plt.subplots(2, 1, figsize=FIGURE_SIZE, sharex=True)
 
     ax1 = axes[0]
-    ax1.plot(df['time_seconds'], df['bitrate_kbps'] / 1000, linewidth=2, color=COLORS['quality'])
-    ax1.axvline(x=45, color=COLORS['phase_marker'], linestyle='--', alpha=0.6)
-    ax1.axvline(x=90, color=COLORS['recovery'], linestyle='--', alpha=0.6)
+    times, bitrate = downsample_step(df['time_seconds'], df['bitrate_kbps'].astype(float) / 1000,
+                                     pixel_width(ax1, DPI))
+    ax1.plot(times, bitrate, linewidth=2, color=COLORS['quality'])
+    boundaries = trial_phase_boundaries(df)
+    draw_phase_markers(ax1, boundaries)
     ax1.set_ylabel('Bitrate (Mbps)')
     ax1.set_title(f'Trial {trial_num}: Quality and Buffer')
     ax1.grid(True, alpha=0.3)
 
     ax2 = axes[1]
-    ax2.plot(df['time_seconds'], df['buffer_seconds'], linewidth=2, color=COLORS['buffer'])
-    ax2.axvline(x=45, color=COLORS['phase_marker'], linestyle='--', alpha=0.6)
-    ax2.axvline(x=90, color=COLORS['recovery'], linestyle='--', alpha=0.6)
+    times, buffer = downsample_line(df['time_seconds'], df['buffer_seconds'], pixel_width(ax2, DPI))
+    ax2.plot(times, buffer, linewidth=2, color=COLORS['buffer'])
+    draw_phase_markers(ax2, boundaries)
     ax2.set_ylabel('Buffer (seconds)')
     ax2.set_xlabel('Time (seconds)')
     ax2.grid(True, alpha=0.3)